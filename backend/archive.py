@@ -0,0 +1,340 @@
+"""Streaming ZIP archives of stored files.
+
+``ZipWriter`` produces a ZIP (ZIP64 where sizes or offsets need it) one piece
+at a time: every member is written with a data descriptor, so nothing has to
+be known up front except the uncompressed size recorded in the file metadata,
+and the archive never touches disk. Content that is already compressed
+(archives, images, audio, video, OOXML documents) is stored rather than
+deflated.
+
+``stream_archive`` drives the writer from object storage: the next ``read_ahead``
+objects are opened while the current one streams, each body is read a chunk
+at a time on the storage executor (compression included), and memory stays
+bounded by ``read_ahead`` open responses plus one chunk, whatever the size of
+the archive. Only the central directory grows, by one record per member.
+"""
+import asyncio
+import logging
+import os
+import struct
+import zlib
+from collections import deque
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, NamedTuple, Optional, Set
+from storage import run_storage_io
+
+logger = logging.getLogger(__name__)
+
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+# Worst-case deflate expansion is a few bytes per 16 KiB block; leave room
+ZIP64_MEMBER_THRESHOLD = ZIP64_LIMIT - (16 << 20)
+
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_OF_CENTRAL_DIR = struct.Struct("<IHHHHIIH")
+_ZIP64_END_OF_CENTRAL_DIR = struct.Struct("<IQHHIIQQQQ")
+_ZIP64_LOCATOR = struct.Struct("<IIQI")
+
+_FLAGS = 0x0808  # sizes and CRC follow in a data descriptor; UTF-8 names
+_STORED, _DEFLATED = 0, 8
+_VERSION_ZIP64, _VERSION_DEFAULT = 45, 20
+_VERSION_MADE_BY = (3 << 8) | _VERSION_ZIP64  # Unix
+
+COMPRESSED_TYPES = {
+    "application/zip", "application/gzip", "application/x-gzip", "application/x-7z-compressed",
+    "application/x-bzip2", "application/x-xz", "application/x-rar-compressed",
+    "application/vnd.rar", "application/zstd", "application/pdf",
+}
+COMPRESSED_TYPE_PREFIXES = ("image/", "video/", "audio/")
+UNCOMPRESSED_IMAGE_TYPES = {"image/svg+xml", "image/bmp", "image/tiff", "image/x-icon"}
+COMPRESSED_EXTENSIONS = {
+    "zip", "gz", "tgz", "bz2", "xz", "7z", "rar", "zst",
+    "jpg", "jpeg", "png", "gif", "webp", "heic", "avif",
+    "mp4", "mov", "mkv", "webm", "avi", "mp3", "aac", "ogg", "flac", "m4a",
+    "docx", "xlsx", "pptx", "odt", "ods", "odp", "epub", "jar", "apk",
+}
+
+
+def should_compress(name: str, content_type: Optional[str]) -> bool:
+    """Deflate only content that isn't compressed already"""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in COMPRESSED_TYPES:
+        return False
+    if content_type.startswith(COMPRESSED_TYPE_PREFIXES) and content_type not in UNCOMPRESSED_IMAGE_TYPES:
+        return False
+    extension = os.path.splitext(name)[1].lstrip(".").lower()
+    return extension not in COMPRESSED_EXTENSIONS
+
+
+def _dos_datetime(moment: Optional[datetime]):
+    moment = moment or datetime(1980, 1, 1)
+    if moment.year < 1980:
+        moment = datetime(1980, 1, 1)
+    time = (moment.hour << 11) | (moment.minute << 5) | (moment.second // 2)
+    date = ((moment.year - 1980) << 9) | (moment.month << 5) | moment.day
+    return time, date
+
+
+class ZipMember(NamedTuple):
+    name: str
+    size: int
+    modified: Optional[datetime] = None
+    compress: bool = True
+    is_dir: bool = False
+
+
+class ZipWriter:
+    """Incremental ZIP writer; each method returns the bytes to emit next"""
+
+    def __init__(self, compression_level: int = 6):
+        self.compression_level = compression_level
+        self.offset = 0
+        self._central: List[bytes] = []
+        self._member: Optional[ZipMember] = None
+
+    def _emit(self, data: bytes) -> bytes:
+        self.offset += len(data)
+        return data
+
+    def begin(self, member: ZipMember) -> bytes:
+        self._member = member
+        self._zip64 = member.size >= ZIP64_MEMBER_THRESHOLD
+        self._method = _DEFLATED if member.compress and not member.is_dir else _STORED
+        self._compressor = (
+            zlib.compressobj(self.compression_level, zlib.DEFLATED, -15)
+            if self._method == _DEFLATED else None
+        )
+        self._header_offset = self.offset
+        self._crc = 0
+        self._compressed_size = 0
+        self._size = 0
+        self._name = member.name.encode("utf-8")
+        self._time, self._date = _dos_datetime(member.modified)
+
+        extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0) if self._zip64 else b""
+        placeholder = ZIP64_LIMIT if self._zip64 else 0
+        header = _LOCAL_HEADER.pack(
+            0x04034B50, _VERSION_ZIP64 if self._zip64 else _VERSION_DEFAULT, _FLAGS,
+            self._method, self._time, self._date, 0, placeholder, placeholder,
+            len(self._name), len(extra),
+        )
+        return self._emit(header + self._name + extra)
+
+    def write(self, data: bytes) -> bytes:
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._compressed_size += len(data)
+        return self._emit(data)
+
+    def end(self) -> bytes:
+        tail = self._compressor.flush() if self._compressor is not None else b""
+        self._compressed_size += len(tail)
+        if self._zip64:
+            descriptor = struct.pack("<IIQQ", 0x08074B50, self._crc, self._compressed_size, self._size)
+        elif self._compressed_size > ZIP64_LIMIT or self._size > ZIP64_LIMIT:
+            raise ValueError(f"{self._member.name} outgrew its recorded size")
+        else:
+            descriptor = struct.pack("<IIII", 0x08074B50, self._crc, self._compressed_size, self._size)
+        self._central.append(self._central_record())
+        self._member = None
+        return self._emit(tail + descriptor)
+
+    def _central_record(self) -> bytes:
+        # Only the fields that overflow move into the ZIP64 extra, in spec order
+        values = []
+        sizes = []
+        for value in (self._size, self._compressed_size, self._header_offset):
+            if value >= ZIP64_LIMIT:
+                values.append(value)
+                sizes.append(ZIP64_LIMIT)
+            else:
+                sizes.append(value)
+        extra = struct.pack(f"<HH{len(values)}Q", 0x0001, 8 * len(values), *values) if values else b""
+        size, compressed_size, header_offset = sizes
+        mode = 0o40755 if self._member.is_dir else 0o100644
+        external = (mode << 16) | (0x10 if self._member.is_dir else 0)
+        header = _CENTRAL_HEADER.pack(
+            0x02014B50, _VERSION_MADE_BY,
+            _VERSION_ZIP64 if (values or self._zip64) else _VERSION_DEFAULT,
+            _FLAGS, self._method, self._time, self._date, self._crc,
+            compressed_size, size, len(self._name), len(extra), 0, 0, 0,
+            external, header_offset,
+        )
+        return header + self._name + extra
+
+    def finish(self) -> bytes:
+        directory_offset = self.offset
+        directory = b"".join(self._central)
+        count = len(self._central)
+        tail = b""
+        if count >= ZIP64_COUNT_LIMIT or len(directory) >= ZIP64_LIMIT or directory_offset >= ZIP64_LIMIT:
+            record_offset = directory_offset + len(directory)
+            tail += _ZIP64_END_OF_CENTRAL_DIR.pack(
+                0x06064B50, _ZIP64_END_OF_CENTRAL_DIR.size - 12, _VERSION_MADE_BY, _VERSION_ZIP64,
+                0, 0, count, count, len(directory), directory_offset,
+            )
+            tail += _ZIP64_LOCATOR.pack(0x07064B50, 0, record_offset, 1)
+            # The classic record then only points readers at the ZIP64 one
+            tail += _END_OF_CENTRAL_DIR.pack(0x06054B50, 0, 0, 0xFFFF, 0xFFFF, ZIP64_LIMIT, ZIP64_LIMIT, 0)
+        else:
+            tail += _END_OF_CENTRAL_DIR.pack(
+                0x06054B50, 0, 0, count, count, len(directory), directory_offset, 0,
+            )
+        return self._emit(directory + tail)
+
+
+def safe_name(name: str) -> str:
+    """A single path component: no separators, no dot-dot"""
+    name = name.replace("/", "_").replace("\\", "_").strip()
+    return "_" if name in ("", ".", "..") else name
+
+
+def unique_path(path: str, used: Set[str], is_dir: bool = False) -> str:
+    """``path``, or ``name (n).ext`` if an earlier member already took it.
+
+    Directories are passed and recorded without their trailing ``/``, so they
+    get ``name (n)`` and clash with a file of the same name.
+    """
+    candidate = path
+    stem, extension = (path, "") if is_dir else os.path.splitext(path)
+    number = 1
+    while candidate in used:
+        candidate = f"{stem} ({number}){extension}"
+        number += 1
+    used.add(candidate)
+    return candidate
+
+
+def folder_paths(folder_docs: Iterable[Dict[str, Any]], roots: Set[str],
+                 used: Optional[Set[str]] = None) -> Dict[str, str]:
+    """Archive directory of each folder, relative to the selected folder above it.
+
+    Parents are placed before their children, so a folder renamed to keep it
+    apart from a same-named sibling takes its contents along.
+    """
+    used = set() if used is None else used
+    paths: Dict[str, str] = {}
+    for doc in sorted(folder_docs, key=lambda doc: len(doc.get("ancestors", []))):
+        ancestors = doc.get("ancestors", [])
+        parent = paths.get(ancestors[-1]["folder_id"]) if ancestors else None
+        if parent is not None:
+            path = f"{parent}/{safe_name(doc['name'])}"
+        else:
+            chain = [*ancestors, {"folder_id": doc["folder_id"], "name": doc["name"]}]
+            start = next(
+                (i for i, entry in enumerate(chain) if entry["folder_id"] in roots), len(chain) - 1
+            )
+            path = "/".join(safe_name(entry["name"]) for entry in chain[start:])
+        paths[doc["folder_id"]] = unique_path(path, used, is_dir=True)
+    return paths
+
+
+class ArchiveEntry(NamedTuple):
+    member: ZipMember
+    object_name: Optional[str]  # None for directories
+
+
+def build_entries(
+    folder_docs: List[Dict[str, Any]],
+    file_docs: List[Dict[str, Any]],
+    roots: Set[str],
+    object_key: Callable[[Dict[str, Any]], str],
+) -> List[ArchiveEntry]:
+    """Directories first, then files grouped by directory; loose files at the top"""
+    used: Set[str] = set()
+    paths = folder_paths(folder_docs, roots, used)
+    entries = []
+    for doc in sorted(folder_docs, key=lambda doc: paths[doc["folder_id"]]):
+        member = ZipMember(
+            paths[doc["folder_id"]] + "/", 0, doc.get("created_date"),
+            compress=False, is_dir=True,
+        )
+        entries.append(ArchiveEntry(member, None))
+
+    def file_path(doc):
+        name = safe_name(doc["name"])
+        folder = paths.get(doc.get("folder_id"))
+        return f"{folder}/{name}" if folder else name
+
+    for doc in sorted(file_docs, key=file_path):
+        member = ZipMember(
+            unique_path(file_path(doc), used), doc["size"], doc.get("upload_date"),
+            should_compress(doc["name"], doc.get("content_type")),
+        )
+        entries.append(ArchiveEntry(member, object_key(doc)))
+    return entries
+
+
+def _pump(response, writer: ZipWriter, chunk_size: int) -> Optional[bytes]:
+    """Read one chunk and run it through the writer; None at end of object"""
+    data = response.read(chunk_size)
+    if not data:
+        return None
+    return writer.write(data)
+
+
+def _close(response):
+    response.close()
+
+
+async def stream_archive(
+    entries: List[ArchiveEntry],
+    open_object: Callable[[str], Any],
+    read_ahead: int = 4,
+    compression_level: int = 6,
+    chunk_size: int = 64 * 1024,
+) -> AsyncIterator[bytes]:
+    """Yield a ZIP of ``entries``; ``open_object`` is a blocking ``ObjectStore.open``"""
+    writer = ZipWriter(compression_level)
+    pending: "deque" = deque()
+    upcoming = iter(entries)
+
+    def schedule():
+        entry = next(upcoming, None)
+        if entry is None:
+            return
+        opening = None
+        if entry.object_name is not None:
+            opening = asyncio.ensure_future(run_storage_io(open_object, entry.object_name))
+        pending.append((entry, opening))
+
+    try:
+        for _ in range(max(1, read_ahead)):
+            schedule()
+        while pending:
+            entry, opening = pending.popleft()
+            schedule()
+            response = None
+            if opening is not None:
+                try:
+                    response = await opening
+                except Exception as e:
+                    # Headers are already sent; leave the member out rather than break the archive
+                    logger.error(f"Skipping {entry.member.name} in archive: {e}")
+                    continue
+            try:
+                yield writer.begin(entry.member)
+                while response is not None:
+                    chunk = await run_storage_io(_pump, response, writer, chunk_size)
+                    if chunk is None:
+                        break
+                    if chunk:
+                        yield chunk
+                yield writer.end()
+            finally:
+                if response is not None:
+                    await run_storage_io(_close, response)
+        yield writer.finish()
+    finally:
+        # Client went away: release anything opened ahead, once it has opened
+        for _, opening in pending:
+            if opening is not None:
+                opening.add_done_callback(_close_opened)
+
+
+def _close_opened(opening: "asyncio.Future"):
+    if not opening.cancelled() and opening.exception() is None:
+        _close(opening.result())
@@ -1,16 +1,18 @@
 from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from typing import Optional
 import secrets
+import time
 from pydantic import BaseModel, EmailStr
-from pymongo import MongoClient
 from config import settings
+from cache import TTLCache
+from metrics import timed
+from passwords import pwd_context
+from resources import Resources, get_resources
 
 # Security setup
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
 
 # JWT settings
@@ -57,9 +59,34 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# Decoded token claims keyed by the raw token, and resolved users keyed by
+# subject. Both are per-process, so a change made through another worker is
+# visible here after at most AUTH_CACHE_TTL seconds.
+token_cache = TTLCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
+user_cache = TTLCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
+
+def invalidate_user(email: str):
+    """Drop a cached user, e.g. after deactivation or a profile change"""
+    user_cache.pop(email)
+
+def clear_auth_caches():
+    token_cache.clear()
+    user_cache.clear()
+
+def users_collection(resources: Resources = Depends(get_resources)):
+    """The users collection of the app serving the request"""
+    return resources.users_collection
+
 def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    with timed("auth"):
+        return _verify_token(credentials.credentials)
+
+def _verify_token(token: str) -> TokenData:
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
         if email is None:
             raise HTTPException(
@@ -74,13 +101,27 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    # Never cache a token past its own expiry ("exp" is seconds since the epoch,
+    # which time.time() gives whatever the server's time zone)
+    expires_in = payload.get("exp", 0) - time.time()
+    if expires_in > 0:
+        token_cache.set(token, token_data, min(settings.AUTH_CACHE_TTL, expires_in))
     return token_data
 
-def get_current_user(token_data: TokenData = Depends(verify_token)):
+async def get_current_user(
+    token_data: TokenData = Depends(verify_token),
+    users=Depends(users_collection)
+):
     """Get current user from token"""
-    from main import users_collection
+    with timed("auth"):
+        return await _load_user(users, token_data.email)
+
+async def _load_user(users, email: str) -> User:
+    cached = user_cache.get(email)
+    if cached is not None:
+        return cached
     
-    user = users_collection.find_one({"email": token_data.email})
+    user = await users.find_one({"email": email})
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -88,10 +129,12 @@ def get_current_user(token_data: TokenData = Depends(verify_token)):
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    return User(
+    current_user = User(
         id=str(user["_id"]),
         email=user["email"],
         full_name=user["full_name"],
         created_at=user["created_at"],
         is_active=user.get("is_active", True)
-    )
\ No newline at end of file
+    )
+    user_cache.set(email, current_user)
+    return current_user
\ No newline at end of file
@@ -0,0 +1,295 @@
+"""Batched move, rename and delete over files and folders.
+
+``plan_batch`` validates a list of operations against the caller's items,
+loaded up front with one ``$in`` query per collection, and turns the valid ones
+into write models. ``apply_plan`` sends them as a single ``bulk_write`` per
+collection and maps write errors back to the operation that caused them.
+File deletes are sent as one ``find_one_and_delete`` each, a few at a time,
+so a file that another request removed first is reported as not found rather
+than having its bytes released and its usage subtracted a second time.
+Folder deletes are recursive, so they are left to one background job
+(``jobs.delete_subtree``) instead of being written inline.
+
+Moves, deletes and their usage rollups are computed from the paths as they
+were before the batch, so moving or deleting an item is rejected when it, or
+its target, sits inside a folder that the batch also moves or deletes.
+"""
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from folder_tree import (
+    ANCESTRY_PROJECTION, FolderCycleError, check_move, rebase_operations, rename_operations
+)
+from models import BatchAction, BatchOperation, ItemType
+from search import search_fields
+from usage import PROJECTION as USAGE_PROJECTION, UsageChanges, folder_chain
+
+FILE_PROJECTION = {"file_id": 1, "folder_id": 1, "size": 1, "object_name": 1, "thumbnail": 1}
+FOLDER_PROJECTION = {**ANCESTRY_PROJECTION, **USAGE_PROJECTION}
+# find_one_and_delete calls in flight at once while deleting a batch's files
+DELETE_CONCURRENCY = 16
+
+
+class BatchPlan:
+    def __init__(self, operations: List[BatchOperation]):
+        self.operations = operations
+        self.results: List[Optional[Dict[str, Any]]] = [None] * len(operations)
+        # write models, and for each the index of the operation it belongs to
+        self.file_writes: List[Tuple[int, Any]] = []
+        self.folder_moves: List[Tuple[int, Any]] = []
+        self.folder_renames: List[Tuple[int, Any]] = []
+        # operation index -> file doc to delete, whose bytes are released once deleted
+        self.deleted_files: Dict[int, Dict[str, Any]] = {}
+        # operation index -> folder_id handed to the recursive delete job
+        self.deleted_folders: Dict[int, str] = {}
+
+    @property
+    def folder_writes(self) -> List[Tuple[int, Any]]:
+        # Moves before renames: a rename fixes names inside freshly moved paths
+        return self.folder_moves + self.folder_renames
+
+    def fail(self, index: int, error: str):
+        if self.results[index] is None:
+            self.results[index] = self._result(index, "error", error=error)
+
+    def succeed(self, index: int, status: str = "ok", **extra):
+        if self.results[index] is None:
+            self.results[index] = self._result(index, status, **extra)
+
+    def _result(self, index: int, status: str, **extra) -> Dict[str, Any]:
+        op = self.operations[index]
+        return {
+            "index": index,
+            "item_id": op.item_id,
+            "item_type": op.item_type.value,
+            "action": op.action.value,
+            "status": status,
+            **extra,
+        }
+
+
+def lookup_ids(operations: Iterable[BatchOperation]) -> Tuple[List[str], List[str]]:
+    """File ids and folder ids (items plus move targets) the batch touches"""
+    file_ids: Set[str] = set()
+    folder_ids: Set[str] = set()
+    for op in operations:
+        (file_ids if op.item_type == ItemType.FILE else folder_ids).add(op.item_id)
+        if op.action == BatchAction.MOVE and op.target_folder_id:
+            folder_ids.add(op.target_folder_id)
+    return sorted(file_ids), sorted(folder_ids)
+
+
+async def load_items(files_collection, folders_collection, user_id: str, operations: List[BatchOperation]):
+    """The caller's files and folders named by the batch, keyed by id.
+
+    Folders include the ones holding the files, whose usage the batch changes.
+    """
+    file_ids, folder_ids = lookup_ids(operations)
+    files: Dict[str, Dict[str, Any]] = {}
+    folders: Dict[str, Dict[str, Any]] = {}
+    if file_ids:
+        async for doc in files_collection.find(
+            {"user_id": user_id, "file_id": {"$in": file_ids}}, FILE_PROJECTION
+        ):
+            files[doc["file_id"]] = doc
+    folder_ids = sorted(set(folder_ids) | {doc["folder_id"] for doc in files.values() if doc.get("folder_id")})
+    if folder_ids:
+        async for doc in folders_collection.find(
+            {"user_id": user_id, "folder_id": {"$in": folder_ids}}, FOLDER_PROJECTION
+        ):
+            folders[doc["folder_id"]] = doc
+    return files, folders
+
+
+def plan_batch(
+    user_id: str,
+    operations: List[BatchOperation],
+    files: Dict[str, Dict[str, Any]],
+    folders: Dict[str, Dict[str, Any]],
+) -> BatchPlan:
+    plan = BatchPlan(operations)
+    seen: Set[Tuple[ItemType, str]] = set()
+    changing_folders = {
+        op.item_id for op in operations
+        if op.item_type == ItemType.FOLDER and op.action in (BatchAction.MOVE, BatchAction.DELETE)
+    }
+
+    def path_is_changing(folder_doc: Dict[str, Any]) -> bool:
+        return any(a["folder_id"] in changing_folders for a in folder_doc.get("ancestors", []))
+
+    def inside_changing(folder_id: Optional[str]) -> bool:
+        """Whether this folder, or one of its parents, is moved or deleted by the batch"""
+        if folder_id is None:
+            return False
+        return folder_id in changing_folders or path_is_changing(folders.get(folder_id, {}))
+
+    for index, op in enumerate(operations):
+        key = (op.item_type, op.item_id)
+        if key in seen:
+            plan.fail(index, "Item appears more than once in the batch")
+            continue
+        seen.add(key)
+
+        is_file = op.item_type == ItemType.FILE
+        doc = (files if is_file else folders).get(op.item_id)
+        if doc is None:
+            plan.fail(index, "File not found" if is_file else "Folder not found")
+            continue
+
+        in_changing_path = inside_changing(doc.get("folder_id")) if is_file else path_is_changing(doc)
+
+        if op.action == BatchAction.RENAME:
+            if not op.name:
+                plan.fail(index, "Rename requires a name")
+            elif is_file:
+                plan.file_writes.append((index, UpdateOne(
+                    {"_id": doc["_id"]},
+                    {"$set": {"name": op.name, **search_fields(op.name)}},
+                )))
+            else:
+                plan.folder_renames.extend(
+                    (index, write) for write in rename_operations(user_id, op.item_id, op.name)
+                )
+
+        elif op.action == BatchAction.MOVE:
+            target = None
+            if op.target_folder_id:
+                target = folders.get(op.target_folder_id)
+                if target is None:
+                    plan.fail(index, "Target folder not found")
+                    continue
+            if not is_file:
+                try:
+                    check_move(doc, target)
+                except FolderCycleError as e:
+                    plan.fail(index, str(e))
+                    continue
+            if in_changing_path:
+                plan.fail(index, "A folder containing this item is also being moved or deleted")
+            elif inside_changing(op.target_folder_id):
+                plan.fail(index, "Target folder is also being moved or deleted")
+            elif is_file:
+                plan.file_writes.append((index, UpdateOne(
+                    {"_id": doc["_id"]}, {"$set": {"folder_id": op.target_folder_id}}
+                )))
+            else:
+                plan.folder_moves.extend(
+                    (index, write) for write in rebase_operations(user_id, doc, target)
+                )
+
+        elif op.action == BatchAction.DELETE:
+            if in_changing_path:
+                plan.fail(index, "A folder containing this item is also being moved or deleted")
+            elif is_file:
+                plan.deleted_files[index] = doc
+            else:
+                plan.deleted_folders[index] = op.item_id
+
+    return plan
+
+
+async def _bulk_write(collection, plan: BatchPlan, writes: List[Tuple[int, Any]], ordered: bool):
+    if not writes:
+        return
+    try:
+        await collection.bulk_write([write for _, write in writes], ordered=ordered)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        for error in errors:
+            plan.fail(writes[error["index"]][0], error.get("errmsg", "Write failed"))
+        if ordered and errors:
+            # An ordered bulk stops at its first error
+            for owner, _ in writes[errors[0]["index"] + 1:]:
+                plan.fail(owner, "Not applied after an earlier error in the batch")
+
+
+async def _delete_files(collection, plan: BatchPlan):
+    """Delete the plan's files, failing the ones that were already gone"""
+    pending = iter(list(plan.deleted_files.items()))
+
+    async def worker():
+        for index, doc in pending:
+            try:
+                deleted = await collection.find_one_and_delete({"_id": doc["_id"]}, {"_id": 1})
+            except PyMongoError as e:
+                plan.fail(index, str(e))
+                continue
+            if deleted is None:
+                plan.fail(index, "File not found")
+
+    await asyncio.gather(*(worker() for _ in range(min(DELETE_CONCURRENCY, len(plan.deleted_files)))))
+
+
+async def apply_plan(plan: BatchPlan, files_collection, folders_collection):
+    """Write the plan; every operation without a result afterwards succeeded"""
+    await _bulk_write(files_collection, plan, plan.file_writes, ordered=False)
+    await _delete_files(files_collection, plan)
+    # Ordered: a folder's rename or move is two writes that belong together
+    await _bulk_write(folders_collection, plan, plan.folder_writes, ordered=True)
+    for index, _ in plan.file_writes + plan.folder_writes:
+        plan.succeed(index)
+    for index in plan.deleted_files:
+        plan.succeed(index)
+
+
+def _applied(plan: BatchPlan):
+    for index, op in enumerate(plan.operations):
+        result = plan.results[index]
+        if result and result["status"] == "ok":
+            yield op
+
+
+def touched_folders(
+    plan: BatchPlan,
+    files: Dict[str, Dict[str, Any]],
+    folders: Dict[str, Dict[str, Any]],
+) -> Set[Optional[str]]:
+    """Folders whose listings the applied operations changed"""
+    touched: Set[Optional[str]] = set()
+    for op in _applied(plan):
+        if op.item_type == ItemType.FILE:
+            touched.add(files[op.item_id].get("folder_id"))
+        else:
+            touched.add(folders[op.item_id].get("parent_folder_id"))
+        if op.action == BatchAction.MOVE:
+            touched.add(op.target_folder_id)
+    return touched
+
+
+def usage_changes(
+    plan: BatchPlan,
+    files: Dict[str, Dict[str, Any]],
+    folders: Dict[str, Dict[str, Any]],
+) -> UsageChanges:
+    """Usage deltas of the applied file moves and deletes and folder moves
+    (folder deletes are accounted for by their job)"""
+    def chain(folder_id: Optional[str]) -> List[str]:
+        if not folder_id:
+            return []
+        return folder_chain(folders[folder_id]) if folder_id in folders else [folder_id]
+
+    changes = UsageChanges()
+    for op in _applied(plan):
+        if op.action == BatchAction.RENAME:
+            continue
+        moved = op.action == BatchAction.MOVE
+        if op.item_type == ItemType.FILE:
+            doc = files[op.item_id]
+            size = doc.get("size", 0)
+            changes.add_item(chain(doc.get("folder_id")), files=-1, bytes=-size, count_user=not moved)
+            if moved:
+                changes.add_item(chain(op.target_folder_id), files=1, bytes=size, count_user=False)
+        else:
+            doc = folders[op.item_id]
+            changes.add_subtree(folder_chain(doc)[:-1], doc, -1, count_user=False)
+            changes.add_subtree(chain(op.target_folder_id), doc, 1, count_user=False)
+    return changes
+
+
+def released_files(plan: BatchPlan) -> List[Dict[str, Any]]:
+    """Deleted files whose delete actually went through"""
+    return [
+        doc for index, doc in plan.deleted_files.items()
+        if plan.results[index] and plan.results[index]["status"] == "ok"
+    ]
@@ -0,0 +1,346 @@
+"""Endpoint latency and throughput against in-process Mongo and MinIO stand-ins.
+
+Builds a synthetic dataset, loads the real ``main`` app on top of
+``benchmarks.fakes`` and drives it concurrently through
+``httpx.ASGITransport``, with no database, object store or network involved.
+The dataset has many small users, and one user with a deep folder chain and a
+folder holding ``--big-folder`` files.
+
+Every scenario reports throughput and p50/p95/p99 latency. Requests share one
+event loop with the stand-ins, so under concurrency a request also waits on
+other requests' store work; instead of per-request subtraction the report
+gives ``app_ms_per_request``, the scenario's wall time minus all time spent in
+the stand-ins, per request. With no injected latency (the default) that is
+the loop time the app itself spends per request, and it is the steadiest
+number to compare across commits. Results are JSON. ``--output`` saves them;
+``--compare`` checks a run against a saved baseline and exits non-zero when a
+scenario grew past ``--threshold``.
+
+Run from ``backend/``::
+
+    python -m benchmarks.bench_api --output baseline.json
+    python -m benchmarks.bench_api --compare baseline.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+from unittest.mock import patch
+
+import httpx
+from bson import ObjectId
+
+from benchmarks.bench_event_loop import percentile
+from benchmarks.fakes import FakeMinio, FakeMongoClient, store_time
+from pagination import ListingSort, SortOrder, encode_cursor
+from search import search_fields
+from usage import UsageChanges, empty_usage, folder_chain
+
+UPLOAD_SIZE = 64 * 1024
+DOWNLOAD_SIZE = 1024 * 1024
+WORDS = ("report", "invoice", "photo", "draft", "backup", "notes", "budget", "slides")
+
+
+class Scenario(NamedTuple):
+    name: str
+    # request number -> (method, url, httpx keyword arguments)
+    request: Callable[[int], Tuple[str, str, Dict[str, Any]]]
+    cached_listings: bool = True
+
+
+def folder_doc(user_id: str, name: str, parent: Dict[str, Any] = None) -> Dict[str, Any]:
+    folder_id = str(ObjectId())
+    ancestors = [*parent["ancestors"], {"folder_id": parent["folder_id"], "name": parent["name"]}] if parent else []
+    return {
+        "_id": ObjectId(folder_id), "name": name, **search_fields(name),
+        "created_date": datetime(2024, 1, 1), "folder_id": folder_id,
+        "parent_folder_id": parent["folder_id"] if parent else None, "ancestors": ancestors,
+        "item_type": "folder", "user_id": user_id, "usage": empty_usage(),
+    }
+
+
+def file_doc(user_id: str, folder_id: str, index: int, size: int = 4096) -> Dict[str, Any]:
+    file_id = str(ObjectId())
+    name = f"{WORDS[index % len(WORDS)]}-{index:06d}.pdf"
+    return {
+        "_id": ObjectId(file_id), "name": name, **search_fields(name), "size": size,
+        "sha256": f"{index:064x}", "content_type": "application/pdf",
+        "upload_date": datetime(2024, 1, 1) + timedelta(seconds=index), "file_id": file_id,
+        "folder_id": folder_id, "item_type": "file", "user_id": user_id,
+    }
+
+
+def user_doc(email: str) -> Dict[str, Any]:
+    return {
+        "_id": ObjectId(), "email": email, "full_name": "Bench User", "hashed_password": "unused",
+        "created_at": datetime(2024, 1, 1), "is_active": True,
+    }
+
+
+def build_dataset(mongo: FakeMongoClient, minio: FakeMinio, users: int, files_per_user: int,
+                  depth: int, big_folder: int) -> Dict[str, Any]:
+    db = mongo.db
+    insert_user, insert_folder, insert_file = db.users._insert, db.folders._insert, db.files._insert
+
+    others = []
+    for n in range(users):
+        user = insert_user(user_doc(f"user{n}@bench.local"))
+        user_id = str(user["_id"])
+        folder = insert_folder(folder_doc(user_id, "Documents"))
+        for i in range(files_per_user):
+            insert_file(file_doc(user_id, folder["folder_id"] if i % 2 else None, i))
+        others.append(user["email"])
+
+    heavy = insert_user(user_doc("heavy@bench.local"))
+    heavy_id = str(heavy["_id"])
+    chain, parent = [], None
+    for level in range(depth):
+        parent = insert_folder(folder_doc(heavy_id, f"level-{level}", parent))
+        chain.append(parent)
+        insert_file(file_doc(heavy_id, parent["folder_id"], level))
+    big = insert_folder(folder_doc(heavy_id, "archive"))
+    big_files = [insert_file(file_doc(heavy_id, big["folder_id"], i)) for i in range(big_folder)]
+    for i in range(files_per_user):
+        insert_file(file_doc(heavy_id, None, i))
+
+    download = insert_file(file_doc(heavy_id, None, 0, size=DOWNLOAD_SIZE))
+    minio.put_bytes(download["file_id"], b"\0" * DOWNLOAD_SIZE, "application/pdf")
+    uploads = insert_folder(folder_doc(heavy_id, "uploads"))
+
+    fill_usage(db)
+    for user in db.users.docs.values():
+        user_id = str(user["_id"])
+        files = db.files._find({"user_id": user_id})
+        db.usage._insert({
+            "_id": user_id, "files": len(files), "bytes": sum(doc["size"] for doc in files),
+            "folders": len(db.folders._find({"user_id": user_id})), "tracked": True,
+        })
+
+    by_name = sorted(big_files, key=lambda doc: (doc["name"], str(doc["_id"])))
+    middle = by_name[len(by_name) // 2] if by_name else None
+    return {
+        "heavy": heavy["email"],
+        "others": others,
+        "deepest": chain[-1]["folder_id"] if chain else None,
+        "big": big["folder_id"],
+        "big_middle_cursor": encode_cursor("file", ListingSort.NAME, SortOrder.ASC, middle),
+        "download": download["file_id"],
+        "uploads": uploads["folder_id"],
+        "counts": {"users": users + 1, "folders": len(db.folders.docs), "files": len(db.files.docs),
+                   "depth": depth, "big_folder": big_folder},
+    }
+
+
+def fill_usage(db):
+    """Set every folder's rollup counters from what was generated under it"""
+    folders = {doc["folder_id"]: doc for doc in db.folders.docs.values()}
+    changes = UsageChanges()
+    for doc in db.files.docs.values():
+        changes.add_item(folder_chain(folders.get(doc["folder_id"])), files=1, bytes=doc["size"])
+    for doc in folders.values():
+        changes.add_item(folder_chain(doc)[:-1], folders=1)
+    for folder_id, counts in changes.folders.items():
+        folders[folder_id]["usage"].update(counts)
+
+
+def load_app(mongo: FakeMongoClient, minio: FakeMinio):
+    """The real app, with resources built on the stand-ins instead of real clients"""
+    import main
+    app = main.create_app()
+    with patch("main.create_mongo_client", return_value=mongo), patch("object_store.Minio", return_value=minio):
+        app.state.resources = main.create_resources()
+    logging.getLogger().setLevel(logging.WARNING)
+    return app
+
+
+def scenarios(data: Dict[str, Any], tokens: Dict[str, str]) -> List[Scenario]:
+    heavy = {"headers": {"Authorization": f"Bearer {tokens[data['heavy']]}"}}
+    others = [{"headers": {"Authorization": f"Bearer {tokens[email]}"}} for email in data["others"]]
+    payload = b"\1" * UPLOAD_SIZE
+
+    def upload(i):
+        return "POST", "/api/files/upload", {
+            **heavy,
+            "files": {"file": (f"upload-{i}.bin", payload, "application/octet-stream")},
+            "data": {"folder_id": data["uploads"]},
+        }
+
+    big = f"/api/files?folder_id={data['big']}&limit=50"
+    return [
+        Scenario("list_root", lambda i: ("GET", "/api/files", heavy)),
+        Scenario("list_root_many_users", lambda i: ("GET", "/api/files", others[i % len(others)])),
+        Scenario("list_big_folder", lambda i: ("GET", big, heavy)),
+        Scenario("list_big_folder_uncached", lambda i: ("GET", big, heavy), cached_listings=False),
+        Scenario("list_big_folder_middle_uncached",
+                 lambda i: ("GET", f"{big}&cursor={data['big_middle_cursor']}", heavy), cached_listings=False),
+        Scenario("list_deep_folder", lambda i: ("GET", f"/api/files?folder_id={data['deepest']}", heavy)),
+        Scenario("search", lambda i: ("GET", f"/api/files?search={WORDS[i % len(WORDS)]}-0001", heavy)),
+        Scenario("breadcrumb", lambda i: ("GET", f"/api/folders/{data['deepest']}/breadcrumb", heavy)),
+        Scenario("download", lambda i: ("GET", f"/api/files/{data['download']}/download", heavy)),
+        # Last: uploads bump the listing versions the scenarios above read
+        Scenario("upload_file", upload),
+    ]
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    return {
+        "p50": round(percentile(samples, 50), 3),
+        "p95": round(percentile(samples, 95), 3),
+        "p99": round(percentile(samples, 99), 3),
+        "max": round(max(samples), 3),
+    }
+
+
+async def run_scenario(http: httpx.AsyncClient, scenario: Scenario, requests: int,
+                       concurrency: int, warmup: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    spent = [0.0]
+    errors = 0
+
+    async def send(i: int, record: bool):
+        nonlocal errors
+        method, url, kwargs = scenario.request(i)
+        store_time.set(spent if record else [0.0])
+        began = time.perf_counter()
+        response = await http.request(method, url, **kwargs)
+        if not record:
+            return
+        latencies.append((time.perf_counter() - began) * 1000)
+        if response.status_code >= 400:
+            errors += 1
+
+    for i in range(warmup):
+        await send(i, record=False)
+
+    counter = itertools.count()
+
+    async def worker():
+        for i in counter:
+            if i >= requests:
+                return
+            await send(warmup + i, record=True)
+
+    began = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - began
+    return {
+        "requests": requests,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "latency_ms": summarize(latencies),
+        "store_ms_per_request": round(spent[0] * 1000 / requests, 3),
+        "app_ms_per_request": round(max(0.0, elapsed - spent[0]) * 1000 / requests, 3),
+    }
+
+
+async def run(args) -> Dict[str, Any]:
+    mongo = FakeMongoClient(latency=args.db_latency_ms / 1000)
+    minio = FakeMinio(latency=args.s3_latency_ms / 1000)
+    app = load_app(mongo, minio)
+    from auth import create_access_token
+    from listing_cache import LocalListingCache
+
+    data = build_dataset(mongo, minio, args.users, args.files_per_user, args.depth, args.big_folder)
+    tokens = {
+        email: create_access_token({"sub": email}, expires_delta=timedelta(hours=1))
+        for email in [data["heavy"], *data["others"]]
+    }
+    selected = [s for s in scenarios(data, tokens) if not args.only or s.name in args.only]
+
+    resources = app.state.resources
+    cached = resources.listing_cache
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        for scenario in selected:
+            resources.listing_cache = cached if scenario.cached_listings else LocalListingCache(0, 0, 0)
+            results[scenario.name] = await run_scenario(
+                http, scenario, args.requests, args.concurrency, args.warmup
+            )
+            result = results[scenario.name]
+            print(f"{scenario.name}: {result['throughput_rps']} rps, p95 {result['latency_ms']['p95']} ms, "
+                  f"app {result['app_ms_per_request']} ms/request", file=sys.stderr)
+    resources.listing_cache = cached
+    return {"meta": meta(args, data["counts"]), "results": results}
+
+
+def meta(args, counts: Dict[str, int]) -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "dataset": counts,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "db_latency_ms": args.db_latency_ms,
+        "s3_latency_ms": args.s3_latency_ms,
+    }
+
+
+def metric_value(result: Dict[str, Any], metric: str) -> float:
+    return result["latency_ms"]["p95"] if metric == "p95" else result["app_ms_per_request"]
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], metric: str, threshold: float) -> Dict[str, Any]:
+    """Each scenario's ``metric`` relative to the baseline; ratios above ``threshold`` regressed"""
+    ratios = {}
+    for name, result in report["results"].items():
+        before = baseline["results"].get(name)
+        if before and metric_value(before, metric) > 0:
+            ratios[name] = round(metric_value(result, metric) / metric_value(before, metric), 3)
+    return {
+        "baseline_commit": baseline.get("meta", {}).get("commit"),
+        "metric": metric,
+        "ratio": ratios,
+        "regressed": sorted(name for name, ratio in ratios.items() if ratio > threshold),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests per scenario")
+    parser.add_argument("--users", type=int, default=200, help="small users")
+    parser.add_argument("--files-per-user", type=int, default=50)
+    parser.add_argument("--depth", type=int, default=40, help="depth of the deep folder chain")
+    parser.add_argument("--big-folder", type=int, default=100_000, help="files in the big folder")
+    parser.add_argument("--db-latency-ms", type=float, default=0.0, help="added to every Mongo call")
+    parser.add_argument("--s3-latency-ms", type=float, default=0.0, help="added to every MinIO call")
+    parser.add_argument("--only", nargs="+", help="scenarios to run")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--compare", help="baseline report to compare against")
+    parser.add_argument("--metric", choices=["app", "p95"], default="app",
+                        help="compare app_ms_per_request or p95 latency")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="ratio to the baseline above which a scenario counts as regressed")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.compare:
+        with open(args.compare) as f:
+            report["comparison"] = compare(report, json.load(f), args.metric, args.threshold)
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    if report.get("comparison", {}).get("regressed"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Throughput of batched item operations vs. one request per item.
+
+Drives the real ``batch.load_items`` / ``plan_batch`` / ``apply_plan`` path
+against in-memory collections that charge a fixed round-trip latency per
+database call, and compares it with what the frontend did before: one HTTP
+request per item, each doing one database write. Planning cost is measured for
+real; only the network is simulated, and the database's own work per write is
+not, so batch throughput here is an upper bound. Deletes cost one
+``find_one_and_delete`` per file, a few in flight at once, so they show how far
+that falls behind a single bulk write.
+
+Run from ``backend/``::
+
+    python -m benchmarks.bench_batch --sizes 1000 5000 10000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from bson import ObjectId
+
+from batch import apply_plan, load_items, plan_batch
+from models import BatchOperation
+
+
+class FakeCollection:
+    """Just enough of an async collection for the batch path"""
+
+    def __init__(self, docs, key, rtt):
+        self.docs = {doc[key]: doc for doc in docs}
+        self.keys_by_id = {doc["_id"]: doc[key] for doc in docs}
+        self.key = key
+        self.rtt = rtt
+        self.calls = 0
+
+    async def _round_trip(self):
+        self.calls += 1
+        await asyncio.sleep(self.rtt)
+
+    def find(self, query, projection=None):
+        wanted = query[self.key]["$in"]
+        collection = self
+
+        class Cursor:
+            async def __aiter__(self):
+                await collection._round_trip()
+                for item_id in wanted:
+                    if item_id in collection.docs:
+                        yield collection.docs[item_id]
+
+        return Cursor()
+
+    async def update_one(self, query, update, **kwargs):
+        await self._round_trip()
+
+    async def bulk_write(self, requests, ordered=True):
+        await self._round_trip()
+
+    async def find_one_and_delete(self, query, projection=None):
+        await self._round_trip()
+        key = self.keys_by_id.pop(query["_id"], None)
+        return None if key is None else self.docs.pop(key)
+
+
+def operations(count, action):
+    return [
+        BatchOperation(action=action, item_type="file", item_id=f"f{i}",
+                       name=f"renamed-{i}.txt", target_folder_id="target")
+        for i in range(count)
+    ]
+
+
+async def run_batched(ops, rtt):
+    files = FakeCollection(
+        [{"_id": ObjectId(), "file_id": op.item_id, "folder_id": None} for op in ops], "file_id", rtt
+    )
+    folders = FakeCollection(
+        [{"_id": ObjectId(), "folder_id": "target", "name": "Target", "ancestors": []}], "folder_id", rtt
+    )
+    began = time.perf_counter()
+    found_files, found_folders = await load_items(files, folders, "user", ops)
+    plan = plan_batch("user", ops, found_files, found_folders)
+    await apply_plan(plan, files, folders)
+    return time.perf_counter() - began, files.calls + folders.calls
+
+
+async def run_per_item(ops, rtt, http_rtt):
+    files = FakeCollection([], "file_id", rtt)
+    began = time.perf_counter()
+    for op in ops:
+        await asyncio.sleep(http_rtt)
+        await files.update_one({"file_id": op.item_id, "user_id": "user"}, {"$set": {"name": op.name}})
+    return time.perf_counter() - began, files.calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 10000])
+    parser.add_argument("--db-rtt-ms", type=float, default=0.5, help="latency per database call")
+    parser.add_argument("--http-rtt-ms", type=float, default=2.0, help="latency per HTTP request")
+    args = parser.parse_args()
+
+    rtt = args.db_rtt_ms / 1000
+    http_rtt = args.http_rtt_ms / 1000
+    results = {}
+    for size in args.sizes:
+        row = {}
+        for action in ("rename", "move", "delete"):
+            ops = operations(size, action)
+            elapsed, calls = asyncio.run(run_batched(ops, rtt))
+            row[f"batch_{action}"] = {
+                "elapsed_s": round(elapsed + http_rtt, 4),
+                "items_per_s": round(size / (elapsed + http_rtt)),
+                "db_calls": calls,
+            }
+        ops = operations(size, "rename")
+        elapsed, calls = asyncio.run(run_per_item(ops, rtt, http_rtt))
+        row["per_item_rename"] = {
+            "elapsed_s": round(elapsed, 4),
+            "items_per_s": round(size / elapsed),
+            "db_calls": calls,
+        }
+        results[str(size)] = row
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
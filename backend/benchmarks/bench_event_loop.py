@@ -0,0 +1,119 @@
+"""Concurrency benchmark for blocking vs. offloaded storage calls.
+
+Two minimal ASGI apps share the same slow storage stand-in (a blocking
+``time.sleep`` in place of a slow Mongo query or MinIO PUT). The "before" app
+calls it inline from an ``async def`` handler, the way ``main.py`` used to; the
+"after" app awaits it through ``storage.run_storage_io``. Both are driven with
+a mixed workload of slow writes and cheap reads, and the latency percentiles of
+the cheap reads show how much the slow calls stall the event loop.
+
+Run from ``backend/``::
+
+    python -m benchmarks.bench_event_loop --slow 50 --fast 500
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from storage import run_storage_io
+
+
+def blocking_store_call(latency: float):
+    time.sleep(latency)
+
+
+def build_app(offload: bool, latency: float) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/fast")
+    async def fast():
+        return {"ok": True}
+
+    @app.post("/slow")
+    async def slow():
+        if offload:
+            await run_storage_io(blocking_store_call, latency)
+        else:
+            blocking_store_call(latency)
+        return {"ok": True}
+
+    return app
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_mixed_load(app: FastAPI, slow: int, fast: int, interval: float) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        latencies = []
+        began = time.perf_counter()
+
+        async def timed_fast(scheduled: float):
+            await http.get("/fast")
+            # Measure from the scheduled arrival time so time spent waiting
+            # for a blocked loop is counted (no coordinated omission)
+            latencies.append((time.perf_counter() - scheduled) * 1000)
+
+        async def fast_stream():
+            tasks = []
+            for i in range(fast):
+                scheduled = began + i * interval
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+                tasks.append(asyncio.create_task(timed_fast(scheduled)))
+            await asyncio.gather(*tasks)
+
+        async def slow_stream():
+            # Slow writes arrive spread across the same window as the reads
+            spacing = fast * interval / max(slow, 1)
+            tasks = []
+            for i in range(slow):
+                await asyncio.sleep(max(0.0, began + i * spacing - time.perf_counter()))
+                tasks.append(asyncio.create_task(http.post("/slow")))
+            await asyncio.gather(*tasks)
+
+        await asyncio.gather(fast_stream(), slow_stream())
+        elapsed = time.perf_counter() - began
+
+    return {
+        "fast_requests": fast,
+        "slow_requests": slow,
+        "elapsed_s": round(elapsed, 3),
+        "fast_p50_ms": round(statistics.median(latencies), 2),
+        "fast_p95_ms": round(percentile(latencies, 95), 2),
+        "fast_p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--slow", type=int, default=50, help="slow storage requests")
+    parser.add_argument("--fast", type=int, default=500, help="cheap read requests")
+    parser.add_argument("--latency-ms", type=float, default=20.0,
+                        help="simulated latency of each slow storage call")
+    parser.add_argument("--interval-ms", type=float, default=2.0,
+                        help="arrival interval between cheap reads")
+    args = parser.parse_args()
+
+    latency = args.latency_ms / 1000
+    results = {}
+    for name, offload in (("before_blocking", False), ("after_offloaded", True)):
+        results[name] = asyncio.run(
+            run_mixed_load(
+                build_app(offload, latency), args.slow, args.fast,
+                args.interval_ms / 1000
+            )
+        )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Listing latency during a login storm.
+
+Two minimal ASGI apps verify a real bcrypt hash on ``POST /slow`` (a login)
+and answer ``GET /fast`` (a listing) straight away. The "before" app verifies
+inline in the ``async def`` handler, the way ``main.py`` used to; the "after"
+app awaits ``passwords.PasswordHasher``. The listing latency percentiles show
+how much concurrent logins stall everything else on the worker.
+
+Run from ``backend/``::
+
+    python -m benchmarks.bench_password_hashing --logins 40 --fast 500
+"""
+import argparse
+import asyncio
+import json
+
+from fastapi import FastAPI
+
+from benchmarks.bench_event_loop import run_mixed_load
+from passwords import PasswordHasher, hash_password_sync, verify_password_sync
+
+
+def build_app(hasher, hashed: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/fast")
+    async def fast():
+        return {"ok": True}
+
+    @app.post("/slow")
+    async def slow():
+        if hasher is None:
+            verify_password_sync("password123", hashed)
+        else:
+            await hasher.verify("password123", hashed)
+        return {"ok": True}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=40, help="concurrent login requests")
+    parser.add_argument("--fast", type=int, default=500, help="listing requests")
+    parser.add_argument("--interval-ms", type=float, default=2.0,
+                        help="arrival interval between listing requests")
+    parser.add_argument("--workers", type=int, default=2, help="hashing pool size")
+    parser.add_argument("--queue", type=int, default=1000, help="hashing admission queue")
+    args = parser.parse_args()
+
+    hashed = hash_password_sync("password123")
+    hasher = PasswordHasher(args.workers, args.queue)
+    # Start the pool before timing so worker spawn isn't measured
+    asyncio.run(hasher.verify("password123", hashed))
+
+    results = {}
+    try:
+        for name, pool in (("before_inline", None), ("after_process_pool", hasher)):
+            results[name] = asyncio.run(
+                run_mixed_load(build_app(pool, hashed), args.logins, args.fast,
+                               args.interval_ms / 1000)
+            )
+        results["hasher"] = hasher.stats()
+    finally:
+        hasher.shutdown()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
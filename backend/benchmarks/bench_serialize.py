@@ -0,0 +1,132 @@
+"""Cost of turning a big folder listing into a response body.
+
+Builds ``--sizes`` rows' worth of documents shaped like ``PROJECTIONS`` (one
+folder per hundred files) and times the two halves of the work, building the
+rows and encoding them, for:
+
+- ``previous``: rows with ``isoformat()`` dates encoded like ``JSONResponse``,
+  as listings were served before ``serialization``
+- ``json``: ``listing_rows`` encoded by ``serialization.dumps`` without orjson
+- ``orjson``: ``listing_rows`` encoded by ``serialization.dumps`` (if installed)
+
+All three must produce the same bytes. Only serialization is measured; for the
+whole request see ``bench_api``.
+
+Run from ``backend/``::
+
+    python -m benchmarks.bench_serialize --sizes 10000 100000
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from bson import ObjectId
+
+import serialization
+from serialization import dumps, listing_rows
+from usage import serialize_usage
+from thumbnails import has_thumbnail
+
+
+def documents(count):
+    start = datetime(2024, 1, 1)
+    folders, files = [], []
+    for i in range(count):
+        moment = start + timedelta(seconds=i, microseconds=i % 1000)
+        if i % 100 == 0:
+            folders.append({
+                "_id": ObjectId(), "name": f"folder-{i:06d}", "created_date": moment,
+                "folder_id": f"{i:024x}", "parent_folder_id": "a" * 24,
+                "usage": {"tracked": True, "total_files": i, "total_bytes": i * 4096, "total_folders": 0},
+            })
+        else:
+            files.append({
+                "_id": ObjectId(), "name": f"report-{i:06d}.pdf", "size": i * 4096,
+                "content_type": "application/pdf", "upload_date": moment,
+                "file_id": f"{i:024x}", "folder_id": "a" * 24,
+                "thumbnail": {"status": "ready" if i % 3 else "pending"},
+            })
+    return folders, files
+
+
+def previous_rows(folders, files):
+    rows = [{
+        "id": str(doc["_id"]),
+        "name": doc["name"],
+        "created_date": doc["created_date"].isoformat(),
+        "folder_id": doc["folder_id"],
+        "parent_folder_id": doc.get("parent_folder_id"),
+        "item_type": "folder",
+        "usage": serialize_usage(doc.get("usage"), totals_only=True),
+    } for doc in folders]
+    rows.extend({
+        "id": str(doc["_id"]),
+        "name": doc["name"],
+        "size": doc["size"],
+        "content_type": doc["content_type"],
+        "upload_date": doc["upload_date"].isoformat(),
+        "file_id": doc["file_id"],
+        "folder_id": doc.get("folder_id"),
+        "item_type": "file",
+        "has_thumbnail": has_thumbnail(doc),
+    } for doc in files)
+    return rows
+
+
+def previous_encode(content):
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def rows(folders, files):
+    return listing_rows("folder", folders) + listing_rows("file", files)
+
+
+def measure(build, encode, folders, files, repeat):
+    """Best of ``repeat`` runs, in milliseconds"""
+    best_build = best_encode = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        items = build(folders, files)
+        built = time.perf_counter()
+        body = encode({"items": items, "current_folder": "a" * 24, "has_more": False})
+        encoded = time.perf_counter()
+        best_build = min(best_build, built - started)
+        best_encode = min(best_encode, encoded - built)
+    return body, {
+        "build_ms": round(best_build * 1000, 2),
+        "encode_ms": round(best_encode * 1000, 2),
+        "total_ms": round((best_build + best_encode) * 1000, 2),
+    }
+
+
+def run(size, repeat):
+    folders, files = documents(size)
+    variants = {"previous": (previous_rows, previous_encode)}
+    with patch.object(serialization, "orjson", None):
+        body, timing = measure(rows, dumps, folders, files, repeat)
+    results = {}
+    reference, results["previous"] = measure(*variants["previous"], folders, files, repeat)
+    results["json"] = timing
+    assert body == reference, "json fallback output differs from the previous output"
+    if serialization.orjson is not None:
+        body, results["orjson"] = measure(rows, dumps, folders, files, repeat)
+        assert body == reference, "orjson output differs from the previous output"
+    baseline = results["previous"]["total_ms"]
+    for result in results.values():
+        result["speedup"] = round(baseline / result["total_ms"], 2)
+    return {"items": size, "bytes": len(reference), **results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5, help="runs per variant; the best counts")
+    args = parser.parse_args()
+    print(json.dumps([run(size, args.repeat) for size in args.sizes], indent=2))
+
+
+if __name__ == "__main__":
+    main()
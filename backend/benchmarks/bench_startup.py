@@ -0,0 +1,153 @@
+"""Import and cold-start time of one API worker.
+
+Each run is a fresh interpreter (this script with ``--child``), as a new
+uvicorn worker would be. It imports ``main``, then runs the app's lifespan
+startup and shutdown with ``AsyncMongoClient`` and ``Minio`` replaced by the
+stand-ins from ``benchmarks.fakes``, each adding ``--db-latency-ms`` /
+``--s3-latency-ms`` per call. Reported per run, as the median (and min/max)
+over ``--runs``:
+
+- ``import_s``: importing ``main`` (the stand-ins' own import is included)
+- ``startup_s``: lifespan startup, from creating the clients until the app
+  would accept requests
+- ``cold_start_s``: the two together
+- ``process_s``: wall time of the whole child process, interpreter included
+
+plus the lifespan's own per-step timings. ``--unavailable-s`` makes MongoDB
+refuse pings for that long after the import, to watch startup retry instead of
+failing. ``--import-profile N`` adds the N slowest modules imported by
+``main``, from ``python -X importtime``.
+
+Run from ``backend/``::
+
+    python -m benchmarks.bench_startup --runs 5 --db-latency-ms 20 --s3-latency-ms 20
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STEPS = ("mongodb", "storage")  # as named by main.lifespan
+
+
+def child(args) -> Dict[str, Any]:
+    """One worker's import and startup, in this process"""
+    started = time.perf_counter()
+    from unittest.mock import patch
+    from benchmarks.fakes import FakeMinio, FakeMongoClient
+    from pymongo.errors import ServerSelectionTimeoutError
+
+    mongo = FakeMongoClient(latency=args.db_latency_ms / 1000)
+    minio = FakeMinio(latency=args.s3_latency_ms / 1000)
+    import main
+    imported = time.perf_counter()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.unavailable_s:
+        available_at = imported + args.unavailable_s
+        ping = mongo.admin.command
+
+        async def command(*a, **kw):
+            if time.perf_counter() < available_at:
+                raise ServerSelectionTimeoutError("stand-in MongoDB is not up yet")
+            return await ping(*a, **kw)
+        mongo.admin.command = command
+
+    timings = {}
+
+    async def start():
+        with patch("main.create_mongo_client", return_value=mongo), \
+             patch("object_store.Minio", return_value=minio):
+            async with main.app.router.lifespan_context(main.app):
+                timings["startup_s"] = time.perf_counter() - imported
+
+    asyncio.run(start())
+    return {
+        "import_s": imported - started,
+        "startup_s": timings["startup_s"],
+        "cold_start_s": imported - started + timings["startup_s"],
+        "steps_s": {step: main.STARTUP_SECONDS.get(phase=step) for step in STEPS},
+    }
+
+
+def spawn(args, extra: List[str] = ()) -> subprocess.CompletedProcess:
+    command = [
+        sys.executable, *extra, "-m", "benchmarks.bench_startup", "--child",
+        "--db-latency-ms", str(args.db_latency_ms), "--s3-latency-ms", str(args.s3_latency_ms),
+        "--unavailable-s", str(args.unavailable_s),
+    ]
+    return subprocess.run(command, cwd=PROJECT_DIR, capture_output=True, text=True, check=True)
+
+
+def summary(values: List[float]) -> Dict[str, float]:
+    return {
+        "median": round(statistics.median(values), 3),
+        "min": round(min(values), 3),
+        "max": round(max(values), 3),
+    }
+
+
+def import_profile(args, count: int) -> List[Dict[str, Any]]:
+    """The slowest modules ``main`` imports directly, by cumulative import time"""
+    stderr = spawn(args, ["-X", "importtime"]).stderr
+    entries, in_main = [], False
+    # Children are listed before their parent, so walk up from main's own line
+    for line in reversed(stderr.splitlines()):
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if name.strip() == "main":
+            in_main, main_depth = True, depth
+            continue
+        if in_main and depth <= main_depth:
+            break
+        if in_main and depth == main_depth + 1:
+            entries.append({"module": name.strip(), "cumulative_s": int(cumulative) / 1e6})
+    entries.sort(key=lambda entry: entry["cumulative_s"], reverse=True)
+    return [{**entry, "cumulative_s": round(entry["cumulative_s"], 3)} for entry in entries[:count]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--db-latency-ms", type=float, default=20.0)
+    parser.add_argument("--s3-latency-ms", type=float, default=20.0)
+    parser.add_argument("--unavailable-s", type=float, default=0.0,
+                        help="MongoDB refuses pings for this long after the import")
+    parser.add_argument("--import-profile", type=int, default=0, metavar="N",
+                        help="also list the N slowest modules imported by main")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child(args)))
+        return
+
+    runs = []
+    for _ in range(args.runs):
+        began = time.perf_counter()
+        result = json.loads(spawn(args).stdout.strip().splitlines()[-1])
+        result["process_s"] = time.perf_counter() - began
+        runs.append(result)
+    report = {
+        metric: summary([run[metric] for run in runs])
+        for metric in ("import_s", "startup_s", "cold_start_s", "process_s")
+    }
+    report["steps_s"] = {
+        step: summary([run["steps_s"][step] for run in runs]) for step in STEPS
+    }
+    if args.import_profile:
+        report["import_profile"] = import_profile(args, args.import_profile)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,580 @@
+"""In-process stand-ins for MongoDB and MinIO, for offline benchmarks.
+
+``FakeMongoClient`` serves the subset of the async pymongo API the backend
+uses: filters with the operators our queries need, dotted paths through
+subdocuments and arrays, projections, sort/limit/skip, the update operators we
+issue, ``bulk_write`` of pymongo write models, and upserts. Collections keep
+hash indexes on the fields our real indexes lead with, so a lookup touches the
+candidates of its most selective indexed condition instead of every document.
+Sorting is still done in Python, so it costs more than walking a real
+compound index.
+
+``FakeMinio`` keeps objects in memory and serves the ``Minio`` calls used on
+the upload and download paths.
+
+Both can add a fixed latency per call. The work done in them, not counting
+that latency, is added to ``store_time`` when a caller has opened one, so a
+benchmark can tell the app's own cost apart from the stand-ins'.
+"""
+import asyncio
+import copy
+import hashlib
+import heapq
+import io
+import itertools
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.results import BulkWriteResult
+
+store_time: ContextVar[Optional[List[float]]] = ContextVar("store_time", default=None)
+
+INDEXED_FIELDS = {
+    "files": ("user_id", "file_id", "folder_id", "name_grams"),
+    "folders": ("user_id", "folder_id", "parent_folder_id", "name_grams"),
+    "users": ("email",),
+    "upload_sessions": ("user_id",),
+    "jobs": ("job_id",),
+}
+
+_MISSING = object()
+
+
+def _charge(seconds: float):
+    spent = store_time.get()
+    if spent is not None:
+        spent[0] += seconds
+
+
+def _values(doc: Any, path: List[str]) -> List[Any]:
+    """Every value at a dotted path, descending into arrays like MongoDB"""
+    if not path:
+        return [doc]
+    if len(path) == 1 and isinstance(doc, dict):
+        return [doc.get(path[0], _MISSING)]
+    if isinstance(doc, list):
+        return [value for item in doc for value in _values(item, path)]
+    if not isinstance(doc, dict) or path[0] not in doc:
+        return [_MISSING]
+    return _values(doc[path[0]], path[1:])
+
+
+def _candidates(doc: Dict[str, Any], field: str) -> List[Any]:
+    found = _values(doc, field.split("."))
+    flat = []
+    for value in found:
+        # A condition on an array field matches any of its elements, or the array itself
+        if isinstance(value, list):
+            flat.extend(value)
+        flat.append(value)
+    return flat
+
+
+def _type_order(value: Any):
+    if value is _MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (5, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, ObjectId):
+        return (3, str(value))
+    if isinstance(value, datetime):
+        return (4, value)
+    return (6, repr(value))
+
+
+def _compare(op: str, value: Any, operand: Any) -> bool:
+    if value is _MISSING or value is None or operand is None:
+        return False
+    a, b = _type_order(value), _type_order(operand)
+    if a[0] != b[0]:
+        return False
+    return {"$gt": a > b, "$gte": a >= b, "$lt": a < b, "$lte": a <= b}[op]
+
+
+def _matches_condition(doc: Dict[str, Any], field: str, condition: Any) -> bool:
+    values = _candidates(doc, field)
+    if not (isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition)):
+        return any(_equal(value, condition) for value in values)
+    for op, operand in condition.items():
+        if op == "$in":
+            ok = any(_equal(value, item) for value in values for item in operand)
+        elif op == "$nin":
+            ok = not any(_equal(value, item) for value in values for item in operand)
+        elif op == "$ne":
+            ok = not any(_equal(value, operand) for value in values)
+        elif op == "$exists":
+            ok = any(value is not _MISSING for value in values) == bool(operand)
+        elif op == "$all":
+            ok = all(any(_equal(value, item) for value in values) for item in operand)
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            ok = any(_compare(op, value, operand) for value in values)
+        else:
+            raise NotImplementedError(f"fake filter operator {op}")
+        if not ok:
+            return False
+    return True
+
+
+def _equal(value: Any, expected: Any) -> bool:
+    if expected is None:
+        return value is None or value is _MISSING
+    return value is not _MISSING and value == expected
+
+
+def matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, sub) for sub in condition):
+                return False
+        elif not _matches_condition(doc, key, condition):
+            return False
+    return True
+
+
+def _project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not projection:
+        return copy.deepcopy(doc)
+    include = {field.split(".")[0] for field, flag in projection.items() if flag and field != "_id"}
+    if not include:
+        excluded = {field for field, flag in projection.items() if not flag}
+        return {k: copy.deepcopy(v) for k, v in doc.items() if k not in excluded}
+    projected = {k: copy.deepcopy(doc[k]) for k in include if k in doc}
+    if projection.get("_id", 1) and "_id" in doc:
+        projected["_id"] = doc["_id"]
+    return projected
+
+
+def _set_path(doc: Dict[str, Any], field: str, value: Any):
+    *parents, last = field.split(".")
+    for part in parents:
+        doc = doc.setdefault(part, {})
+    doc[last] = value
+
+
+def _get_path(doc: Dict[str, Any], field: str, default: Any = None) -> Any:
+    for part in field.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return default
+        doc = doc[part]
+    return doc
+
+
+def _unset_path(doc: Dict[str, Any], field: str):
+    *parents, last = field.split(".")
+    for part in parents:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(last, None)
+
+
+def _apply_update(doc: Dict[str, Any], update: Dict[str, Any], inserting: bool):
+    for op, fields in update.items():
+        if op == "$set":
+            for field, value in fields.items():
+                _set_path(doc, field, copy.deepcopy(value))
+        elif op == "$setOnInsert":
+            if inserting:
+                for field, value in fields.items():
+                    _set_path(doc, field, copy.deepcopy(value))
+        elif op == "$inc":
+            for field, amount in fields.items():
+                _set_path(doc, field, _get_path(doc, field, 0) + amount)
+        elif op == "$unset":
+            for field in fields:
+                _unset_path(doc, field)
+        else:
+            raise NotImplementedError(f"fake update operator {op}")
+
+
+def _sort_key(fields: List[str]):
+    paths = [field.split(".") for field in fields]
+
+    def key(doc):
+        return [_type_order(_values(doc, path)[0]) for path in paths]
+    return key
+
+
+def _sorted(docs: List[Dict[str, Any]], spec: Optional[List[tuple]], count: int = 0) -> List[Dict[str, Any]]:
+    """``docs`` in ``spec`` order; with ``count``, only the first ``count`` are guaranteed"""
+    if not spec:
+        return docs
+    directions = {direction for _, direction in spec}
+    if len(directions) == 1:
+        key = _sort_key([field for field, _ in spec])
+        if count and count < len(docs):
+            # A page out of a big folder: no need to order the rest
+            pick = heapq.nlargest if directions.pop() < 0 else heapq.nsmallest
+            return pick(count, docs, key=key)
+        return sorted(docs, key=key, reverse=directions.pop() < 0)
+    # Stable sorts from the last key to the first honour mixed directions
+    for field, direction in reversed(spec):
+        docs = sorted(docs, key=_sort_key([field]), reverse=direction < 0)
+    return docs
+
+
+class FakeCursor:
+    def __init__(self, collection: "FakeCollection", docs_factory):
+        self._collection = collection
+        self._docs_factory = docs_factory
+
+    async def _materialize(self) -> List[Dict[str, Any]]:
+        return await self._collection._call(self._docs_factory)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in await self._materialize():
+            yield doc
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        docs = await self._materialize()
+        return docs if length is None else docs[:length]
+
+
+class FakeCollection:
+    def __init__(self, name: str, latency: float = 0.0, indexed: Iterable[str] = ()):
+        self.name = name
+        self.latency = latency
+        self.docs: Dict[Any, Dict[str, Any]] = {}
+        self.indexed = tuple(indexed)
+        self._index: Dict[str, Dict[Any, set]] = {field: {} for field in self.indexed}
+        self.calls = 0
+
+    async def _call(self, work):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        began = time.perf_counter()
+        try:
+            return work()
+        finally:
+            _charge(time.perf_counter() - began)
+
+    # Indexes
+
+    @staticmethod
+    def _index_keys(value: Any) -> List[Any]:
+        if value is _MISSING:
+            return [None]
+        if isinstance(value, list):
+            return value or [None]
+        return [value]
+
+    def _reindex(self, doc: Dict[str, Any], add: bool):
+        for field in self.indexed:
+            for value in _values(doc, field.split(".")):
+                for key in self._index_keys(value):
+                    try:
+                        bucket = self._index[field].setdefault(key, set()) if add else self._index[field].get(key)
+                    except TypeError:
+                        continue
+                    if bucket is None:
+                        continue
+                    if add:
+                        bucket.add(doc["_id"])
+                    else:
+                        bucket.discard(doc["_id"])
+
+    def _lookup(self, query: Dict[str, Any]):
+        """Candidate documents for ``query``, and what is left of it to match.
+
+        Plain equality on indexed fields is answered by the indexes alone, so
+        those conditions are dropped from what is left.
+        """
+        if "_id" in query and not isinstance(query["_id"], dict):
+            doc = self.docs.get(query["_id"])
+            return ([doc] if doc is not None else []), query
+        best, covered = None, set()
+        for field in self.indexed:
+            if field not in query:
+                continue
+            condition = query[field]
+            try:
+                if isinstance(condition, dict) and condition.keys() == {"$in"}:
+                    keys = condition["$in"]
+                    ids = set().union(*(self._index[field].get(key, set()) for key in keys))
+                elif isinstance(condition, dict) and condition.get("$all"):
+                    ids = self._index[field].get(condition["$all"][0], set())
+                elif isinstance(condition, dict):
+                    continue
+                else:
+                    ids = self._index[field].get(condition, set())
+                    covered.add(field)
+            except TypeError:
+                # Unhashable operand: leave it to the full match
+                continue
+            best = ids if best is None else best & ids
+        if best is None:
+            return list(self.docs.values()), query
+        residual = {key: value for key, value in query.items() if key not in covered}
+        return [self.docs[doc_id] for doc_id in best], residual
+
+    def _find(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        candidates, residual = self._lookup(query or {})
+        if not residual:
+            return candidates
+        return [doc for doc in candidates if matches(doc, residual)]
+
+    # Writes
+
+    def _insert(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self.docs:
+            raise ValueError(f"duplicate _id in {self.name}")
+        self.docs[doc["_id"]] = doc
+        self._reindex(doc, add=True)
+        return doc
+
+    def _update(self, doc: Dict[str, Any], update: Dict[str, Any], inserting: bool = False):
+        self._reindex(doc, add=False)
+        _apply_update(doc, update, inserting)
+        self._reindex(doc, add=True)
+
+    def _upsert(self, query: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+        seed = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+        doc = self._insert(seed)
+        self._update(doc, update, inserting=True)
+        return doc
+
+    def _update_matching(self, query, update, upsert=False, many=False):
+        found = self._find(query)
+        if not many:
+            found = found[:1]
+        for doc in found:
+            self._update(doc, update)
+        upserted_id = None
+        if not found and upsert:
+            upserted_id = self._upsert(query, update)["_id"]
+        return SimpleNamespace(matched_count=len(found), modified_count=len(found),
+                               upserted_id=upserted_id, acknowledged=True)
+
+    def _delete(self, query, many=False):
+        found = self._find(query)
+        if not many:
+            found = found[:1]
+        for doc in found:
+            self._reindex(doc, add=False)
+            del self.docs[doc["_id"]]
+        return SimpleNamespace(deleted_count=len(found), acknowledged=True)
+
+    # Public API
+
+    def find(self, query=None, projection=None, sort=None, limit=0, skip=0, **kwargs):
+        def work():
+            docs = _sorted(self._find(query or {}), sort, skip + limit if limit else 0)[skip:]
+            if limit:
+                docs = docs[:limit]
+            return [_project(doc, projection) for doc in docs]
+        return FakeCursor(self, work)
+
+    async def find_one(self, query=None, projection=None, **kwargs):
+        def work():
+            found = self._find(query or {})
+            return _project(found[0], projection) if found else None
+        return await self._call(work)
+
+    async def count_documents(self, query, **kwargs):
+        return await self._call(lambda: len(self._find(query)))
+
+    async def insert_one(self, doc, **kwargs):
+        def work():
+            inserted = self._insert(doc)
+            doc.setdefault("_id", inserted["_id"])
+            return SimpleNamespace(inserted_id=inserted["_id"], acknowledged=True)
+        return await self._call(work)
+
+    async def insert_many(self, docs, **kwargs):
+        def work():
+            return SimpleNamespace(inserted_ids=[self._insert(doc)["_id"] for doc in docs])
+        return await self._call(work)
+
+    async def update_one(self, query, update, upsert=False, **kwargs):
+        return await self._call(lambda: self._update_matching(query, update, upsert))
+
+    async def update_many(self, query, update, upsert=False, **kwargs):
+        return await self._call(lambda: self._update_matching(query, update, upsert, many=True))
+
+    async def delete_one(self, query, **kwargs):
+        return await self._call(lambda: self._delete(query))
+
+    async def delete_many(self, query, **kwargs):
+        return await self._call(lambda: self._delete(query, many=True))
+
+    async def find_one_and_update(self, query, update, projection=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE, sort=None, **kwargs):
+        def work():
+            found = _sorted(self._find(query), sort)[:1]
+            if not found:
+                if not upsert:
+                    return None
+                inserted = self._upsert(query, update)
+                return _project(inserted, projection) if return_document else None
+            before = _project(found[0], projection)
+            self._update(found[0], update)
+            return _project(found[0], projection) if return_document else before
+        return await self._call(work)
+
+    async def find_one_and_delete(self, query, projection=None, **kwargs):
+        def work():
+            found = self._find(query)[:1]
+            if not found:
+                return None
+            self._delete({"_id": found[0]["_id"]})
+            return _project(found[0], projection)
+        return await self._call(work)
+
+    async def create_indexes(self, models, **kwargs):
+        return await self._call(lambda: [model.document["name"] for model in models])
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        def work():
+            counts = {"nInserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0,
+                      "nUpserted": 0, "upserted": [], "writeErrors": [], "writeConcernErrors": []}
+            for request in requests:
+                if isinstance(request, InsertOne):
+                    self._insert(request._doc)
+                    counts["nInserted"] += 1
+                elif isinstance(request, (UpdateOne, UpdateMany)):
+                    result = self._update_matching(request._filter, request._doc, bool(request._upsert),
+                                                   many=isinstance(request, UpdateMany))
+                    counts["nMatched"] += result.matched_count
+                    counts["nModified"] += result.modified_count
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    counts["nRemoved"] += self._delete(request._filter, many=isinstance(request, DeleteMany)).deleted_count
+                else:
+                    raise NotImplementedError(f"fake bulk write {type(request).__name__}")
+            return BulkWriteResult(counts, True)
+        return await self._call(work)
+
+
+class FakeDatabase:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name, self.latency, INDEXED_FIELDS.get(name, ()))
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+class FakeMongoClient:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.db = FakeDatabase(latency)
+        self.admin = SimpleNamespace(command=self._command)
+
+    async def _command(self, *args, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return {"ok": 1}
+
+    def __getitem__(self, name: str) -> FakeDatabase:
+        return self.db
+
+    async def close(self):
+        pass
+
+
+class _ObjectResponse(io.BytesIO):
+    def release_conn(self):
+        pass
+
+    def stream(self, amt: int = 64 * 1024):
+        while True:
+            chunk = self.read(amt)
+            if not chunk:
+                break
+            yield chunk
+
+
+class FakeMinio:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.objects: Dict[str, Dict[str, Any]] = {}
+        self._etags = itertools.count()
+
+    def _call(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return time.perf_counter()
+
+    def bucket_exists(self, bucket_name):
+        _charge(time.perf_counter() - self._call())
+        return True
+
+    def make_bucket(self, bucket_name):
+        pass
+
+    def put_object(self, bucket_name, object_name, data, length, content_type="application/octet-stream",
+                   part_size=0, **kwargs):
+        began = self._call()
+        chunks = []
+        while True:
+            chunk = data.read(part_size or 1 << 20) if length < 0 else data.read(length)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            if length >= 0:
+                break
+        self.put_bytes(object_name, b"".join(chunks), content_type)
+        _charge(time.perf_counter() - began)
+        return SimpleNamespace(bucket_name=bucket_name, object_name=object_name,
+                               etag=self.objects[object_name]["etag"])
+
+    def put_bytes(self, object_name: str, data: bytes, content_type: str = "application/octet-stream"):
+        self.objects[object_name] = {
+            "data": data,
+            "content_type": content_type,
+            "etag": hashlib.md5(data).hexdigest(),
+            "last_modified": datetime.utcnow(),
+        }
+
+    def _get(self, object_name):
+        if object_name not in self.objects:
+            from minio.error import S3Error
+            raise S3Error(code="NoSuchKey", message="Object does not exist", resource=object_name,
+                          request_id=None, host_id=None, response=None)
+        return self.objects[object_name]
+
+    def get_object(self, bucket_name, object_name, offset=0, length=0, **kwargs):
+        began = self._call()
+        data = self._get(object_name)["data"]
+        end = offset + length if length else len(data)
+        _charge(time.perf_counter() - began)
+        return _ObjectResponse(data[offset:end])
+
+    def stat_object(self, bucket_name, object_name, **kwargs):
+        began = self._call()
+        obj = self._get(object_name)
+        _charge(time.perf_counter() - began)
+        return SimpleNamespace(object_name=object_name, size=len(obj["data"]), etag=obj["etag"],
+                               content_type=obj["content_type"], last_modified=obj["last_modified"])
+
+    def remove_object(self, bucket_name, object_name, **kwargs):
+        self.objects.pop(object_name, None)
+
+    def remove_objects(self, bucket_name, delete_object_list, **kwargs):
+        for obj in delete_object_list:
+            self.objects.pop(getattr(obj, "name", None) or obj._name, None)
+        return iter([])
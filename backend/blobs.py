@@ -0,0 +1,278 @@
+"""Content-addressed, reference-counted object storage.
+
+With ``CONTENT_ADDRESSED_STORAGE`` on, a streamed upload is staged under
+``staging/<file_id>`` while it is hashed, then adopted as ``blobs/<sha256>``:
+if that blob already exists the staged copy is dropped, otherwise it is copied
+server-side into place. The ``blobs`` collection keeps one document per digest
+with its size and ``refcount``; file documents point at their blob through
+``object_name``. Deleting a file releases one reference and the blob is
+removed once none remain.
+
+Collecting a blob and adopting a new copy of the same bytes must not
+interleave, or the adopter's fresh reference would point at an object the
+collector is about to remove. The collector first marks the unreferenced blob
+document ``collecting``, removes the object, then deletes the document. An
+adopter can neither reference a marked blob nor upsert over it (the upsert
+hits the existing ``_id``), so it waits for the collection to finish and
+copies again. An adopter whose upsert created the document checks the object
+is there, in case a whole collection ran between its copy and its claim.
+
+Files without ``object_name`` (stored before this mode, or through upload
+sessions and presigned uploads) keep using their ``file_id`` as the key.
+
+Derivatives such as thumbnails live under ``derivatives/<object key>/`` and
+are removed together with the object they were rendered from.
+
+``python blobs.py --stats`` prints the dedup ratio and bytes saved.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from object_store import ObjectNotFoundError, StorageError
+from storage import StoredObject, run_storage_io
+
+logger = logging.getLogger(__name__)
+
+BLOB_PREFIX = "blobs/"
+STAGING_PREFIX = "staging/"
+DERIVATIVE_PREFIX = "derivatives/"
+COLLECTION_POLL_INTERVAL = 0.05  # seconds an adopter waits between checks on a collection
+STALE_COLLECTION = 300  # seconds after which an unfinished collection is presumed abandoned
+
+
+def blob_key(sha256: str) -> str:
+    return f"{BLOB_PREFIX}{sha256}"
+
+
+def staging_key(file_id: str) -> str:
+    return f"{STAGING_PREFIX}{file_id}"
+
+
+def object_key(file_doc: Dict[str, Any]) -> str:
+    """Storage key holding a file's bytes"""
+    return file_doc.get("object_name") or file_doc["file_id"]
+
+
+def thumbnail_key(key: str) -> str:
+    """Storage key of the thumbnail rendered from the object at ``key``"""
+    return f"{DERIVATIVE_PREFIX}{key}/thumbnail.jpg"
+
+
+def _derived_keys(key: str, file_doc: Dict[str, Any]) -> List[str]:
+    # Only files queued for a thumbnail can have one; a blob may have one
+    # from any of the files that shared it
+    if key.startswith(BLOB_PREFIX) or "thumbnail" in file_doc:
+        return [thumbnail_key(key)]
+    return []
+
+
+async def _remove(store, key: str, derived: List[str]) -> bool:
+    """Remove an object and its derivatives; True if the object itself went"""
+    if not derived:
+        await run_storage_io(store.remove, key)
+        return True
+    errors = await run_storage_io(store.remove_many, [key, *derived])
+    for error in errors:
+        logger.warning(f"Failed to remove object {error.name}: {error.message}")
+    return all(error.name != key for error in errors)
+
+
+async def _exists(store, key: str) -> bool:
+    try:
+        await run_storage_io(store.stat, key)
+        return True
+    except ObjectNotFoundError:
+        return False
+
+
+async def _wait_for_collection(blobs_collection, sha256: str) -> None:
+    while True:
+        blob = await blobs_collection.find_one({"_id": sha256}, {"collecting": 1})
+        if blob is None or "collecting" not in blob:
+            return
+        if (datetime.utcnow() - blob["collecting"]).total_seconds() > STALE_COLLECTION:
+            # The collector went away part way; the adopter copies the bytes again anyway
+            logger.warning(f"Abandoning stale collection of blob {sha256}")
+            await blobs_collection.delete_one({"_id": sha256, "collecting": blob["collecting"]})
+            return
+        await asyncio.sleep(COLLECTION_POLL_INTERVAL)
+
+
+async def _mark_collecting(blobs_collection, sha256: str, now: datetime) -> bool:
+    """Claim an unreferenced blob for removal; False if it was re-referenced or is taken"""
+    marked = await blobs_collection.find_one_and_update(
+        {"_id": sha256, "refcount": {"$lte": 0}, "collecting": {"$exists": False}},
+        {"$set": {"collecting": now}},
+    )
+    return marked is not None
+
+
+async def adopt_staged_object(
+    blobs_collection, store, staged_key: str, stored: StoredObject
+) -> Tuple[str, bool, Optional[Dict[str, Any]]]:
+    """Turn a staged upload into a reference to its blob.
+
+    Returns the blob key, whether the bytes were already stored, and how the
+    blob is compressed (which, for an existing blob, is how it was first stored).
+    """
+    key = blob_key(stored.sha256)
+    while True:
+        existing = await blobs_collection.find_one_and_update(
+            {"_id": stored.sha256, "refcount": {"$gt": 0}},
+            {"$inc": {"refcount": 1}},
+        )
+        if existing is not None:
+            break
+        # Copying onto the digest key is idempotent, so racing first uploads
+        # of the same bytes are harmless; count the reference once it exists
+        await run_storage_io(store.copy, staged_key, key)
+        blob = {"size": stored.size, "created_at": datetime.utcnow()}
+        if stored.compression:
+            blob["compression"] = stored.compression
+        try:
+            result = await blobs_collection.update_one(
+                {"_id": stored.sha256, "collecting": {"$exists": False}},
+                {"$inc": {"refcount": 1}, "$setOnInsert": blob},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Being collected, possibly after our copy: wait, then copy again
+            await _wait_for_collection(blobs_collection, stored.sha256)
+            continue
+        if result.upserted_id is not None and not await _exists(store, key):
+            # A collection finished between our copy and our claim; now that
+            # the blob is referenced again nothing else will remove it
+            await run_storage_io(store.copy, staged_key, key)
+        break
+    await run_storage_io(store.remove, staged_key)
+    if existing is None:
+        return key, False, stored.compression
+    return key, True, existing.get("compression")
+
+
+async def release_object(blobs_collection, store, file_doc: Dict[str, Any]) -> bool:
+    """Drop a deleted file's claim on its bytes; True if an object was removed"""
+    key = object_key(file_doc)
+    try:
+        if not key.startswith(BLOB_PREFIX):
+            return await _remove(store, key, _derived_keys(key, file_doc))
+        sha256 = key[len(BLOB_PREFIX):]
+        blob = await blobs_collection.find_one_and_update(
+            {"_id": sha256},
+            {"$inc": {"refcount": -1}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if blob is None or blob["refcount"] > 0:
+            return False
+        # Only collect if nobody re-referenced it in the meantime
+        now = datetime.utcnow()
+        if not await _mark_collecting(blobs_collection, sha256, now):
+            return False
+        try:
+            return await _remove(store, key, _derived_keys(key, file_doc))
+        finally:
+            await blobs_collection.delete_one({"_id": sha256, "collecting": now})
+    except StorageError:
+        # Already gone from storage; the metadata is what matters
+        return False
+
+
+async def release_objects(blobs_collection, store, file_docs: List[Dict[str, Any]]) -> int:
+    """Batched ``release_object``: one refcount bulk_write, one multi-object delete.
+
+    Returns the number of objects removed from storage.
+    """
+    doomed: List[str] = []
+    derived: List[str] = []
+    collecting: List[str] = []
+    references: Counter = Counter()
+    for file_doc in file_docs:
+        key = object_key(file_doc)
+        if key.startswith(BLOB_PREFIX):
+            references[key[len(BLOB_PREFIX):]] += 1
+        else:
+            doomed.append(key)
+            derived.extend(_derived_keys(key, file_doc))
+
+    if references:
+        await blobs_collection.bulk_write(
+            [UpdateOne({"_id": sha256}, {"$inc": {"refcount": -count}})
+             for sha256, count in references.items()],
+            ordered=False,
+        )
+        unreferenced = blobs_collection.find(
+            {"_id": {"$in": list(references)}, "refcount": {"$lte": 0}}, {"_id": 1}
+        )
+        now = datetime.utcnow()
+        async for blob in unreferenced:
+            if await _mark_collecting(blobs_collection, blob["_id"], now):
+                collecting.append(blob["_id"])
+                key = blob_key(blob["_id"])
+                doomed.append(key)
+                derived.append(thumbnail_key(key))
+
+    if not doomed:
+        return 0
+    try:
+        errors = await run_storage_io(store.remove_many, doomed + derived)
+    finally:
+        if collecting:
+            await blobs_collection.delete_many({"_id": {"$in": collecting}, "collecting": now})
+    for error in errors:
+        logger.warning(f"Failed to remove object {error.name}: {error.message}")
+    failed = {error.name for error in errors}
+    return sum(1 for key in doomed if key not in failed)
+
+
+async def dedup_stats(blobs_collection) -> Dict[str, Any]:
+    """Logical (referenced) vs. physical (unique) vs. stored (compressed) bytes across all blobs"""
+    totals = {"blobs": 0, "references": 0, "physical_bytes": 0, "logical_bytes": 0, "stored_bytes": 0}
+    cursor = await blobs_collection.aggregate([
+        {"$group": {
+            "_id": None,
+            "blobs": {"$sum": 1},
+            "references": {"$sum": "$refcount"},
+            "physical_bytes": {"$sum": "$size"},
+            # What the blobs take up in storage, after at-rest compression
+            "stored_bytes": {"$sum": {"$ifNull": ["$compression.stored_size", "$size"]}},
+            "logical_bytes": {"$sum": {"$multiply": ["$refcount", "$size"]}},
+        }},
+    ])
+    async for row in cursor:
+        totals.update({k: v for k, v in row.items() if k != "_id"})
+    physical = totals["physical_bytes"]
+    return {
+        **totals,
+        "bytes_saved": totals["logical_bytes"] - physical,
+        "dedup_ratio": round(totals["logical_bytes"] / physical, 4) if physical else 1.0,
+    }
+
+
+async def main() -> int:
+    from pymongo import AsyncMongoClient
+    from config import settings
+
+    client = AsyncMongoClient(settings.MONGODB_URL)
+    try:
+        stats = await dedup_stats(client[settings.MONGODB_DB_NAME].blobs)
+        print(json.dumps(stats, indent=2))
+        return 0
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Content-addressed storage maintenance")
+    parser.add_argument("--stats", action="store_true",
+                        help="print dedup ratio and bytes saved")
+    if not parser.parse_args().stats:
+        parser.print_help()
+        sys.exit(0)
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,173 @@
+"""Transparent at-rest compression of compressible uploads.
+
+With ``COMPRESSION_ENABLED``, an upload streamed through the API whose content
+type is text-like (``text/*``, JSON, XML, JavaScript, SVG, legacy binary
+Office formats, ...) is sampled before it is stored: its first
+``COMPRESSION_SAMPLE_SIZE`` bytes are compressed, and only if that saves at
+least ``COMPRESSION_MIN_SAVINGS`` percent is the whole stream compressed with
+zstd on its way to storage. Anything else is stored as sent.
+
+A compressed file's document records ``compression: {"codec": "zstd",
+"stored_size": n}``. ``size`` and ``sha256`` stay those of the original bytes,
+so listings, quotas, ETags and deduplication are unaffected; with
+content-addressed storage the blob document carries the same field and every
+file sharing the blob copies it.
+
+``open_stored`` reads original bytes back, decompressing on the fly; a range
+is served by skipping ahead in the decompressed stream. Downloads whose
+``Accept-Encoding`` allows zstd get the stored bytes as they are, with
+``Content-Encoding: zstd``.
+
+Upload sessions and presigned uploads go from the client straight to storage
+and are never compressed. The ``zstandard`` package is optional: without it
+nothing is compressed, and files stored compressed cannot be read.
+"""
+from typing import Any, BinaryIO, Dict, Optional
+from storage import HashingReader, StoredObject
+
+try:
+    import zstandard
+except ImportError:  # optional dependency: uploads are stored as sent without it
+    zstandard = None
+
+ZSTD = "zstd"
+
+COMPRESSIBLE_TYPES = {
+    "application/json", "application/xml", "application/javascript", "application/x-javascript",
+    "application/ecmascript", "application/x-ndjson", "application/yaml", "application/x-yaml",
+    "application/toml", "application/sql", "application/rtf", "application/x-sh",
+    "application/x-tar", "application/postscript", "image/svg+xml",
+    # Pre-OOXML Office files are not compressed internally
+    "application/msword", "application/vnd.ms-excel", "application/vnd.ms-powerpoint",
+}
+COMPRESSIBLE_TYPE_PREFIXES = ("text/",)
+COMPRESSIBLE_TYPE_SUFFIXES = ("+json", "+xml")
+SKIP_CHUNK = 256 * 1024
+
+
+def compressible_type(content_type: Optional[str]) -> bool:
+    media_type = (content_type or "").split(";", 1)[0].strip().lower()
+    return (
+        media_type in COMPRESSIBLE_TYPES
+        or media_type.startswith(COMPRESSIBLE_TYPE_PREFIXES)
+        or media_type.endswith(COMPRESSIBLE_TYPE_SUFFIXES)
+    )
+
+
+def accepts_encoding(accept_encoding: Optional[str], coding: str) -> bool:
+    """Whether an ``Accept-Encoding`` header allows ``coding`` (q-values honoured)"""
+    wildcard = None
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name == coding:
+            return quality > 0
+        if name == "*":
+            wildcard = quality > 0
+    return bool(wildcard)
+
+
+class _Prefixed:
+    """File-like that replays already-read ``head`` bytes before the rest of ``stream``"""
+
+    def __init__(self, head: bytes, stream):
+        self._head = head
+        self._stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._head:
+            return self._stream.read(size)
+        if size < 0:
+            data, self._head = self._head + self._stream.read(), b""
+            return data
+        data, self._head = self._head[:size], self._head[size:]
+        return data
+
+
+class Compressor:
+    """Stores uploads, compressing the ones that are worth it"""
+
+    def __init__(self, enabled: bool = True, level: int = 3, sample_size: int = 64 * 1024,
+                 min_savings: int = 10):
+        self.enabled = enabled and zstandard is not None
+        self.level = level
+        self.sample_size = sample_size
+        self.min_savings = min_savings
+
+    def _worth_compressing(self, sample: bytes) -> bool:
+        if not sample:
+            return False
+        compressed = zstandard.ZstdCompressor(level=self.level).compress(sample)
+        return len(compressed) * 100 <= len(sample) * (100 - self.min_savings)
+
+    def put_stream(self, store, key: str, stream: BinaryIO, content_type: Optional[str] = None,
+                   max_size: Optional[int] = None) -> StoredObject:
+        """``ObjectStore.put_stream``, sizing and hashing the original bytes either way"""
+        if not self.enabled or not compressible_type(content_type):
+            return store.put_stream(key, stream, content_type=content_type, max_size=max_size)
+        original = HashingReader(stream, max_size)
+        sample = original.read(self.sample_size)
+        source = _Prefixed(sample, original)
+        if not self._worth_compressing(sample):
+            store.put_stream(key, source, content_type=content_type)
+            return StoredObject(size=original.size, sha256=original.sha256)
+        # One compressor per upload: they are not safe to share between threads
+        compressed = zstandard.ZstdCompressor(level=self.level, write_checksum=True).stream_reader(source)
+        written = store.put_stream(key, compressed, content_type=content_type)
+        return StoredObject(
+            size=original.size, sha256=original.sha256,
+            compression={"codec": ZSTD, "stored_size": written.size},
+        )
+
+
+class _DecompressingReader:
+    """Original bytes of a compressed object, or of a range of them"""
+
+    def __init__(self, reader, offset: int = 0, length: Optional[int] = None):
+        self._reader = reader
+        self._stream = zstandard.ZstdDecompressor().stream_reader(reader, closefd=False)
+        self._skip = offset
+        self._remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        while self._skip:
+            skipped = len(self._stream.read(min(self._skip, SKIP_CHUNK)))
+            if not skipped:
+                return b""
+            self._skip -= skipped
+        if self._remaining is not None:
+            size = self._remaining if size < 0 else min(size, self._remaining)
+            if not size:
+                return b""
+        data = self._stream.read(size)
+        if self._remaining is not None:
+            self._remaining -= len(data)
+        return data
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            self._reader.close()
+
+
+def open_stored(store, key: str, compression: Optional[Dict[str, Any]], offset: int = 0,
+                length: Optional[int] = None):
+    """``ObjectStore.open`` over a file's original bytes, however they were stored"""
+    if not compression:
+        return store.open(key, offset=offset, length=length)
+    if compression["codec"] != ZSTD:
+        raise ValueError(f"Unknown compression codec {compression['codec']!r}")
+    if zstandard is None:
+        raise RuntimeError("The zstandard package is needed to read compressed files")
+    return _DecompressingReader(store.open(key), offset, length)
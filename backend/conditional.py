@@ -0,0 +1,92 @@
+"""Validators and conditional GETs (``If-None-Match`` / ``If-Modified-Since``).
+
+File bytes never change once stored, so a file's strong ETag is its SHA-256
+digest when we have one, and otherwise the ETag MinIO computed for the object.
+Listings get weak ETags from their folder version (see ``versions``) plus the
+query that shaped the page.
+
+Authenticated responses are ``private``; ``no-cache`` lets browsers keep them
+but makes them revalidate, which is a cheap 304 from here.
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, List, Optional
+
+REVALIDATE = "private, no-cache"
+
+
+def strong_etag(value: str) -> str:
+    return f'"{value}"'
+
+
+def file_etag(file_doc: Dict[str, Any]) -> Optional[str]:
+    """Strong ETag recorded for a file, if any (None means ask MinIO)"""
+    value = file_doc.get("sha256") or file_doc.get("etag")
+    return strong_etag(value) if value else None
+
+
+def listing_etag(version: int, *parts: Any) -> str:
+    """Weak ETag for a listing at ``version``, shaped by the query ``parts``"""
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+    return f'W/"{version}-{digest}"'
+
+
+def weak_etag(etag: str) -> str:
+    """Weak form of ``etag``, for a content-coded variant of the same bytes"""
+    return etag if etag.startswith("W/") else f"W/{etag}"
+
+
+def parse_etags(header: str) -> List[str]:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def _opaque(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def none_match(if_none_match: str, etag: Optional[str]) -> bool:
+    """False when ``If-None-Match`` matches ``etag`` (weak comparison)"""
+    tags = parse_etags(if_none_match)
+    if "*" in tags:
+        # Matches any current representation, and the resource exists
+        return False
+    if etag is None:
+        return True
+    return all(_opaque(tag) != _opaque(etag) for tag in tags)
+
+
+def modified_since(if_modified_since: str, last_modified: Optional[datetime]) -> bool:
+    """False when the resource is no newer than ``If-Modified-Since``"""
+    if last_modified is None:
+        return True
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return True
+    if since is None:
+        return True
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    # HTTP-dates have one-second resolution
+    return last_modified.replace(microsecond=0) > since
+
+
+def is_not_modified(
+    headers,
+    etag: Optional[str] = None,
+    last_modified: Optional[datetime] = None,
+) -> bool:
+    """Whether a GET with these request ``headers`` should get a 304.
+
+    ``If-Modified-Since`` only counts when there is no ``If-None-Match``.
+    """
+    if_none_match = headers.get("if-none-match")
+    if if_none_match:
+        return not none_match(if_none_match, etag)
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        return not modified_since(if_modified_since, last_modified)
+    return False
@@ -7,6 +7,14 @@ class Settings:
     MONGODB_URL: str = os.getenv(
         "MONGODB_URL", "mongodb://localhost:27017/filemanager")
     MONGODB_DB_NAME: str = "filemanager"
+    MONGODB_MAX_POOL_SIZE: int = int(os.getenv("MONGODB_MAX_POOL_SIZE", 100))  # connections per worker
+    MONGODB_MIN_POOL_SIZE: int = int(os.getenv("MONGODB_MIN_POOL_SIZE", 0))  # kept open while idle
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS: int = int(
+        os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", 30000))
+
+    # Object storage: "minio", or "local" for files on this host's disk
+    STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "minio").lower()
+    LOCAL_STORAGE_PATH: str = os.getenv("LOCAL_STORAGE_PATH", "/data/files")
 
     # MinIO
     MINIO_ENDPOINT: str = os.getenv("MINIO_ENDPOINT", "localhost:9000")
@@ -14,6 +22,26 @@ class Settings:
     MINIO_SECRET_KEY: str = os.getenv("MINIO_SECRET_KEY", "minioadmin")
     MINIO_BUCKET_NAME: str = os.getenv("MINIO_BUCKET_NAME", "files")
     MINIO_SECURE: bool = False
+    STORAGE_IO_WORKERS: int = int(os.getenv("STORAGE_IO_WORKERS", 16))
+    # Pooled HTTP connections to MinIO; fewer than STORAGE_IO_WORKERS means reconnecting under load
+    MINIO_MAX_POOL_SIZE: int = int(os.getenv("MINIO_MAX_POOL_SIZE", STORAGE_IO_WORKERS))
+    MINIO_REGION: str = os.getenv("MINIO_REGION", "us-east-1")
+
+    # Presigned URLs (direct-to-MinIO transfers)
+    PRESIGNED_URLS_ENABLED: bool = os.getenv(
+        "PRESIGNED_URLS_ENABLED", "false").lower() == "true"
+    # Host clients use to reach MinIO; presigned signatures cover the host
+    MINIO_PUBLIC_ENDPOINT: str = os.getenv(
+        "MINIO_PUBLIC_ENDPOINT", os.getenv("MINIO_ENDPOINT", "localhost:9000"))
+    MINIO_PUBLIC_SECURE: bool = os.getenv(
+        "MINIO_PUBLIC_SECURE", "false").lower() == "true"
+    PRESIGNED_URL_EXPIRY: int = int(
+        os.getenv("PRESIGNED_URL_EXPIRY", 15 * 60))  # seconds
+
+    # Startup: each step (MongoDB, object storage) is retried
+    # this many times, waiting STARTUP_RETRY_DELAY seconds and doubling
+    STARTUP_RETRIES: int = int(os.getenv("STARTUP_RETRIES", 5))
+    STARTUP_RETRY_DELAY: float = float(os.getenv("STARTUP_RETRY_DELAY", 0.5))
 
     # API
     API_V1_STR: str = "/api"
@@ -23,6 +51,16 @@ class Settings:
 
     # File Upload
     MAX_FILE_SIZE: int = 100 * 1024 * 1024  # 100MB
+    # Store streamed uploads once per sha256 digest, shared by reference
+    CONTENT_ADDRESSED_STORAGE: bool = os.getenv(
+        "CONTENT_ADDRESSED_STORAGE", "false").lower() == "true"
+    UPLOAD_PART_SIZE: int = int(
+        os.getenv("UPLOAD_PART_SIZE", 8 * 1024 * 1024))  # 8MB, >= MinIO's 5MB minimum
+    MIN_UPLOAD_PART_SIZE: int = 5 * 1024 * 1024  # S3 minimum for all but the last part
+    # Upload session parts are held in memory while they are stored
+    MAX_UPLOAD_PART_SIZE: int = int(
+        os.getenv("MAX_UPLOAD_PART_SIZE", 64 * 1024 * 1024))  # 64MB
+    MAX_UPLOAD_PARTS: int = 10000
     ALLOWED_EXTENSIONS: set = {
         'jpg', 'jpeg', 'png', 'gif', 'webp', 'svg',
         'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt',
@@ -31,6 +69,67 @@ class Settings:
         'py', 'js', 'html', 'md'
     }
 
+    # At-rest compression of text-like uploads (zstd; needs zstandard)
+    COMPRESSION_ENABLED: bool = os.getenv(
+        "COMPRESSION_ENABLED", "false").lower() == "true"
+    COMPRESSION_LEVEL: int = int(os.getenv("COMPRESSION_LEVEL", 3))
+    COMPRESSION_SAMPLE_SIZE: int = int(
+        os.getenv("COMPRESSION_SAMPLE_SIZE", 64 * 1024))  # bytes tried before committing
+    COMPRESSION_MIN_SAVINGS: int = int(
+        os.getenv("COMPRESSION_MIN_SAVINGS", 10))  # percent the sample must shrink by
+
+    # Resumable upload sessions
+    UPLOAD_SESSION_TTL: int = int(
+        os.getenv("UPLOAD_SESSION_TTL", 24 * 60 * 60))  # seconds since last activity
+    UPLOAD_SESSION_SWEEP_INTERVAL: int = int(
+        os.getenv("UPLOAD_SESSION_SWEEP_INTERVAL", 10 * 60))  # seconds
+
+    # Auth
+    AUTH_CACHE_TTL: int = int(os.getenv("AUTH_CACHE_TTL", 60))  # seconds
+    AUTH_CACHE_SIZE: int = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+
+    # Password hashing (process pool)
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+    PASSWORD_HASH_QUEUE: int = int(os.getenv("PASSWORD_HASH_QUEUE", 32))
+
+    # Background jobs (recursive folder delete/move)
+    JOB_BATCH_SIZE: int = int(os.getenv("JOB_BATCH_SIZE", 1000))  # MinIO deletes up to 1000 keys per request
+
+    # Batch item operations
+    MAX_BATCH_ITEMS: int = int(os.getenv("MAX_BATCH_ITEMS", 10000))
+
+    # ZIP downloads
+    ARCHIVE_READ_AHEAD: int = int(os.getenv("ARCHIVE_READ_AHEAD", 4))  # objects opened ahead
+    ARCHIVE_COMPRESSION_LEVEL: int = int(os.getenv("ARCHIVE_COMPRESSION_LEVEL", 6))
+
+    # Thumbnails (background derivative pipeline; needs Pillow)
+    THUMBNAILS_ENABLED: bool = os.getenv(
+        "THUMBNAILS_ENABLED", "true").lower() == "true"
+    THUMBNAIL_WORKERS: int = int(os.getenv("THUMBNAIL_WORKERS", 2))  # concurrent renders per process
+    THUMBNAIL_SIZE: int = int(os.getenv("THUMBNAIL_SIZE", 256))  # px, longest side
+    THUMBNAIL_MAX_SOURCE_SIZE: int = int(
+        os.getenv("THUMBNAIL_MAX_SOURCE_SIZE", 50 * 1024 * 1024))  # larger files get no thumbnail
+    THUMBNAIL_POLL_INTERVAL: int = int(os.getenv("THUMBNAIL_POLL_INTERVAL", 30))  # seconds
+    THUMBNAIL_CLAIM_TIMEOUT: int = int(os.getenv("THUMBNAIL_CLAIM_TIMEOUT", 5 * 60))  # seconds
+
+    # Listings
+    LISTING_PAGE_SIZE: int = 50  # default when a client asks for pagination
+    MAX_PAGE_SIZE: int = 1000
+    LISTING_CACHE_SIZE: int = int(os.getenv("LISTING_CACHE_SIZE", 10000))  # entries; 0 disables
+    LISTING_CACHE_MAX_BYTES: int = int(
+        os.getenv("LISTING_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    LISTING_CACHE_TTL: int = int(os.getenv("LISTING_CACHE_TTL", 10 * 60))  # seconds
+    # Share cached listings across workers through a Redis-compatible server
+    LISTING_CACHE_REDIS_URL: str = os.getenv("LISTING_CACHE_REDIS_URL", "")
+
+    # Prometheus metrics at /metrics
+    METRICS_ENABLED: bool = os.getenv(
+        "METRICS_ENABLED", "true").lower() == "true"
+
+    # Search
+    SEARCH_CANDIDATE_LIMIT: int = int(
+        os.getenv("SEARCH_CANDIDATE_LIMIT", 1000))  # per lookup, before ranking
+
     # CORS
     CORS_ORIGINS: list = [
         "http://localhost:3000",
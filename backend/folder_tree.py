@@ -0,0 +1,194 @@
+"""Materialized ancestor paths for folders.
+
+Each folder document carries ``ancestors``: the ``{"folder_id", "name"}`` of
+every folder above it, root first. A breadcrumb (or any other path) is then a
+single indexed read of the folder itself. The list is maintained on create,
+rename and move; folders created before it existed are backfilled with
+``python folder_tree.py --backfill``.
+"""
+import argparse
+import asyncio
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import UpdateMany, UpdateOne
+from search import search_fields
+
+ANCESTRY_PROJECTION = {"folder_id": 1, "name": 1, "ancestors": 1, "parent_folder_id": 1}
+
+
+class FolderCycleError(ValueError):
+    """Raised when a folder would be moved into its own subtree"""
+
+
+def ancestor_entry(folder_doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {"folder_id": folder_doc["folder_id"], "name": folder_doc["name"]}
+
+
+def child_ancestors(parent_doc: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Ancestors of a folder created directly under ``parent_doc`` (None = root)"""
+    if parent_doc is None:
+        return []
+    return [*parent_doc.get("ancestors", []), ancestor_entry(parent_doc)]
+
+
+def breadcrumb(folder_doc: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {"folder_id": None, "name": "Home"},
+        *folder_doc.get("ancestors", []),
+        ancestor_entry(folder_doc),
+    ]
+
+
+def _descendant_rename(user_id: str, folder_id: str, name: str) -> Tuple[Dict[str, Any], Dict[str, Any], List[Dict[str, Any]]]:
+    return (
+        {"user_id": user_id, "ancestors.folder_id": folder_id},
+        {"$set": {"ancestors.$[entry].name": name}},
+        [{"entry.folder_id": folder_id}],
+    )
+
+
+async def rename_in_descendants(folders_collection, user_id: str, folder_id: str, name: str):
+    """Propagate a folder rename into the ancestor paths below it"""
+    query, update, array_filters = _descendant_rename(user_id, folder_id, name)
+    await folders_collection.update_many(query, update, array_filters=array_filters)
+
+
+def rename_operations(user_id: str, folder_id: str, name: str) -> List[Any]:
+    """bulk_write models renaming a folder and its entry in descendants' paths"""
+    query, update, array_filters = _descendant_rename(user_id, folder_id, name)
+    return [
+        UpdateOne({"user_id": user_id, "folder_id": folder_id},
+                  {"$set": {"name": name, **search_fields(name)}}),
+        UpdateMany(query, update, array_filters=array_filters),
+    ]
+
+
+def check_move(folder_doc: Dict[str, Any], new_parent_doc: Optional[Dict[str, Any]]):
+    """Raise FolderCycleError if ``new_parent_doc`` is the folder or below it"""
+    folder_id = folder_doc["folder_id"]
+    if new_parent_doc is not None and (
+        new_parent_doc["folder_id"] == folder_id
+        or any(a["folder_id"] == folder_id for a in new_parent_doc.get("ancestors", []))
+    ):
+        raise FolderCycleError("Cannot move a folder into itself")
+
+
+def subtree_filter(user_id: str, folder_ids: List[str]) -> Dict[str, Any]:
+    """Folders and everything below them, in one indexed query"""
+    return {"user_id": user_id, "$or": [
+        {"folder_id": {"$in": folder_ids}},
+        {"ancestors.folder_id": {"$in": folder_ids}},
+    ]}
+
+
+async def rebase_subtree(
+    folders_collection,
+    user_id: str,
+    folder_doc: Dict[str, Any],
+    new_parent_doc: Optional[Dict[str, Any]],
+):
+    """Move ``folder_doc`` under ``new_parent_doc`` (None = root).
+
+    Rewrites the folder's own ancestors and, in one update, the shared prefix
+    of every descendant's ancestors.
+    """
+    check_move(folder_doc, new_parent_doc)
+    own, descendants = _rebase_updates(user_id, folder_doc, new_parent_doc)
+    await folders_collection.update_one(*own)
+    await folders_collection.update_many(*descendants)
+
+
+def rebase_operations(
+    user_id: str, folder_doc: Dict[str, Any], new_parent_doc: Optional[Dict[str, Any]]
+) -> List[Any]:
+    """bulk_write models for ``rebase_subtree``; the caller runs ``check_move``"""
+    own, descendants = _rebase_updates(user_id, folder_doc, new_parent_doc)
+    return [UpdateOne(*own), UpdateMany(*descendants)]
+
+
+def _rebase_updates(user_id: str, folder_doc: Dict[str, Any], new_parent_doc: Optional[Dict[str, Any]]):
+    folder_id = folder_doc["folder_id"]
+    old_depth = len(folder_doc.get("ancestors", []))
+    new_ancestors = child_ancestors(new_parent_doc)
+    own = (
+        {"user_id": user_id, "folder_id": folder_id},
+        {"$set": {
+            "parent_folder_id": new_parent_doc["folder_id"] if new_parent_doc else None,
+            "ancestors": new_ancestors,
+        }},
+    )
+    # Descendants keep everything from this folder down; only the prefix changes
+    descendants = (
+        {"user_id": user_id, "ancestors.folder_id": folder_id},
+        [{"$set": {"ancestors": {"$concatArrays": [
+            new_ancestors,
+            {"$slice": ["$ancestors", old_depth, {"$size": "$ancestors"}]},
+        ]}}}],
+    )
+    return own, descendants
+
+
+def compute_ancestors(folders: Dict[str, Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Ancestor lists for one user's folders, keyed by folder_id"""
+    resolved: Dict[str, List[Dict[str, Any]]] = {}
+
+    def resolve(folder_id: str, seen: frozenset) -> List[Dict[str, Any]]:
+        if folder_id in resolved:
+            return resolved[folder_id]
+        parent_id = folders[folder_id].get("parent_folder_id")
+        if not parent_id or parent_id not in folders or parent_id in seen:
+            # Root, orphaned or cyclic: treat as top level
+            ancestors = []
+        else:
+            ancestors = [*resolve(parent_id, seen | {folder_id}), ancestor_entry(folders[parent_id])]
+        resolved[folder_id] = ancestors
+        return ancestors
+
+    for folder_id in folders:
+        resolve(folder_id, frozenset())
+    return resolved
+
+
+async def backfill_ancestors(db, batch_size: int = 1000) -> int:
+    """Recompute ``ancestors`` for every folder, one user at a time"""
+    updated = 0
+    for user_id in await db.folders.distinct("user_id"):
+        folders = {
+            doc["folder_id"]: doc
+            async for doc in db.folders.find({"user_id": user_id}, ANCESTRY_PROJECTION)
+        }
+        batch = []
+        for folder_id, ancestors in compute_ancestors(folders).items():
+            batch.append(UpdateOne(
+                {"user_id": user_id, "folder_id": folder_id},
+                {"$set": {"ancestors": ancestors}},
+            ))
+            if len(batch) >= batch_size:
+                updated += (await db.folders.bulk_write(batch, ordered=False)).modified_count
+                batch = []
+        if batch:
+            updated += (await db.folders.bulk_write(batch, ordered=False)).modified_count
+    return updated
+
+
+async def main() -> int:
+    from pymongo import AsyncMongoClient
+    from config import settings
+
+    client = AsyncMongoClient(settings.MONGODB_URL)
+    try:
+        updated = await backfill_ancestors(client[settings.MONGODB_DB_NAME])
+        print(f"Backfilled ancestors on {updated} folders")
+        return 0
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Folder ancestry maintenance")
+    parser.add_argument("--backfill", action="store_true",
+                        help="recompute ancestors for every folder")
+    if not parser.parse_args().backfill:
+        parser.print_help()
+        sys.exit(0)
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,166 @@
+"""Index bootstrap and query-shape checks for the Mongo collections.
+
+``ensure_indexes`` runs at startup and is idempotent: ``create_indexes`` is a
+no-op for indexes that already exist with the same spec.
+
+``check_query_plans`` explains every hot query in ``HOT_QUERIES`` and reports
+any whose winning plan falls back to a COLLSCAN. Run it against a database with
+``python indexes.py --explain``; it exits non-zero if a query is unindexed.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "files": [
+        # list_files: files in a folder, one index per sort key
+        IndexModel([("user_id", ASCENDING), ("folder_id", ASCENDING), ("name", ASCENDING),
+                    ("_id", ASCENDING)], name="user_folder_name"),
+        IndexModel([("user_id", ASCENDING), ("folder_id", ASCENDING), ("size", ASCENDING),
+                    ("_id", ASCENDING)], name="user_folder_size"),
+        IndexModel([("user_id", ASCENDING), ("folder_id", ASCENDING), ("upload_date", ASCENDING),
+                    ("_id", ASCENDING)], name="user_folder_date"),
+        # download / update / delete by file_id
+        IndexModel([("user_id", ASCENDING), ("file_id", ASCENDING)], name="user_file"),
+        # filename search (multikey)
+        IndexModel([("user_id", ASCENDING), ("name_grams", ASCENDING)], name="user_name_grams"),
+        # thumbnail queue: pending files and stale claims
+        IndexModel([("thumbnail.status", ASCENDING), ("thumbnail.claimed_at", ASCENDING)],
+                   name="thumbnail_queue"),
+    ],
+    "folders": [
+        # list_files: subfolders of a folder, one index per sort key
+        IndexModel([("user_id", ASCENDING), ("parent_folder_id", ASCENDING), ("name", ASCENDING),
+                    ("_id", ASCENDING)], name="user_parent_name"),
+        IndexModel([("user_id", ASCENDING), ("parent_folder_id", ASCENDING), ("created_date", ASCENDING),
+                    ("_id", ASCENDING)], name="user_parent_date"),
+        # breadcrumb / update / delete by folder_id
+        IndexModel([("user_id", ASCENDING), ("folder_id", ASCENDING)], name="user_folder"),
+        # descendants of a folder (multikey over materialized ancestors)
+        IndexModel([("user_id", ASCENDING), ("ancestors.folder_id", ASCENDING)], name="user_ancestors"),
+        # filename search (multikey)
+        IndexModel([("user_id", ASCENDING), ("name_grams", ASCENDING)], name="user_name_grams"),
+    ],
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "jobs": [
+        IndexModel([("user_id", ASCENDING), ("job_id", ASCENDING)], name="user_job"),
+    ],
+    "upload_sessions": [
+        IndexModel([("user_id", ASCENDING), ("session_id", ASCENDING)], name="user_session"),
+        IndexModel([("user_id", ASCENDING), ("file_id", ASCENDING)], name="user_file"),
+        # stale session sweeper
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ],
+}
+
+# (collection, filter, sort) shaped like the queries the API issues
+HOT_QUERIES: List[Tuple[str, Dict[str, Any], Optional[List[Tuple[str, int]]]]] = [
+    ("files", {"user_id": "u", "folder_id": "f"}, [("name", ASCENDING), ("_id", ASCENDING)]),
+    ("files", {"user_id": "u", "folder_id": {"$in": [None, ""]}},
+     [("size", DESCENDING), ("_id", DESCENDING)]),
+    ("files", {"user_id": "u", "folder_id": "f"}, [("upload_date", ASCENDING), ("_id", ASCENDING)]),
+    ("files", {"user_id": "u", "file_id": "f"}, None),
+    ("folders", {"user_id": "u", "parent_folder_id": "f"}, [("name", ASCENDING), ("_id", ASCENDING)]),
+    ("folders", {"user_id": "u", "parent_folder_id": {"$in": [None, ""]}},
+     [("created_date", DESCENDING), ("_id", DESCENDING)]),
+    ("folders", {"user_id": "u", "folder_id": "f"}, None),
+    ("folders", {"user_id": "u", "ancestors.folder_id": "f"}, None),
+    ("folders", {"user_id": "u", "name_grams": {"$all": ["rep", "epo"]}}, None),
+    ("files", {"user_id": "u", "name_grams": {"$all": ["^r"]}}, None),
+    ("users", {"email": "user@example.com"}, None),
+    ("folders", {"user_id": "u", "$or": [{"folder_id": {"$in": ["f"]}},
+                                         {"ancestors.folder_id": {"$in": ["f"]}}]}, None),
+    ("files", {"user_id": "u", "folder_id": {"$in": ["f", "g"]}}, None),
+    ("files", {"user_id": "u", "$or": [{"folder_id": {"$in": ["f"]}}, {"file_id": {"$in": ["x"]}}]}, None),
+    ("files", {"$or": [{"thumbnail.status": "pending"},
+                       {"thumbnail.status": "processing", "thumbnail.claimed_at": {"$lt": datetime(2000, 1, 1)},
+                        "thumbnail.attempts": {"$lt": 3}}]}, None),
+    ("jobs", {"user_id": "u", "job_id": "j"}, None),
+    ("upload_sessions", {"user_id": "u", "session_id": "s"}, None),
+    ("upload_sessions", {"user_id": "u", "file_id": "f", "upload_id": {"$exists": False}}, None),
+    ("upload_sessions", {"updated_at": {"$lt": datetime(1970, 1, 1)}}, None),
+]
+
+
+async def _ensure_collection_indexes(db, collection_name: str, models) -> None:
+    try:
+        names = await db[collection_name].create_indexes(models)
+        logger.info(f"Ensured indexes on {collection_name}: {', '.join(names)}")
+    except OperationFailure as e:
+        # e.g. duplicate emails blocking the unique index; keep serving
+        logger.error(f"Failed to create indexes on {collection_name}: {e}")
+
+
+async def ensure_indexes(db) -> None:
+    """Create every index in ``INDEXES``; existing ones are left untouched.
+
+    Collections are done concurrently, one round trip each.
+    """
+    await asyncio.gather(*(
+        _ensure_collection_indexes(db, collection_name, models)
+        for collection_name, models in INDEXES.items()
+    ))
+
+
+def plan_stages(plan: Any) -> List[str]:
+    """Collect every ``stage`` name in an explain plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+
+async def check_query_plans(db) -> List[Tuple[str, Dict[str, Any], Any]]:
+    """Return the hot queries whose winning plan is a collection scan"""
+    collscans = []
+    for collection_name, query, sort in HOT_QUERIES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explained = await cursor.explain()
+        winning_plan = explained.get("queryPlanner", {}).get("winningPlan", {})
+        if "COLLSCAN" in plan_stages(winning_plan):
+            collscans.append((collection_name, query, sort))
+    return collscans
+
+
+async def main(explain: bool) -> int:
+    from pymongo import AsyncMongoClient
+    from config import settings
+
+    client = AsyncMongoClient(settings.MONGODB_URL)
+    try:
+        db = client[settings.MONGODB_DB_NAME]
+        await ensure_indexes(db)
+        if not explain:
+            return 0
+        collscans = await check_query_plans(db)
+        for collection_name, query, sort in collscans:
+            print(f"COLLSCAN on {collection_name}: {query} sort={sort}")
+        print(f"{len(HOT_QUERIES) - len(collscans)}/{len(HOT_QUERIES)} hot queries use an index")
+        return 1 if collscans else 0
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Create Mongo indexes")
+    parser.add_argument("--explain", action="store_true",
+                        help="explain hot queries and fail on any COLLSCAN")
+    sys.exit(asyncio.run(main(parser.parse_args().explain)))
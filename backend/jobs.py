@@ -0,0 +1,184 @@
+"""Tracked background jobs for recursive folder operations.
+
+A job is a document in the ``jobs`` collection that the client polls through
+``GET /api/jobs/{job_id}``; the work itself runs as an asyncio task on the
+worker that accepted the request and records its progress on the document.
+
+Deleting a subtree enumerates every folder below it with one indexed query on
+the materialized ``ancestors``, then removes files in batches: one
+``delete_many`` for the metadata and one multi-object storage delete for the
+bytes per batch. It lists the subtree again after deleting the folders it
+found, until a pass finds none, so folders and files added while it runs go
+too. What it deleted is counted per root for the usage rollups as each batch
+goes, so a caller can still account for it when the job fails partway. Moving
+a subtree rewrites the ancestor paths in two updates, however deep the tree is.
+
+A job interrupted by a restart stays ``running``; both operations are
+idempotent, so the client can simply submit the same request again.
+"""
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from bson import ObjectId
+from blobs import release_objects
+from folder_tree import rebase_subtree, subtree_filter
+from usage import folder_chain
+
+logger = logging.getLogger(__name__)
+
+Report = Callable[..., Awaitable[None]]
+
+
+class JobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class JobType(str, Enum):
+    DELETE_FOLDER = "delete_folder"
+    MOVE_FOLDER = "move_folder"
+
+
+# Keep strong references so running jobs aren't garbage collected
+_running: Set[asyncio.Task] = set()
+
+
+def new_job(user_id: str, job_type: JobType, **params) -> Dict[str, Any]:
+    now = datetime.utcnow()
+    return {
+        "_id": ObjectId(),
+        "job_id": str(ObjectId()),
+        "user_id": user_id,
+        "type": job_type.value,
+        **params,
+        "status": JobStatus.PENDING.value,
+        "progress": {},
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def serialize_job(job_doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        key: (value.isoformat() if isinstance(value, datetime) else value)
+        for key, value in job_doc.items()
+        if key not in ("_id", "user_id")
+    }
+
+
+async def run_job(jobs_collection, job_doc: Dict[str, Any], work: Callable[[Report], Awaitable[None]]):
+    """Run ``work`` and record its status and progress on the job document"""
+    job_filter = {"_id": job_doc["_id"]}
+
+    async def report(**progress):
+        await jobs_collection.update_one(job_filter, {"$set": {
+            **{f"progress.{key}": value for key, value in progress.items()},
+            "updated_at": datetime.utcnow(),
+        }})
+
+    async def set_status(status: JobStatus, error: Optional[str] = None):
+        await jobs_collection.update_one(job_filter, {"$set": {
+            "status": status.value, "error": error, "updated_at": datetime.utcnow(),
+        }})
+
+    await set_status(JobStatus.RUNNING)
+    try:
+        await work(report)
+    except Exception as e:
+        logger.error(f"Job {job_doc['job_id']} failed: {e}")
+        await set_status(JobStatus.FAILED, str(e))
+    else:
+        await set_status(JobStatus.COMPLETED)
+
+
+def start_job(jobs_collection, job_doc: Dict[str, Any], work: Callable[[Report], Awaitable[None]]) -> asyncio.Task:
+    task = asyncio.create_task(run_job(jobs_collection, job_doc, work))
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+    return task
+
+
+async def delete_subtree(
+    folders_collection,
+    files_collection,
+    blobs_collection,
+    store,
+    user_id: str,
+    root_folder_ids: List[str],
+    report: Report,
+    batch_size: int,
+    removed: Optional[Dict[str, Counter]] = None,
+    touched: Optional[Set[str]] = None,
+) -> Dict[str, Counter]:
+    """Delete folders, every folder below them, and all of their files.
+
+    Returns what was deleted under each root: ``files``, ``bytes`` and
+    ``folders`` (the root itself included). Pass ``removed`` (a
+    ``defaultdict(Counter)``) and ``touched`` to have them filled in as the
+    deletion goes; ``touched`` holds the folders that lost files and are
+    still there, which is only ever the case after a failure.
+    """
+    roots = set(root_folder_ids)
+    root_of: Dict[str, str] = {}
+    removed = defaultdict(Counter) if removed is None else removed
+    touched = set() if touched is None else touched
+    deleted_files = deleted_folders = 0
+    while True:
+        found: List[str] = []
+        async for doc in folders_collection.find(
+            subtree_filter(user_id, root_folder_ids), {"folder_id": 1, "ancestors.folder_id": 1}
+        ):
+            # Attribute nested roots to the outermost one
+            root_of.setdefault(doc["folder_id"], next(f for f in folder_chain(doc) if f in roots))
+            found.append(doc["folder_id"])
+        # Every folder seen so far: files can still land in one already deleted
+        files_filter = {"user_id": user_id, "folder_id": {"$in": list(root_of)}}
+        await report(
+            total_folders=len(root_of),
+            total_files=deleted_files + await files_collection.count_documents(files_filter),
+            deleted_files=deleted_files, deleted_folders=deleted_folders,
+        )
+
+        while True:
+            batch = await files_collection.find(
+                files_filter, {"file_id": 1, "object_name": 1, "thumbnail": 1, "size": 1, "folder_id": 1}
+            ).limit(batch_size).to_list()
+            if not batch:
+                break
+            # Metadata first, like delete_file: a crash leaves orphaned bytes, never dangling files
+            await files_collection.delete_many({"_id": {"$in": [doc["_id"] for doc in batch]}})
+            for doc in batch:
+                removed[root_of[doc["folder_id"]]].update(files=1, bytes=doc.get("size", 0))
+                touched.add(doc["folder_id"])
+            deleted_files += len(batch)
+            await release_objects(blobs_collection, store, batch)
+            await report(deleted_files=deleted_files)
+
+        if not found:
+            return removed
+        result = await folders_collection.delete_many({"user_id": user_id, "folder_id": {"$in": found}})
+        for folder_id in found:
+            removed[root_of[folder_id]]["folders"] += 1
+        touched.difference_update(found)
+        deleted_folders += result.deleted_count
+        await report(deleted_folders=deleted_folders)
+
+
+async def move_subtree(
+    folders_collection,
+    user_id: str,
+    folder_doc: Dict[str, Any],
+    new_parent_doc: Optional[Dict[str, Any]],
+    report: Report,
+):
+    """Re-parent a folder; files keep their folder_id, so only folders change"""
+    total = await folders_collection.count_documents(subtree_filter(user_id, [folder_doc["folder_id"]]))
+    await report(total_folders=total, moved_folders=0)
+    await rebase_subtree(folders_collection, user_id, folder_doc, new_parent_doc)
+    await report(moved_folders=total)
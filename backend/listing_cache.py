@@ -0,0 +1,105 @@
+"""Cache of serialized folder listings, validated by folder version.
+
+Entries are keyed by user, folder and the query that shaped the page, and hold
+the JSON body together with the folder version it was built at. Lookups pass
+the current version (which ``list_files`` reads for its ETag anyway), so a
+folder that changed since simply misses and its entry is overwritten; no write
+path has to invalidate anything. The versions live in Mongo, so entries stay
+coherent across workers even with the per-process backend.
+
+``LocalListingCache`` is an LRU per process, bounded by entry count and bytes.
+``RedisListingCache`` keeps entries in a Redis-compatible server so all
+workers share them.
+"""
+from typing import Any, Dict, Optional, Tuple
+from cache import TTLCache
+from versions import version_key
+
+
+def listing_key(user_id: str, folder_id: Optional[str], *query: Any) -> str:
+    return "|".join([version_key(user_id, folder_id), *map(str, query)])
+
+
+class _Counters:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, body: Optional[bytes]) -> Optional[bytes]:
+        if body is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return body
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class LocalListingCache:
+    def __init__(self, maxsize: int, max_bytes: int, ttl: float):
+        self._cache = TTLCache(
+            maxsize, ttl, weigher=lambda entry: len(entry[1]), max_weight=max_bytes
+        )
+        self._counters = _Counters()
+
+    async def get(self, key: str, version: int) -> Optional[bytes]:
+        entry: Optional[Tuple[int, bytes]] = self._cache.get(key)
+        return self._counters.record(entry[1] if entry and entry[0] == version else None)
+
+    async def set(self, key: str, version: int, body: bytes):
+        self._cache.set(key, (version, body))
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "local",
+            **self._counters.stats(),
+            "entries": len(self._cache),
+            "max_entries": self._cache.maxsize,
+            "bytes": self._cache.weight,
+            "max_bytes": self._cache.max_weight,
+        }
+
+
+class RedisListingCache:
+    PREFIX = "listing:"
+
+    def __init__(self, url: str, ttl: float, client=None):
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(url)
+        self._redis = client
+        self.ttl = int(ttl)
+        self._counters = _Counters()
+
+    async def get(self, key: str, version: int) -> Optional[bytes]:
+        payload = await self._redis.get(self.PREFIX + key)
+        body = None
+        if payload is not None:
+            stored, _, rest = payload.partition(b":")
+            if stored == str(version).encode():
+                body = rest
+        return self._counters.record(body)
+
+    async def set(self, key: str, version: int, body: bytes):
+        await self._redis.set(self.PREFIX + key, str(version).encode() + b":" + body, ex=self.ttl)
+
+    async def stats(self) -> Dict[str, Any]:
+        memory = await self._redis.info("memory")
+        return {
+            "backend": "redis",
+            **self._counters.stats(),
+            "bytes": memory.get("used_memory"),
+            "max_bytes": memory.get("maxmemory") or None,
+        }
+
+
+def create_listing_cache(redis_url: str, maxsize: int, max_bytes: int, ttl: float):
+    if redis_url:
+        return RedisListingCache(redis_url, ttl)
+    return LocalListingCache(maxsize, max_bytes, ttl)
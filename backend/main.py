@@ -1,80 +1,223 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Query, Form
-from fastapi.responses import StreamingResponse
+import time
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import APIRouter, FastAPI, File, UploadFile, HTTPException, Depends, Query, Form, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pymongo import MongoClient
 from bson import ObjectId
-from minio import Minio
-from minio.error import S3Error
 import os
+import math
+import secrets
+import asyncio
 import logging
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-import io
 from typing import List, Optional
 from config import settings
 from models import (
     FileMetadata, FolderMetadata, FileUpdate, FolderCreate, 
-    FolderUpdate, ItemMove, ItemType
+    FolderUpdate, FolderMove, ItemMove, ItemType, UploadSessionCreate,
+    PresignedUploadCreate, BatchRequest
 )
 from auth import (
-    UserCreate, UserLogin, Token, User, get_current_user,
-    verify_password, get_password_hash, create_access_token,
-    ACCESS_TOKEN_EXPIRE_MINUTES
+    UserCreate, UserLogin, Token, User, get_current_user, create_access_token,
+    invalidate_user, token_cache, user_cache, ACCESS_TOKEN_EXPIRE_MINUTES
+)
+from storage import FileTooLargeError, run_storage_io, iter_object
+from object_store import LocalFileResponse, StorageError, create_object_store
+from compression import Compressor, accepts_encoding, open_stored
+from passwords import HashQueueFullError, password_hasher
+from blobs import (
+    staging_key, object_key, thumbnail_key, adopt_staged_object, release_object,
+    release_objects
+)
+from thumbnails import ThumbnailPipeline, has_thumbnail
+from indexes import ensure_indexes
+from search import search_fields, search_query, rank_matches
+from folder_tree import (
+    ANCESTRY_PROJECTION, FolderCycleError, child_ancestors, rename_in_descendants,
+    check_move, subtree_filter, breadcrumb as breadcrumb_path
+)
+from jobs import (
+    JobType, new_job, serialize_job, start_job, delete_subtree, move_subtree
+)
+from archive import build_entries, stream_archive
+from batch import (
+    load_items, plan_batch, apply_plan, released_files, touched_folders, usage_changes
+)
+from usage import (
+    PROJECTION as USAGE_PROJECTION, UsageChanges, apply_usage, empty_usage,
+    folder_chain, init_user_usage, removed_subtrees, serialize_usage, serialize_user_usage
+)
+from versions import ALL_FOLDERS, bump_versions, folder_version
+from listing_cache import create_listing_cache, listing_key
+from serialization import FastJSONResponse, listing_rows
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, REGISTRY, STARTUP_SECONDS, MetricsMiddleware, timed
+)
+from startup import create_mongo_client, run_steps
+from resources import Resources, get_resources
+from conditional import (
+    REVALIDATE, strong_etag, weak_etag, file_etag, listing_etag, is_not_modified
+)
+from pagination import (
+    ListingSort, SortOrder, PHASES, PROJECTIONS, InvalidCursorError,
+    sort_spec, encode_cursor, decode_cursor, keyset_filter
+)
+from ranges import (
+    ByteRange, RangeNotSatisfiableError, parse_range_header, if_range_matches,
+    content_range, http_date, multipart_part_header, multipart_trailer,
+    multipart_length
 )
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(
-    title=settings.PROJECT_NAME,
-    version=settings.VERSION,
-    description=settings.DESCRIPTION
-)
+router = APIRouter()
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=settings.CORS_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE"],
-    allow_headers=["*"],
-)
+async def touch_folders(resources: Resources, user_id: str, *folder_ids: Optional[str]):
+    """Bump listing versions after a write; call only once the write is done"""
+    await bump_versions(resources.folder_versions_collection, user_id, folder_ids)
 
-# MongoDB client
-try:
-    client = MongoClient(settings.MONGODB_URL)
-    db = client[settings.MONGODB_DB_NAME]
-    files_collection = db.files
-    folders_collection = db.folders
-    users_collection = db.users
-    # Test connection
-    client.admin.command('ping')
+async def record_usage(resources: Resources, user_id: str, changes: UsageChanges,
+                       *folder_ids: Optional[str]):
+    """Apply usage deltas, then bump ``folder_ids`` and every listing showing a changed total"""
+    await apply_usage(resources.folders_collection, resources.usage_collection, user_id, changes)
+    # A folder's totals appear in its parent's listing, all the way up to the root
+    await touch_folders(resources, user_id, None, *changes.folder_ids(), *folder_ids)
+
+async def record_files(resources: Resources, user_id: str, folder_id: Optional[str],
+                       count: int, size: int):
+    """Count files added to (or, when negative, removed from) a folder"""
+    chain = []
+    if folder_id:
+        folder = await resources.folders_collection.find_one(
+            {"folder_id": folder_id, "user_id": user_id}, ANCESTRY_PROJECTION
+        )
+        chain = folder_chain(folder) if folder else [folder_id]
+    changes = UsageChanges()
+    changes.add_item(chain, files=count, bytes=size)
+    await record_usage(resources, user_id, changes, folder_id)
+
+async def sweep_stale_upload_sessions(resources: Resources):
+    """Abort multipart uploads whose sessions have been idle past the TTL"""
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.UPLOAD_SESSION_TTL)
+    swept = 0
+    async for session in resources.upload_sessions_collection.find({"updated_at": {"$lt": cutoff}}):
+        try:
+            if session.get("upload_id"):
+                await run_storage_io(
+                    resources.object_store.abort_multipart_upload,
+                    session["file_id"],
+                    session["upload_id"]
+                )
+            else:
+                # Presigned direct upload that was never committed
+                await run_storage_io(resources.object_store.remove, session["file_id"])
+        except StorageError as e:
+            # Upload may already be gone from storage; still drop the session
+            logger.warning(f"Failed to clean up upload {session['session_id']}: {e}")
+        await resources.upload_sessions_collection.delete_one({"_id": session["_id"]})
+        swept += 1
+    if swept:
+        logger.info(f"Swept {swept} stale upload sessions")
+    return swept
+
+async def upload_session_sweeper(resources: Resources):
+    while True:
+        await asyncio.sleep(settings.UPLOAD_SESSION_SWEEP_INTERVAL)
+        try:
+            await sweep_stale_upload_sessions(resources)
+        except Exception as e:
+            logger.error(f"Upload session sweep failed: {e}")
+
+def create_resources() -> Resources:
+    """The clients and caches of one app; nothing connects until first use"""
+    # MongoDB client (async driver; connects on first use, verified in the lifespan)
+    client = create_mongo_client(settings)
+    resources = Resources(
+        client,
+        client[settings.MONGODB_DB_NAME],
+        # Object storage (MinIO or the local filesystem, per STORAGE_BACKEND);
+        # the bucket or directory is created in the lifespan
+        create_object_store(settings),
+        Compressor(
+            settings.COMPRESSION_ENABLED,
+            level=settings.COMPRESSION_LEVEL,
+            sample_size=settings.COMPRESSION_SAMPLE_SIZE,
+            min_savings=settings.COMPRESSION_MIN_SAVINGS
+        ),
+        create_listing_cache(
+            settings.LISTING_CACHE_REDIS_URL,
+            maxsize=settings.LISTING_CACHE_SIZE,
+            max_bytes=settings.LISTING_CACHE_MAX_BYTES,
+            ttl=settings.LISTING_CACHE_TTL
+        )
+    )
+    resources.thumbnail_pipeline = ThumbnailPipeline(
+        resources.files_collection,
+        resources.object_store,
+        enabled=settings.THUMBNAILS_ENABLED,
+        workers=settings.THUMBNAIL_WORKERS,
+        size=settings.THUMBNAIL_SIZE,
+        max_source_size=settings.THUMBNAIL_MAX_SOURCE_SIZE,
+        poll_interval=settings.THUMBNAIL_POLL_INTERVAL,
+        claim_timeout=settings.THUMBNAIL_CLAIM_TIMEOUT,
+        on_ready=lambda file_doc: touch_folders(
+            resources, file_doc["user_id"], file_doc.get("folder_id")
+        )
+    )
+    return resources
+
+async def start_mongodb(resources: Resources):
+    await resources.client.admin.command('ping')
     logger.info("Connected to MongoDB")
-except Exception as e:
-    logger.error(f"Failed to connect to MongoDB: {e}")
-    raise
-
-# MinIO client
-try:
-    minio_client = Minio(
-        settings.MINIO_ENDPOINT,
-        access_key=settings.MINIO_ACCESS_KEY,
-        secret_key=settings.MINIO_SECRET_KEY,
-        secure=settings.MINIO_SECURE
+    await ensure_indexes(resources.db)
+
+async def start_object_store(resources: Resources):
+    # Creates the bucket or directory on first start
+    store = resources.object_store
+    await run_storage_io(store.ensure_ready)
+    logger.info(f"Using {store.name} object storage: {store.location}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    resources = app.state.resources = create_resources()
+    try:
+        timings = await run_steps(
+            {
+                "mongodb": lambda: start_mongodb(resources),
+                "storage": lambda: start_object_store(resources)
+            },
+            attempts=settings.STARTUP_RETRIES + 1,
+            delay=settings.STARTUP_RETRY_DELAY
+        )
+    except BaseException:
+        await resources.client.close()
+        raise
+    # Spawning hashing processes takes a while; don't hold up readiness for it
+    hasher_warm_up = asyncio.create_task(password_hasher.start())
+    sweeper = asyncio.create_task(upload_session_sweeper(resources))
+    resources.thumbnail_pipeline.start()
+    startup_seconds = time.perf_counter() - started
+    STARTUP_SECONDS.set(startup_seconds, phase="total")
+    logger.info(
+        f"Started in {startup_seconds:.3f}s after a {IMPORT_SECONDS:.3f}s import ("
+        + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in timings.items()) + ")"
     )
-    
-    # Ensure bucket exists
-    if not minio_client.bucket_exists(settings.MINIO_BUCKET_NAME):
-        minio_client.make_bucket(settings.MINIO_BUCKET_NAME)
-        logger.info(f"Created MinIO bucket: {settings.MINIO_BUCKET_NAME}")
-    else:
-        logger.info(f"Connected to MinIO bucket: {settings.MINIO_BUCKET_NAME}")
-        
-except Exception as e:
-    logger.error(f"Failed to connect to MinIO: {e}")
-    raise
-
-@app.get("/")
+    try:
+        yield
+    finally:
+        sweeper.cancel()
+        hasher_warm_up.cancel()
+        await resources.thumbnail_pipeline.stop()
+        password_hasher.shutdown()
+        await resources.client.close()
+
+@router.get("/")
 async def root():
     return {
         "message": "File Manager API is running",
@@ -82,35 +225,45 @@ async def root():
         "status": "healthy"
     }
 
-@app.get("/health")
-async def health_check():
+@router.get("/health")
+async def health_check(resources: Resources = Depends(get_resources)):
     try:
         # Check MongoDB connection
-        client.admin.command('ping')
+        await resources.client.admin.command('ping')
         mongo_status = "healthy"
     except Exception:
         mongo_status = "unhealthy"
     
     try:
-        # Check MinIO connection
-        minio_client.bucket_exists(settings.MINIO_BUCKET_NAME)
-        minio_status = "healthy"
+        # Check object storage
+        await run_storage_io(resources.object_store.check)
+        storage_status = "healthy"
     except Exception:
-        minio_status = "unhealthy"
+        storage_status = "unhealthy"
     
     return {
-        "status": "healthy" if mongo_status == "healthy" and minio_status == "healthy" else "unhealthy",
+        "status": "healthy" if mongo_status == "healthy" and storage_status == "healthy" else "unhealthy",
         "mongodb": mongo_status,
-        "minio": minio_status,
+        "storage": {"backend": resources.object_store.name, "status": storage_status},
+        "auth_cache": {"tokens": token_cache.stats(), "users": user_cache.stats()},
+        "password_hashing": password_hasher.stats(),
+        "thumbnails": resources.thumbnail_pipeline.stats(),
+        "listing_cache": await resources.listing_cache.stats(),
         "timestamp": datetime.utcnow().isoformat()
     }
 
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return Response(content=REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
 # Authentication endpoints
-@app.post("/api/auth/register", response_model=dict)
-async def register(user_data: UserCreate):
+@router.post("/api/auth/register", response_model=dict)
+async def register(user_data: UserCreate, resources: Resources = Depends(get_resources)):
     try:
         # Check if user already exists
-        existing_user = users_collection.find_one({"email": user_data.email})
+        existing_user = await resources.users_collection.find_one({"email": user_data.email})
         if existing_user:
             raise HTTPException(
                 status_code=400,
@@ -118,7 +271,7 @@ async def register(user_data: UserCreate):
             )
         
         # Hash password and create user
-        hashed_password = get_password_hash(user_data.password)
+        hashed_password = await password_hasher.hash(user_data.password)
         user_doc = {
             "_id": ObjectId(),
             "email": user_data.email,
@@ -128,21 +281,27 @@ async def register(user_data: UserCreate):
             "is_active": True
         }
         
-        users_collection.insert_one(user_doc)
+        await resources.users_collection.insert_one(user_doc)
+        await init_user_usage(resources.usage_collection, str(user_doc["_id"]))
+        # A previous account under this email may still be cached
+        invalidate_user(user_data.email)
         
         return {"message": "User registered successfully"}
         
+    except HashQueueFullError:
+        raise HTTPException(status_code=503, detail="Too many sign-ins in progress, retry shortly",
+                            headers={"Retry-After": "1"})
     except Exception as e:
         if "Email already registered" in str(e):
             raise e
         raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
 
-@app.post("/api/auth/login", response_model=Token)
-async def login(user_credentials: UserLogin):
+@router.post("/api/auth/login", response_model=Token)
+async def login(user_credentials: UserLogin, resources: Resources = Depends(get_resources)):
     try:
         # Find user by email
-        user = users_collection.find_one({"email": user_credentials.email})
-        if not user or not verify_password(user_credentials.password, user["hashed_password"]):
+        user = await resources.users_collection.find_one({"email": user_credentials.email})
+        if not user or not await password_hasher.verify(user_credentials.password, user["hashed_password"]):
             raise HTTPException(
                 status_code=401,
                 detail="Incorrect email or password"
@@ -156,123 +315,586 @@ async def login(user_credentials: UserLogin):
         
         return {"access_token": access_token, "token_type": "bearer"}
         
+    except HashQueueFullError:
+        raise HTTPException(status_code=503, detail="Too many sign-ins in progress, retry shortly",
+                            headers={"Retry-After": "1"})
     except Exception as e:
         if "Incorrect email or password" in str(e):
             raise e
         raise HTTPException(status_code=500, detail=f"Login failed: {str(e)}")
 
-@app.get("/api/auth/me", response_model=User)
+@router.get("/api/auth/me", response_model=User)
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
     return current_user
 
 # File management endpoints
-@app.post("/api/files/upload")
+@router.post("/api/files/upload")
 async def upload_file(
     file: UploadFile = File(...), 
     folder_id: Optional[str] = Form(None),
+    resources: Resources = Depends(get_resources),
     current_user: User = Depends(get_current_user)
 ):
     try:
-        # Debug logging
-        logger.info(f"Upload request - File: {file.filename}, Folder ID: {folder_id}, User: {current_user.id}")
-        
         # Generate unique file ID
         file_id = str(ObjectId())
+        content_addressed = settings.CONTENT_ADDRESSED_STORAGE
         
-        # Read file content
-        content = await file.read()
-        
-        # Upload to MinIO
-        minio_client.put_object(
-            settings.MINIO_BUCKET_NAME,
-            file_id,
-            io.BytesIO(content),
-            length=len(content),
-            content_type=file.content_type
+        # Stream to storage in fixed-size parts, sizing, hashing and (for
+        # text-like content) compressing on the fly
+        stored = await run_storage_io(
+            resources.compressor.put_stream,
+            resources.object_store,
+            staging_key(file_id) if content_addressed else file_id,
+            file.file,
+            content_type=file.content_type,
+            max_size=settings.MAX_FILE_SIZE
         )
         
+        deduplicated = False
+        compression = stored.compression
+        if content_addressed:
+            object_name, deduplicated, compression = await adopt_staged_object(
+                resources.blobs_collection, resources.object_store, staging_key(file_id), stored
+            )
+        
         # Save metadata to MongoDB
         file_metadata = {
             "_id": ObjectId(file_id),
             "name": file.filename,
-            "size": len(content),
+            **search_fields(file.filename),
+            "size": stored.size,
+            "sha256": stored.sha256,
             "content_type": file.content_type,
             "upload_date": datetime.utcnow(),
             "file_id": file_id,
             "folder_id": folder_id,  # This should properly store the folder_id
             "item_type": "file",
-            "user_id": current_user.id
+            "user_id": current_user.id,
+            **resources.thumbnail_pipeline.fields(file.content_type, stored.size)
         }
+        if content_addressed:
+            file_metadata["object_name"] = object_name
+        if compression:
+            file_metadata["compression"] = compression
         
-        # Debug logging
-        logger.info(f"Saving file metadata: {file_metadata}")
-        
-        files_collection.insert_one(file_metadata)
+        await resources.files_collection.insert_one(file_metadata)
+        await record_files(resources, current_user.id, folder_id, 1, stored.size)
+        resources.thumbnail_pipeline.notify()
         
         return {
             "message": "File uploaded successfully",
             "file_id": file_id,
             "filename": file.filename,
-            "folder_id": folder_id
+            "folder_id": folder_id,
+            "deduplicated": deduplicated
         }
         
+    except FileTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logger.error(f"Upload failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
-@app.get("/api/files")
+# Resumable upload session endpoints
+async def get_upload_session(resources: Resources, session_id: str, user_id: str):
+    session = await resources.upload_sessions_collection.find_one({
+        "session_id": session_id,
+        "user_id": user_id,
+        "upload_id": {"$exists": True}
+    })
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session
+
+def expected_part_size(session: dict, part_number: int) -> int:
+    if part_number < session["total_parts"]:
+        return session["chunk_size"]
+    return session["size"] - session["chunk_size"] * (session["total_parts"] - 1)
+
+async def read_part(request: Request, expected: int) -> bytes:
+    """Read an upload part's body, refusing before reading if it is not ``expected`` bytes"""
+    content_length = request.headers.get("content-length")
+    if content_length is None:
+        raise HTTPException(status_code=411, detail="Content-Length is required")
+    try:
+        length = int(content_length)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length")
+    if length > expected:
+        raise HTTPException(
+            status_code=413, detail=f"Part must be {expected} bytes, got {length}"
+        )
+    if length != expected:
+        raise HTTPException(
+            status_code=400, detail=f"Part must be {expected} bytes, got {length}"
+        )
+    # Content-Length is the client's word; never buffer more than the part
+    data = bytearray()
+    async for chunk in request.stream():
+        data += chunk
+        if len(data) > expected:
+            raise HTTPException(
+                status_code=413, detail=f"Part must be {expected} bytes, got more"
+            )
+    if len(data) != expected:
+        raise HTTPException(
+            status_code=400, detail=f"Part must be {expected} bytes, got {len(data)}"
+        )
+    return bytes(data)
+
+def upload_session_status(session: dict) -> dict:
+    received = sorted(int(number) for number in session.get("parts", {}))
+    received_set = set(received)
+    return {
+        "session_id": session["session_id"],
+        "filename": session["name"],
+        "size": session["size"],
+        "chunk_size": session["chunk_size"],
+        "total_parts": session["total_parts"],
+        "received_parts": received,
+        "missing_parts": [
+            number for number in range(1, session["total_parts"] + 1)
+            if number not in received_set
+        ]
+    }
+
+@router.post("/api/uploads")
+async def create_upload_session(
+    session_data: UploadSessionCreate,
+    resources: Resources = Depends(get_resources),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        if session_data.size < 0 or session_data.size > settings.MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File exceeds maximum size of {settings.MAX_FILE_SIZE} bytes"
+            )
+        
+        chunk_size = session_data.chunk_size or settings.UPLOAD_PART_SIZE
+        if chunk_size < settings.MIN_UPLOAD_PART_SIZE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"chunk_size must be at least {settings.MIN_UPLOAD_PART_SIZE} bytes"
+            )
+        if chunk_size > settings.MAX_UPLOAD_PART_SIZE:
+            raise HTTPException(
+                status_code=400,
+                detail=f"chunk_size must be at most {settings.MAX_UPLOAD_PART_SIZE} bytes"
+            )
+        
+        total_parts = max(1, math.ceil(session_data.size / chunk_size))
+        if total_parts > settings.MAX_UPLOAD_PARTS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Upload would need more than {settings.MAX_UPLOAD_PARTS} parts"
+            )
+        
+        file_id = str(ObjectId())
+        upload_id = await run_storage_io(
+            resources.object_store.create_multipart_upload,
+            file_id,
+            session_data.content_type
+        )
+        
+        now = datetime.utcnow()
+        session = {
+            "_id": ObjectId(),
+            "session_id": str(ObjectId()),
+            "upload_id": upload_id,
+            "file_id": file_id,
+            "name": session_data.filename,
+            "size": session_data.size,
+            "content_type": session_data.content_type,
+            "folder_id": session_data.folder_id,
+            "chunk_size": chunk_size,
+            "total_parts": total_parts,
+            "parts": {},
+            "user_id": current_user.id,
+            "created_at": now,
+            "updated_at": now
+        }
+        await resources.upload_sessions_collection.insert_one(session)
+        
+        return upload_session_status(session)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to create upload session: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to create upload session: {str(e)}")
+
+@router.put("/api/uploads/{session_id}/parts/{part_number}")
+async def upload_session_part(
+    session_id: str,
+    part_number: int,
+    request: Request,
+    resources: Resources = Depends(get_resources),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        session = await get_upload_session(resources, session_id, current_user.id)
+        if part_number < 1 or part_number > session["total_parts"]:
+            raise HTTPException(status_code=400, detail="Invalid part number")
+        
+        # Bounded by chunk_size, itself at most MAX_UPLOAD_PART_SIZE
+        data = await read_part(request, expected_part_size(session, part_number))
+        
+        etag = await run_storage_io(
+            resources.object_store.upload_part,
+            session["file_id"],
+            session["upload_id"],
+            part_number,
+            data
+        )
+        
+        # Each part writes its own key, so parallel uploads never conflict
+        await resources.upload_sessions_collection.update_one(
+            {"_id": session["_id"]},
+            {"$set": {
+                f"parts.{part_number}": {"etag": etag, "size": len(data)},
+                "updated_at": datetime.utcnow()
+            }}
+        )
+        
+        return {"part_number": part_number, "etag": etag}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Part upload failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Part upload failed: {str(e)}")
+
+@router.get("/api/uploads/{session_id}")
+async def get_upload_session_status(
+    session_id: str,
+    resources: Resources = Depends(get_resources),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        return upload_session_status(await get_upload_session(resources, session_id, current_user.id))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get upload session: {str(e)}")
+
+@router.post("/api/uploads/{session_id}/complete")
+async def complete_upload_session(
+    session_id: str,
+    resources: Resources = Depends(get_resources),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        session = await get_upload_session(resources, session_id, current_user.id)
+        status = upload_session_status(session)
+        if status["missing_parts"]:
+            raise HTTPException(
+                status_code=409,
+                detail={"message": "Upload is incomplete", "missing_parts": status["missing_parts"]}
+            )
+        
+        etag = await run_storage_io(
+            resources.object_store.complete_multipart_upload,
+            session["file_id"],
+            session["upload_id"],
+            {int(number): part["etag"] for number, part in session["parts"].items()}
+        )
+        
+        file_metadata = {
+            "_id": ObjectId(session["file_id"]),
+            "name": session["name"],
+            **search_fields(session["name"]),
+            "size": session["size"],
+            "etag": etag,
+            "content_type": session["content_type"],
+            "upload_date": datetime.utcnow(),
+            "file_id": session["file_id"],
+            "folder_id": session["folder_id"],
+            "item_type": "file",
+            "user_id": current_user.id,
+            **resources.thumbnail_pipeline.fields(session["content_type"], session["size"])
+        }
+        await resources.files_collection.insert_one(file_metadata)
+        await resources.upload_sessions_collection.delete_one({"_id": session["_id"]})
+        await record_files(resources, current_user.id, session["folder_id"], 1, session["size"])
+        resources.thumbnail_pipeline.notify()
+        
+        return {
+            "message": "File uploaded successfully",
+            "file_id": session["file_id"],
+            "filename": session["name"],
+            "folder_id": session["folder_id"]
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Upload completion failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Upload completion failed: {str(e)}")
+
+@router.delete("/api/uploads/{session_id}")
+async def abort_upload_session(
+    session_id: str,
+    resources: Resources = Depends(get_resources),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        session = await get_upload_session(resources, session_id, current_user.id)
+        try:
+            await run_storage_io(
+                resources.object_store.abort_multipart_upload,
+                session["file_id"],
+                session["upload_id"]
+            )
+        except StorageError:
+            # Upload may already have been aborted
+            pass
+        await resources.upload_sessions_collection.delete_one({"_id": session["_id"]})
+        
+        return {"message": "Upload session aborted"}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Abort failed: {str(e)}")
+
+# Presigned URL endpoints (direct-to-MinIO transfers)
+def require_presigned_urls(resources: Resources = Depends(get_resources)):
+    if not settings.PRESIGNED_URLS_ENABLED or not resources.object_store.supports_presigned_urls:
+        raise HTTPException(status_code=404, detail="Presigned URLs are disabled")
+
+@router.post("/api/files/upload-url", dependencies=[Depends(require_presigned_urls)])
+async def create_upload_url(
+    upload_data: PresignedUploadCreate,
+    resources: Resources = Depends(get_resources),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        if upload_data.size is not None and upload_data.size > settings.MAX_FILE_SIZE:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File exceeds maximum size of {settings.MAX_FILE_SIZE} bytes"
+            )
+        
+        file_id = str(ObjectId())
+        expires = timedelta(seconds=settings.PRESIGNED_URL_EXPIRY)
+        url = resources.object_store.presigned_put_url(file_id, expires)
+        
+        # Pending until committed; the session sweeper removes orphans
+        now = datetime.utcnow()
+        await resources.upload_sessions_collection.insert_one({
+            "_id": ObjectId(),
+            "session_id": str(ObjectId()),
+            "file_id": file_id,
+            "name": upload_data.filename,
+            "content_type": upload_data.content_type,
+            "folder_id": upload_data.folder_id,
+            "user_id": current_user.id,
+            "created_at": now,
+            "updated_at": now
+        })
+        
+        return {
+            "file_id": file_id,
+            "upload_url": url,
+            "method": "PUT",
+            "expires_in": settings.PRESIGNED_URL_EXPIRY
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to create upload URL: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to create upload URL: {str(e)}")
+
+@router.post("/api/files/{file_id}/commit", dependencies=[Depends(require_presigned_urls)])
+async def commit_direct_upload(
+    file_id: str,
+    resources: Resources = Depends(get_resources),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        pending = await resources.upload_sessions_collection.find_one({
+            "file_id": file_id,
+            "user_id": current_user.id,
+            "upload_id": {"$exists": False}
+        })
+        if not pending:
+            raise HTTPException(status_code=404, detail="Pending upload not found")
+        
+        try:
+            stat = await run_storage_io(resources.object_store.stat, file_id)
+        except StorageError:
+            raise HTTPException(status_code=409, detail="File has not been uploaded yet")
+        
+        # A presigned PUT cannot cap the body size, so enforce it here
+        if stat.size > settings.MAX_FILE_SIZE:
+            await run_storage_io(resources.object_store.remove, file_id)
+            await resources.upload_sessions_collection.delete_one({"_id": pending["_id"]})
+            raise HTTPException(
+                status_code=413,
+                detail=f"File exceeds maximum size of {settings.MAX_FILE_SIZE} bytes"
+            )
+        
+        content_type = pending["content_type"] or stat.content_type
+        file_metadata = {
+            "_id": ObjectId(file_id),
+            "name": pending["name"],
+            **search_fields(pending["name"]),
+            "size": stat.size,
+            "etag": stat.etag,
+            "content_type": content_type,
+            "upload_date": datetime.utcnow(),
+            "file_id": file_id,
+            "folder_id": pending["folder_id"],
+            "item_type": "file",
+            "user_id": current_user.id,
+            **resources.thumbnail_pipeline.fields(content_type, stat.size)
+        }
+        await resources.files_collection.insert_one(file_metadata)
+        await resources.upload_sessions_collection.delete_one({"_id": pending["_id"]})
+        await record_files(resources, current_user.id, pending["folder_id"], 1, stat.size)
+        resources.thumbnail_pipeline.notify()
+        
+        return {
+            "message": "File uploaded successfully",
+            "file_id": file_id,
+            "filename": pending["name"],
+            "folder_id": pending["folder_id"]
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Upload commit failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Upload commit failed: {str(e)}")
+
+@router.get("/api/files/{file_id}/download-url", dependencies=[Depends(require_presigned_urls)])
+async def create_download_url(
+    file_id: str,
+    request: Request,
+    resources: Resources = Depends(get_resources),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        file_doc = await resources.files_collection.find_one({
+            "file_id": file_id, 
+            "user_id": current_user.id
+        })
+        if not file_doc:
+            raise HTTPException(status_code=404, detail="File not found")
+        
+        # Storage hands out compressed files as stored, so the client has to decode them
+        codec = (file_doc.get("compression") or {}).get("codec")
+        if codec and not accepts_encoding(request.headers.get("accept-encoding"), codec):
+            raise HTTPException(
+                status_code=406,
+                detail=f"File is stored {codec}-compressed; download it through /api/files/{file_id}/download"
+            )
+        
+        url = resources.object_store.presigned_get_url(
+            object_key(file_doc),
+            timedelta(seconds=settings.PRESIGNED_URL_EXPIRY),
+            filename=file_doc["name"],
+            content_type=file_doc["content_type"] or "application/octet-stream",
+            content_encoding=codec
+        )
+        
+        return {"download_url": url, "expires_in": settings.PRESIGNED_URL_EXPIRY}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create download URL: {str(e)}")
+
+@router.get("/api/files")
 async def list_files(
+    request: Request,
     folder_id: Optional[str] = Query(None),
     search: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=settings.MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    offset: int = Query(0, ge=0),
+    sort: ListingSort = Query(ListingSort.NAME),
+    order: SortOrder = Query(SortOrder.ASC),
+    resources: Resources = Depends(get_resources),
     current_user: User = Depends(get_current_user)
 ):
     try:
+        # Revalidation is answered from the folder version, before any listing query
+        searching = bool(search and search.strip())
+        version = await folder_version(
+            resources.folder_versions_collection, current_user.id, ALL_FOLDERS if searching else folder_id
+        )
+        etag = listing_etag(
+            version, settings.VERSION, current_user.id, folder_id, search,
+            limit, cursor, offset, sort.value, order.value
+        )
+        cache_headers = {"ETag": etag, "Cache-Control": REVALIDATE}
+        if is_not_modified(request.headers, etag):
+            return Response(status_code=304, headers=cache_headers)
+        
         # Build base query to include user_id filter
         base_query = {"user_id": current_user.id}
         
         # If search query is provided, search across all folders
-        if search and search.strip():
+        if searching:
             search_term = search.strip()
             logger.info(f"Searching for: {search_term}")
             
             items = []
+            truncated = False
             
-            # Search all folders for the user (case-insensitive)
-            folder_search_query = {
-                **base_query,
-                "name": {"$regex": search_term, "$options": "i"}
-            }
-            
-            for folder_doc in folders_collection.find(folder_search_query):
-                items.append({
-                    "id": str(folder_doc["_id"]),
-                    "name": folder_doc["name"],
-                    "created_date": folder_doc["created_date"].isoformat(),
-                    "folder_id": folder_doc["folder_id"],
-                    "parent_folder_id": folder_doc.get("parent_folder_id"),
-                    "item_type": "folder"
-                })
-            
-            # Search all files for the user (case-insensitive)
-            file_search_query = {
-                **base_query,
-                "name": {"$regex": search_term, "$options": "i"}
-            }
+            # Candidates come from the (user_id, name_grams) index; they are
+            # verified and ranked here, so each lookup is capped. Names starting
+            # with the term rank best, so they are looked up first on their own.
+            candidate_limit = settings.SEARCH_CANDIDATE_LIMIT
+            lookups = [
+                search_query(current_user.id, search_term, prefix=True),
+                search_query(current_user.id, search_term)
+            ]
             
-            for file_doc in files_collection.find(file_search_query):
-                items.append({
-                    "id": str(file_doc["_id"]),
-                    "name": file_doc["name"],
-                    "size": file_doc["size"],
-                    "content_type": file_doc["content_type"],
-                    "upload_date": file_doc["upload_date"].isoformat(),
-                    "file_id": file_doc["file_id"],
-                    "folder_id": file_doc.get("folder_id"),
-                    "item_type": "file"
-                })
+            phases = (("folder", resources.folders_collection), ("file", resources.files_collection))
+            for phase, collection in phases:
+                candidates = {}
+                for search_filter in lookups:
+                    # Sorted, so a capped lookup keeps the same candidates every time
+                    docs = [
+                        doc async for doc in collection.find(
+                            search_filter, PROJECTIONS[phase],
+                            sort=[("name", 1), ("_id", 1)], limit=candidate_limit + 1
+                        )
+                    ]
+                    if len(docs) > candidate_limit:
+                        truncated = True
+                    for doc in docs[:candidate_limit]:
+                        candidates.setdefault(doc["_id"], doc)
+                with timed("serialize"):
+                    items.extend(listing_rows(phase, candidates.values()))
             
-            logger.info(f"Search found {len(items)} items")
-            return {"items": items, "current_folder": folder_id, "search_term": search_term}
+            ranked = rank_matches(search_term, items)
+            logger.info(f"Search found {len(ranked)} items")
+            # Like folder listings, no limit means every match
+            end = offset + limit if limit else len(ranked)
+            return FastJSONResponse(content={
+                "items": ranked[offset:end],
+                "current_folder": folder_id,
+                "search_term": search_term,
+                "limit": limit,
+                "offset": offset,
+                "has_more": len(ranked) > end,
+                # Some candidates were left unranked; a longer term narrows the search
+                "truncated": truncated
+            }, headers=cache_headers)
+        
+        # Serialized pages are reused until the folder's version moves on
+        cache_key = listing_key(
+            current_user.id, folder_id, sort.value, order.value, limit, cursor, offset
+        )
+        cached = await resources.listing_cache.get(cache_key, version)
+        if cached is not None:
+            return Response(content=cached, media_type="application/json", headers=cache_headers)
         
         # Regular folder browsing (no search)
         if folder_id:
@@ -282,143 +904,394 @@ async def list_files(
             file_query = {**base_query, "folder_id": {"$in": [None, ""]}}
             folder_query = {**base_query, "parent_folder_id": {"$in": [None, ""]}}
         
-        items = []
+        # Paginate only when asked to, so existing clients still get everything
+        page_size = (limit or settings.LISTING_PAGE_SIZE) if (limit or cursor) else None
+        try:
+            position = decode_cursor(cursor, sort, order) if cursor else None
+        except InvalidCursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         
-        # Get folders in current directory
-        for folder_doc in folders_collection.find(folder_query):
-            items.append({
-                "id": str(folder_doc["_id"]),
-                "name": folder_doc["name"],
-                "created_date": folder_doc["created_date"].isoformat(),
-                "folder_id": folder_doc["folder_id"],
-                "parent_folder_id": folder_doc.get("parent_folder_id"),
-                "item_type": "folder"
-            })
+        items = []
+        next_cursor = None
+        phases = [
+            ("folder", resources.folders_collection, folder_query),
+            ("file", resources.files_collection, file_query)
+        ]
         
-        # Get files in current directory
-        for file_doc in files_collection.find(file_query):
-            items.append({
-                "id": str(file_doc["_id"]),
-                "name": file_doc["name"],
-                "size": file_doc["size"],
-                "content_type": file_doc["content_type"],
-                "upload_date": file_doc["upload_date"].isoformat(),
-                "file_id": file_doc["file_id"],
-                "folder_id": file_doc.get("folder_id"),
-                "item_type": "file"
-            })
+        # Subfolders first, then files; a cursor may resume in either phase
+        for phase, collection, query in phases:
+            if position and PHASES.index(phase) < PHASES.index(position["p"]):
+                continue
+            
+            find_options = {"sort": sort_spec(phase, sort, order)}
+            remaining = None
+            if page_size is not None:
+                remaining = page_size - len(items)
+                # One extra row tells us whether another page follows
+                find_options["limit"] = remaining + 1
+            
+            docs = [
+                doc async for doc in collection.find(
+                    {**query, **keyset_filter(phase, sort, order, position)},
+                    PROJECTIONS[phase],
+                    **find_options
+                )
+            ]
+            if remaining is not None and len(docs) > remaining:
+                docs = docs[:remaining]
+                next_cursor = encode_cursor(phase, sort, order, docs[-1] if docs else None)
+            
+            with timed("serialize"):
+                items.extend(listing_rows(phase, docs))
+            if next_cursor:
+                break
             
-        return {"items": items, "current_folder": folder_id}
+        with timed("serialize"):
+            listing = FastJSONResponse(content={
+                "items": items,
+                "current_folder": folder_id,
+                "sort": sort.value,
+                "order": order.value,
+                "next_cursor": next_cursor,
+                "has_more": next_cursor is not None
+            }, headers=cache_headers)
+        await resources.listing_cache.set(cache_key, version, listing.body)
+        return listing
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in list_files: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to list items: {str(e)}")
 
-@app.get("/api/files/{file_id}/download")
+async def iter_byteranges(
+    store,
+    object_name: str,
+    compression: Optional[dict],
+    ranges: List[ByteRange],
+    size: int,
+    content_type: str,
+    boundary: str
+):
+    """Stream a multipart/byteranges body, fetching each range from storage"""
+    for start, end in ranges:
+        yield multipart_part_header(boundary, content_type, start, end, size)
+        reader = await run_storage_io(
+            open_stored, store, object_name, compression, offset=start, length=end - start + 1
+        )
+        async for chunk in iter_object(reader):
+            yield chunk
+        yield b"\r\n"
+    yield multipart_trailer(boundary)
+
+@router.get("/api/files/{file_id}/download")
 async def download_file(
     file_id: str, 
+    request: Request,
+    resources: Resources = Depends(get_resources),
     current_user: User = Depends(get_current_user)
 ):
     try:
         # Get file metadata from MongoDB and verify ownership
-        file_doc = files_collection.find_one({
+        file_doc = await resources.files_collection.find_one({
             "file_id": file_id, 
             "user_id": current_user.id
         })
         if not file_doc:
             raise HTTPException(status_code=404, detail="File not found")
         
-        # Get file from MinIO
-        response = minio_client.get_object(settings.MINIO_BUCKET_NAME, file_id)
+        object_name = object_key(file_doc)
+        size = file_doc["size"]
+        content_type = file_doc["content_type"] or "application/octet-stream"
+        compression = file_doc.get("compression")
+        # Compressed files go out as stored to clients that can decode them,
+        # except for ranges, which are ranges of the original bytes
+        encoded = bool(compression) and not request.headers.get("range") and accepts_encoding(
+            request.headers.get("accept-encoding"), compression["codec"]
+        )
+        
+        etag = file_etag(file_doc)
+        if etag is None:
+            # Stored without a checksum: validate with the storage ETag, recorded for next time
+            stat = await run_storage_io(resources.object_store.stat, object_name)
+            etag = strong_etag(stat.etag)
+            await resources.files_collection.update_one(
+                {"file_id": file_id, "user_id": current_user.id}, {"$set": {"etag": stat.etag}}
+            )
+        validators = {
+            # A content-coded response is a different representation of the same bytes
+            "ETag": weak_etag(etag) if encoded else etag,
+            "Last-Modified": http_date(file_doc["upload_date"]),
+            "Cache-Control": REVALIDATE
+        }
+        if compression:
+            validators["Vary"] = "Accept-Encoding"
+        if is_not_modified(request.headers, etag, file_doc["upload_date"]):
+            return Response(status_code=304, headers=validators)
+        headers = {
+            "Content-Disposition": f"attachment; filename={file_doc['name']}",
+            "Accept-Ranges": "bytes",
+            **validators
+        }
         
-        def iterfile():
-            try:
-                for chunk in response:
-                    yield chunk
-            finally:
-                response.close()
-                response.release_conn()
+        try:
+            ranges = parse_range_header(request.headers.get("range"), size)
+        except RangeNotSatisfiableError:
+            raise HTTPException(
+                status_code=416,
+                detail="Requested range not satisfiable",
+                headers={"Content-Range": f"bytes */{size}"}
+            )
         
+        if ranges:
+            if not if_range_matches(request.headers.get("if-range"), etag, file_doc["upload_date"]):
+                # Representation changed since the client's partial copy
+                ranges = None
+        
+        if not ranges or len(ranges) == 1:
+            start, end = ranges[0] if ranges else (0, size - 1)
+            length = end - start + 1
+            if ranges:
+                headers["Content-Range"] = content_range(start, end, size)
+            if encoded:
+                headers["Content-Encoding"] = compression["codec"]
+                length = compression["stored_size"]
+                compression = None  # sent as stored, nothing to decode
+            headers["Content-Length"] = str(length)
+            status_code = 206 if ranges else 200
+            if not compression:
+                # Objects on local disk are sent from the file itself
+                path = await run_storage_io(resources.object_store.local_path, object_name)
+                if path is not None:
+                    return LocalFileResponse(
+                        path, start, length,
+                        status_code=status_code, media_type=content_type, headers=headers
+                    )
+            reader = await run_storage_io(
+                open_stored, resources.object_store, object_name, compression,
+                offset=start, length=length if ranges else None
+            )
+            return StreamingResponse(
+                iter_object(reader),
+                status_code=status_code,
+                media_type=content_type,
+                headers=headers
+            )
+        
+        boundary = secrets.token_hex(16)
+        headers["Content-Length"] = str(
+            multipart_length(boundary, content_type, ranges, size)
+        )
         return StreamingResponse(
-            iterfile(),
-            media_type=file_doc["content_type"],
-            headers={
-                "Content-Disposition": f"attachment; filename={file_doc['name']}"
-            }
+            iter_byteranges(
+                resources.object_store, object_name, compression, ranges, size, content_type, boundary
+            ),
+            status_code=206,
+            media_type=f"multipart/byteranges; boundary={boundary}",
+            headers=headers
         )
         
-    except S3Error as e:
+    except HTTPException:
+        raise
+    except StorageError:
         raise HTTPException(status_code=404, detail="File not found in storage")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Download failed: {str(e)}")
 
-@app.put("/api/files/{file_id}")
+@router.get("/api/files/{file_id}/thumbnail")
+async def get_thumbnail(
+    file_id: str,
+    resources: Resources = Depends(get_resources),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        file_doc = await resources.files_collection.find_one(
+            {"file_id": file_id, "user_id": current_user.id},
+            {"file_id": 1, "object_name": 1, "thumbnail": 1}
+        )
+        if not file_doc:
+            raise HTTPException(status_code=404, detail="File not found")
+        if not has_thumbnail(file_doc):
+            status = (file_doc.get("thumbnail") or {}).get("status", "none")
+            raise HTTPException(
+                status_code=404,
+                detail={"message": "Thumbnail not available", "status": status}
+            )
+        
+        data = await run_storage_io(resources.object_store.read, thumbnail_key(object_key(file_doc)))
+        # Derived from immutable bytes: cacheable for as long as the file exists
+        return Response(
+            content=data,
+            media_type="image/jpeg",
+            headers={"Cache-Control": "private, max-age=31536000, immutable"}
+        )
+        
+    except HTTPException:
+        raise
+    except StorageError:
+        raise HTTPException(status_code=404, detail="Thumbnail not found in storage")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Thumbnail failed: {str(e)}")
+
+@router.get("/api/archive")
+async def download_archive(
+    folder_id: List[str] = Query([], description="Folders to include with everything below them"),
+    file_id: List[str] = Query([], description="Individual files to include"),
+    resources: Resources = Depends(get_resources),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        if not folder_id and not file_id:
+            raise HTTPException(status_code=400, detail="Nothing selected to download")
+        
+        folders = []
+        if folder_id:
+            folders = [
+                doc async for doc in resources.folders_collection.find(
+                    subtree_filter(current_user.id, folder_id),
+                    {**ANCESTRY_PROJECTION, "created_date": 1}
+                )
+            ]
+            found = {doc["folder_id"] for doc in folders}
+            if not set(folder_id) <= found:
+                raise HTTPException(status_code=404, detail="Folder not found")
+        
+        files = [
+            doc async for doc in resources.files_collection.find(
+                {"user_id": current_user.id, "$or": [
+                    {"folder_id": {"$in": [doc["folder_id"] for doc in folders]}},
+                    {"file_id": {"$in": file_id}}
+                ]},
+                {"name": 1, "size": 1, "content_type": 1, "upload_date": 1,
+                 "file_id": 1, "folder_id": 1, "object_name": 1, "compression": 1}
+            )
+        ]
+        if not set(file_id) <= {doc["file_id"] for doc in files}:
+            raise HTTPException(status_code=404, detail="File not found")
+        
+        entries = build_entries(folders, files, set(folder_id), object_key)
+        # Members are archived from the original bytes of compressed files
+        compressed = {object_key(doc): doc["compression"] for doc in files if doc.get("compression")}
+        if len(folder_id) == 1 and not file_id:
+            archive_name = next(doc["name"] for doc in folders if doc["folder_id"] == folder_id[0])
+        else:
+            archive_name = "download"
+        
+        return StreamingResponse(
+            stream_archive(
+                entries, lambda key: open_stored(resources.object_store, key, compressed.get(key)),
+                read_ahead=settings.ARCHIVE_READ_AHEAD,
+                compression_level=settings.ARCHIVE_COMPRESSION_LEVEL
+            ),
+            media_type="application/zip",
+            headers={"Content-Disposition": f"attachment; filename={archive_name}.zip"}
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Archive failed: {str(e)}")
+
+@router.get("/api/folders/{folder_id}/download")
+async def download_folder(
+    folder_id: str,
+    resources: Resources = Depends(get_resources),
+    current_user: User = Depends(get_current_user)
+):
+    return await download_archive(
+        folder_id=[folder_id], file_id=[], resources=resources, current_user=current_user
+    )
+
+@router.put("/api/files/{file_id}")
 async def update_file(
     file_id: str, 
     file_update: FileUpdate,
+    resources: Resources = Depends(get_resources),
     current_user: User = Depends(get_current_user)
 ):
     try:
         # Update file metadata in MongoDB with user verification
-        result = files_collection.update_one(
+        file_doc = await resources.files_collection.find_one_and_update(
             {"file_id": file_id, "user_id": current_user.id},
-            {"$set": {"name": file_update.name}}
+            {"$set": {"name": file_update.name, **search_fields(file_update.name)}},
+            projection={"folder_id": 1}
         )
         
-        if result.matched_count == 0:
+        if file_doc is None:
             raise HTTPException(status_code=404, detail="File not found")
         
+        await touch_folders(resources, current_user.id, file_doc.get("folder_id"))
         return {"message": "File updated successfully"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Update failed: {str(e)}")
 
-@app.delete("/api/files/{file_id}")
+@router.delete("/api/files/{file_id}")
 async def delete_file(
     file_id: str,
+    resources: Resources = Depends(get_resources),
     current_user: User = Depends(get_current_user)
 ):
     try:
         # Delete file metadata from MongoDB with user verification
-        result = files_collection.delete_one({
+        file_doc = await resources.files_collection.find_one_and_delete({
             "file_id": file_id, 
             "user_id": current_user.id
         })
         
-        if result.deleted_count == 0:
+        if file_doc is None:
             raise HTTPException(status_code=404, detail="File not found")
+        await record_files(
+            resources, current_user.id, file_doc.get("folder_id"), -1, -file_doc.get("size", 0)
+        )
         
-        # Delete file from MinIO
-        try:
-            minio_client.remove_object(settings.MINIO_BUCKET_NAME, file_id)
-        except S3Error:
-            # File might not exist in MinIO, but we've already deleted from MongoDB
-            pass
+        # Delete the object, or release this file's reference to a shared blob
+        await release_object(resources.blobs_collection, resources.object_store, file_doc)
         
         return {"message": "File deleted successfully"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Delete failed: {str(e)}")
 
 # Folder management endpoints
-@app.post("/api/folders")
+@router.post("/api/folders")
 async def create_folder(
     folder_data: FolderCreate,
+    resources: Resources = Depends(get_resources),
     current_user: User = Depends(get_current_user)
 ):
     try:
         folder_id = str(ObjectId())
         
+        parent = None
+        if folder_data.parent_folder_id:
+            parent = await resources.folders_collection.find_one(
+                {"folder_id": folder_data.parent_folder_id, "user_id": current_user.id},
+                ANCESTRY_PROJECTION
+            )
+            if not parent:
+                raise HTTPException(status_code=404, detail="Parent folder not found")
+        
         folder_metadata = {
             "_id": ObjectId(folder_id),
             "name": folder_data.name,
+            **search_fields(folder_data.name),
             "created_date": datetime.utcnow(),
             "folder_id": folder_id,
             "parent_folder_id": folder_data.parent_folder_id,
+            "ancestors": child_ancestors(parent),
             "item_type": "folder",
-            "user_id": current_user.id  # Associate with user
+            "user_id": current_user.id,  # Associate with user
+            "usage": empty_usage()
         }
         
-        folders_collection.insert_one(folder_metadata)
+        await resources.folders_collection.insert_one(folder_metadata)
+        changes = UsageChanges()
+        changes.add_item(folder_chain(parent), folders=1)
+        await record_usage(resources, current_user.id, changes, folder_data.parent_folder_id)
         
         return {
             "message": "Folder created successfully",
@@ -426,72 +1299,300 @@ async def create_folder(
             "name": folder_data.name
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create folder: {str(e)}")
 
-@app.put("/api/folders/{folder_id}")
+@router.put("/api/folders/{folder_id}")
 async def update_folder(
     folder_id: str, 
     folder_update: FolderUpdate,
+    resources: Resources = Depends(get_resources),
     current_user: User = Depends(get_current_user)
 ):
     try:
-        result = folders_collection.update_one(
+        folder = await resources.folders_collection.find_one_and_update(
             {"folder_id": folder_id, "user_id": current_user.id},
-            {"$set": {"name": folder_update.name}}
+            {"$set": {"name": folder_update.name, **search_fields(folder_update.name)}},
+            projection={"parent_folder_id": 1}
         )
         
-        if result.matched_count == 0:
+        if folder is None:
             raise HTTPException(status_code=404, detail="Folder not found")
         
+        await rename_in_descendants(
+            resources.folders_collection, current_user.id, folder_id, folder_update.name
+        )
+        await touch_folders(resources, current_user.id, folder.get("parent_folder_id"))
+        
         return {"message": "Folder updated successfully"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Update failed: {str(e)}")
 
-@app.delete("/api/folders/{folder_id}")
+@router.delete("/api/folders/{folder_id}")
 async def delete_folder(
     folder_id: str,
+    recursive: bool = Query(False, description="Delete the folder with everything in it as a background job"),
+    resources: Resources = Depends(get_resources),
     current_user: User = Depends(get_current_user)
 ):
     try:
-        # Check if folder contains any items (with user verification)
-        files_count = files_collection.count_documents({
-            "folder_id": folder_id, 
-            "user_id": current_user.id
-        })
-        subfolders_count = folders_collection.count_documents({
-            "parent_folder_id": folder_id, 
-            "user_id": current_user.id
-        })
+        folder = await resources.folders_collection.find_one(
+            {"folder_id": folder_id, "user_id": current_user.id},
+            {**ANCESTRY_PROJECTION, **USAGE_PROJECTION}
+        )
+        if not folder:
+            raise HTTPException(status_code=404, detail="Folder not found")
         
-        if files_count > 0 or subfolders_count > 0:
-            raise HTTPException(status_code=400, detail="Cannot delete non-empty folder")
+        if recursive:
+            async def delete_work(report):
+                # Filled as the job goes, so a failure still accounts for what went
+                removed, touched = defaultdict(Counter), set()
+                try:
+                    await delete_subtree(
+                        resources.folders_collection, resources.files_collection,
+                        resources.blobs_collection, resources.object_store,
+                        current_user.id, [folder_id], report,
+                        batch_size=settings.JOB_BATCH_SIZE, removed=removed, touched=touched
+                    )
+                finally:
+                    await record_usage(
+                        resources, current_user.id, removed_subtrees([folder], removed),
+                        folder.get("parent_folder_id"), *touched
+                    )
+            
+            job = new_job(current_user.id, JobType.DELETE_FOLDER, folder_ids=[folder_id])
+            await resources.jobs_collection.insert_one(job)
+            start_job(resources.jobs_collection, job, delete_work)
+            return JSONResponse(status_code=202, content=serialize_job(job))
         
-        result = folders_collection.delete_one({
-            "folder_id": folder_id, 
-            "user_id": current_user.id
-        })
+        usage = folder.get("usage") or {}
+        if usage.get("tracked"):
+            non_empty = usage.get("files", 0) > 0 or usage.get("folders", 0) > 0
+        else:
+            # Counters not rebuilt for this folder yet: check with the collections
+            non_empty = await resources.files_collection.count_documents({
+                "folder_id": folder_id, 
+                "user_id": current_user.id
+            }) > 0 or await resources.folders_collection.count_documents({
+                "parent_folder_id": folder_id, 
+                "user_id": current_user.id
+            }) > 0
+        
+        if non_empty:
+            raise HTTPException(status_code=400, detail="Cannot delete non-empty folder")
         
-        if result.deleted_count == 0:
+        if await resources.folders_collection.find_one_and_delete(
+            {"folder_id": folder_id, "user_id": current_user.id},
+            projection={"_id": 1}
+        ) is None:
             raise HTTPException(status_code=404, detail="Folder not found")
         
+        changes = UsageChanges()
+        changes.add_item(folder_chain(folder)[:-1], folders=-1)
+        await record_usage(resources, current_user.id, changes, folder.get("parent_folder_id"))
         return {"message": "Folder deleted successfully"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Delete failed: {str(e)}")
 
-@app.get("/api/folders/{folder_id}/breadcrumb")
+@router.post("/api/folders/{folder_id}/move")
+async def move_folder(
+    folder_id: str,
+    folder_move: FolderMove,
+    resources: Resources = Depends(get_resources),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        folder = await resources.folders_collection.find_one(
+            {"folder_id": folder_id, "user_id": current_user.id},
+            {**ANCESTRY_PROJECTION, **USAGE_PROJECTION}
+        )
+        if not folder:
+            raise HTTPException(status_code=404, detail="Folder not found")
+        
+        target = None
+        if folder_move.target_folder_id:
+            target = await resources.folders_collection.find_one(
+                {"folder_id": folder_move.target_folder_id, "user_id": current_user.id},
+                ANCESTRY_PROJECTION
+            )
+            if not target:
+                raise HTTPException(status_code=404, detail="Target folder not found")
+        
+        try:
+            check_move(folder, target)
+        except FolderCycleError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        async def move_work(report):
+            await move_subtree(resources.folders_collection, current_user.id, folder, target, report)
+            changes = UsageChanges()
+            changes.add_subtree(folder_chain(folder)[:-1], folder, -1, count_user=False)
+            changes.add_subtree(folder_chain(target), folder, 1, count_user=False)
+            await record_usage(
+                resources, current_user.id, changes,
+                folder.get("parent_folder_id"), folder_move.target_folder_id
+            )
+        
+        job = new_job(
+            current_user.id, JobType.MOVE_FOLDER,
+            folder_id=folder_id, target_folder_id=folder_move.target_folder_id
+        )
+        await resources.jobs_collection.insert_one(job)
+        start_job(resources.jobs_collection, job, move_work)
+        return JSONResponse(status_code=202, content=serialize_job(job))
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Move failed: {str(e)}")
+
+@router.post("/api/items/batch")
+async def batch_items(
+    batch: BatchRequest,
+    resources: Resources = Depends(get_resources),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        if len(batch.operations) > settings.MAX_BATCH_ITEMS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"A batch can hold at most {settings.MAX_BATCH_ITEMS} operations"
+            )
+        
+        # One ownership lookup and one bulk_write per collection
+        files, folders = await load_items(
+            resources.files_collection, resources.folders_collection, current_user.id, batch.operations
+        )
+        plan = plan_batch(current_user.id, batch.operations, files, folders)
+        await apply_plan(plan, resources.files_collection, resources.folders_collection)
+        await record_usage(
+            resources, current_user.id, usage_changes(plan, files, folders),
+            *touched_folders(plan, files, folders)
+        )
+        
+        try:
+            await release_objects(
+                resources.blobs_collection, resources.object_store, released_files(plan)
+            )
+        except Exception as e:
+            # Metadata is already gone; leftover objects are only wasted space
+            logger.warning(f"Failed to remove objects for batch delete: {e}")
+        
+        job = None
+        if plan.deleted_folders:
+            deleted = [folders[folder_id] for folder_id in plan.deleted_folders.values()]
+            
+            async def delete_work(report):
+                # Filled as the job goes, so a failure still accounts for what went
+                removed, touched = defaultdict(Counter), set()
+                try:
+                    await delete_subtree(
+                        resources.folders_collection, resources.files_collection,
+                        resources.blobs_collection, resources.object_store,
+                        current_user.id, job["folder_ids"], report,
+                        batch_size=settings.JOB_BATCH_SIZE, removed=removed, touched=touched
+                    )
+                finally:
+                    await record_usage(
+                        resources, current_user.id, removed_subtrees(deleted, removed),
+                        *{doc.get("parent_folder_id") for doc in deleted}, *touched
+                    )
+            
+            job = new_job(
+                current_user.id, JobType.DELETE_FOLDER,
+                folder_ids=list(plan.deleted_folders.values())
+            )
+            await resources.jobs_collection.insert_one(job)
+            start_job(resources.jobs_collection, job, delete_work)
+            for index in plan.deleted_folders:
+                plan.succeed(index, "accepted", job_id=job["job_id"])
+        
+        failed = sum(result["status"] == "error" for result in plan.results)
+        return {
+            "results": plan.results,
+            "succeeded": len(plan.results) - failed,
+            "failed": failed,
+            "job": serialize_job(job) if job else None
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Batch failed: {str(e)}")
+
+@router.get("/api/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    resources: Resources = Depends(get_resources),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        job = await resources.jobs_collection.find_one({"job_id": job_id, "user_id": current_user.id})
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return serialize_job(job)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get job: {str(e)}")
+
+@router.get("/api/usage")
+async def get_usage(
+    folder_id: Optional[str] = Query(None),
+    resources: Resources = Depends(get_resources),
+    current_user: User = Depends(get_current_user)
+):
+    try:
+        if folder_id:
+            folder = await resources.folders_collection.find_one(
+                {"folder_id": folder_id, "user_id": current_user.id}, USAGE_PROJECTION
+            )
+            if not folder:
+                raise HTTPException(status_code=404, detail="Folder not found")
+            usage = serialize_usage(folder.get("usage"))
+        else:
+            usage = serialize_user_usage(await resources.usage_collection.find_one({"_id": current_user.id}))
+        
+        if usage is None:
+            # Created before rollups existed and not rebuilt since
+            raise HTTPException(status_code=409, detail="Usage is not tracked yet, run usage.py --rebuild")
+        return {"folder_id": folder_id, **usage}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get usage: {str(e)}")
+
+@router.get("/api/folders/{folder_id}/breadcrumb")
 async def get_folder_breadcrumb(
     folder_id: str,
+    resources: Resources = Depends(get_resources),
     current_user: User = Depends(get_current_user)
 ):
     try:
+        folder = await resources.folders_collection.find_one(
+            {"folder_id": folder_id, "user_id": current_user.id},
+            ANCESTRY_PROJECTION
+        )
+        if folder and "ancestors" in folder:
+            return {"breadcrumb": breadcrumb_path(folder)}
+        
+        # Folders not yet backfilled with ancestors: walk up one level at a time
         breadcrumb = []
         current_folder_id = folder_id
         
         while current_folder_id:
-            folder = folders_collection.find_one({
+            folder = await resources.folders_collection.find_one({
                 "folder_id": current_folder_id, 
                 "user_id": current_user.id
             })
@@ -511,3 +1612,36 @@ async def get_folder_breadcrumb(
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get breadcrumb: {str(e)}")
+
+
+def create_app() -> FastAPI:
+    """Build the API; its lifespan creates the clients and caches it serves requests with"""
+    app = FastAPI(
+        title=settings.PROJECT_NAME,
+        version=settings.VERSION,
+        description=settings.DESCRIPTION,
+        lifespan=lifespan
+    )
+
+    # CORS middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=settings.CORS_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["GET", "POST", "PUT", "DELETE"],
+        allow_headers=["*"],
+        expose_headers=["Accept-Ranges", "Content-Range", "Content-Length", "Content-Disposition", "ETag"],
+    )
+
+    app.include_router(router)
+
+    if settings.METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware, routes=app.router.routes)
+
+    return app
+
+
+app = create_app()
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+STARTUP_SECONDS.set(IMPORT_SECONDS, phase="import")
@@ -0,0 +1,331 @@
+"""Prometheus metrics, served in the text exposition format at ``GET /metrics``.
+
+The registry is a small in-process one (counters, gauges and histograms with
+labels), so there is nothing extra to install. Like the other ``/health``
+stats it is per worker: scrape every uvicorn worker, or run one per container.
+
+``MetricsMiddleware`` times every request by route template and counts body
+bytes in and out, which covers upload and download volume. It also opens a
+per-request ``timings`` dict in a context variable. The Mongo command
+listener, the MinIO wrapper, auth and serialization add their time to it, and
+when the request ends each phase is observed into
+``http_request_phase_seconds{route,phase}``. That is how a slow ``list_files``
+is told apart into ``mongodb``, ``serialize`` or ``auth``. Phases can overlap:
+``auth`` includes its users lookup, which also counts as ``mongodb``.
+"""
+import functools
+import inspect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from pymongo import monitoring
+from starlette.routing import Match
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+
+    def register(self, metric: "_Metric"):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _snapshot(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            return sorted(self._values.items())
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        for key, value in self._snapshot():
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, registry: Registry = REGISTRY):
+        super().__init__(name, help, labels, registry)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            counts = list(counts)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def get(self, **labels) -> Tuple[int, float]:
+        """Observation count and sum"""
+        counts, total = self._values.get(self._key(labels)) or ([0], 0.0)
+        return sum(counts), total
+
+    def samples(self):
+        for key, (counts, total) in self._snapshot():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames + ("le",), key + (_format_value(bound),))
+                yield f"{self.name}_bucket", labels, cumulative
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Request latency by route", ["method", "route", "status"]
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests being served", ["method", "route"]
+)
+HTTP_REQUEST_BYTES = Counter(
+    "http_request_body_bytes_total", "Request body bytes received (uploads)", ["route"]
+)
+HTTP_RESPONSE_BYTES = Counter(
+    "http_response_body_bytes_total", "Response body bytes sent (downloads)", ["route"]
+)
+PHASE_SECONDS = Histogram(
+    "http_request_phase_seconds", "Time a request spent per phase", ["route", "phase"]
+)
+MONGO_SECONDS = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency", ["command", "collection"]
+)
+MONGO_FAILURES = Counter(
+    "mongodb_command_failures_total", "Failed MongoDB commands", ["command", "collection"]
+)
+MINIO_SECONDS = Histogram(
+    "minio_request_duration_seconds", "MinIO call latency", ["operation"]
+)
+MINIO_FAILURES = Counter(
+    "minio_request_failures_total", "Failed MinIO calls", ["operation"]
+)
+STARTUP_SECONDS = Gauge(
+    "app_startup_seconds", "Time this worker spent starting up, by phase", ["phase"]
+)
+
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def add_time(phase: str, seconds: float):
+    """Charge ``seconds`` to ``phase`` of the current request, if any"""
+    timings = _timings.get()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed(phase: str):
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        add_time(phase, perf_counter() - start)
+
+
+def route_template(routes, scope) -> str:
+    """The path template a request is routed to, to keep label values bounded"""
+    partial = None
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(self.routes, scope)
+        status = 500
+        timings: Dict[str, float] = {}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request" and message.get("body"):
+                HTTP_REQUEST_BYTES.inc(len(message["body"]), route=route)
+            return message
+
+        async def counting_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and message.get("body"):
+                HTTP_RESPONSE_BYTES.inc(len(message["body"]), route=route)
+            elif message["type"] == "http.response.zerocopysend" and message.get("count"):
+                HTTP_RESPONSE_BYTES.inc(message["count"], route=route)
+            await send(message)
+
+        token = _timings.set(timings)
+        HTTP_IN_FLIGHT.inc(method=method, route=route)
+        start = perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            HTTP_IN_FLIGHT.dec(method=method, route=route)
+            HTTP_REQUEST_SECONDS.observe(perf_counter() - start, method=method, route=route, status=status)
+            for phase, seconds in timings.items():
+                PHASE_SECONDS.observe(seconds, route=route, phase=phase)
+            _timings.reset(token)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command the client sends, per command and collection"""
+
+    def __init__(self):
+        self._collections: Dict[Tuple[Any, int], str] = {}
+
+    def started(self, event):
+        # find, insert, update, aggregate... name their collection; getMore has it separately
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get("collection")
+        self._collections[(event.connection_id, event.request_id)] = (
+            collection if isinstance(collection, str) else ""
+        )
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        collection = self._record(event)
+        MONGO_FAILURES.inc(command=event.command_name, collection=collection)
+
+    def _record(self, event) -> str:
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        seconds = event.duration_micros / 1e6
+        MONGO_SECONDS.observe(seconds, command=event.command_name, collection=collection)
+        add_time("mongodb", seconds)
+        return collection
+
+
+class TimedMinio:
+    """Proxy for a ``Minio`` client that times each call.
+
+    Calls returning generators (``list_objects``, ``remove_objects``) are timed
+    while they are consumed; ``get_object`` is timed up to the response headers.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._client, name)
+        # Multipart uploads go through minio-py's underscored methods, so only dunders are skipped
+        if name.startswith("__") or not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def timed_call(*args, **kwargs):
+            start = perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                MINIO_FAILURES.inc(operation=name)
+                raise
+            finally:
+                _observe_minio(name, perf_counter() - start)
+            if inspect.isgenerator(result):
+                return _timed_iter(name, result)
+            return result
+
+        return timed_call
+
+
+def _observe_minio(operation: str, seconds: float):
+    MINIO_SECONDS.observe(seconds, operation=operation)
+    add_time("minio", seconds)
+
+
+def _timed_iter(operation: str, iterator) -> Iterator:
+    start = perf_counter()
+    try:
+        yield from iterator
+    except Exception:
+        MINIO_FAILURES.inc(operation=operation)
+        raise
+    finally:
+        _observe_minio(operation, perf_counter() - start)
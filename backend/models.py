@@ -34,7 +34,35 @@ class FolderCreate(BaseModel):
 class FolderUpdate(BaseModel):
     name: str
 
+class FolderMove(BaseModel):
+    target_folder_id: Optional[str] = None
+
 class ItemMove(BaseModel):
     item_id: str
     item_type: ItemType
-    target_folder_id: Optional[str] = None
\ No newline at end of file
+    target_folder_id: Optional[str] = None
+
+class BatchAction(str, Enum):
+    MOVE = "move"
+    RENAME = "rename"
+    DELETE = "delete"
+
+class BatchOperation(ItemMove):
+    action: BatchAction
+    name: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int
+    content_type: Optional[str] = None
+    folder_id: Optional[str] = None
+    chunk_size: Optional[int] = None
+
+class PresignedUploadCreate(BaseModel):
+    filename: str
+    size: Optional[int] = None
+    content_type: Optional[str] = None
+    folder_id: Optional[str] = None
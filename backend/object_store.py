@@ -0,0 +1,535 @@
+"""Where file bytes live, behind one interface.
+
+``ObjectStore`` is what the API, blobs, thumbnails and jobs talk to: streamed
+puts, ranged reads, batched deletes, server-side copies, multipart uploads
+and presigned URLs. ``STORAGE_BACKEND`` picks the driver:
+
+- ``minio`` (default): a MinIO (or other S3) bucket, through minio-py.
+- ``local``: plain files under ``LOCAL_STORAGE_PATH``, for single-node
+  deployments and development without a MinIO server. Keys map to paths below
+  the root; writes land in a temporary file first and are renamed into
+  place, so readers never see a partial object. Ranged reads come from a
+  memory map, and ``LocalFileResponse`` hands downloads to the server as a
+  file descriptor to ``sendfile`` when it supports the ASGI zero-copy
+  extension. Presigned URLs need an S3 endpoint and are not offered.
+
+All methods block; call them through ``run_storage_io``. Missing objects and
+uploads raise ``ObjectNotFoundError``, other storage failures ``StorageError``.
+"""
+import hashlib
+import io
+import mmap
+import os
+import secrets
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import BinaryIO, Dict, Iterable, List, NamedTuple, Optional
+import certifi
+import urllib3
+from minio import Minio
+from minio.commonconfig import ComposeSource
+from minio.error import S3Error
+from starlette.responses import StreamingResponse
+from storage import (
+    HashingReader, StoredObject, abort_multipart_upload, complete_multipart_upload,
+    create_multipart_upload, iter_object, remove_objects, run_storage_io, stream_to_minio,
+    upload_part
+)
+
+# ASGI extension through which a server sends a file descriptor with sendfile
+ZEROCOPY_SEND = "http.response.zerocopysend"
+
+
+class StorageError(Exception):
+    """A storage call failed"""
+
+
+class ObjectNotFoundError(StorageError):
+    """The object, or the multipart upload, does not exist"""
+
+
+class ObjectInfo(NamedTuple):
+    size: int
+    etag: str
+    content_type: Optional[str]
+    last_modified: datetime
+
+
+class RemoveError(NamedTuple):
+    name: str
+    message: str
+
+
+class ObjectStore:
+    name = ""
+    supports_presigned_urls = False
+
+    @property
+    def location(self) -> str:
+        """Where objects are kept, for logs"""
+        raise NotImplementedError
+
+    def ensure_ready(self):
+        """Create the bucket or directory if it does not exist yet"""
+        raise NotImplementedError
+
+    def check(self):
+        """Raise if the store cannot be reached"""
+        raise NotImplementedError
+
+    def put_stream(self, key: str, stream: BinaryIO, content_type: Optional[str] = None,
+                   max_size: Optional[int] = None) -> StoredObject:
+        """Store a stream of unknown length, sizing and hashing it on the way"""
+        raise NotImplementedError
+
+    def put_bytes(self, key: str, data: bytes, content_type: Optional[str] = None):
+        raise NotImplementedError
+
+    def open(self, key: str, offset: int = 0, length: Optional[int] = None):
+        """A reader (``read(size)``, ``close()``) over the object or a range of it"""
+        raise NotImplementedError
+
+    def read(self, key: str) -> bytes:
+        reader = self.open(key)
+        try:
+            return reader.read()
+        finally:
+            reader.close()
+
+    def stat(self, key: str) -> ObjectInfo:
+        raise NotImplementedError
+
+    def copy(self, source: str, target: str):
+        raise NotImplementedError
+
+    def remove(self, key: str):
+        """Delete an object; deleting one that does not exist is not an error"""
+        raise NotImplementedError
+
+    def remove_many(self, keys: Iterable[str]) -> List[RemoveError]:
+        """Batched ``remove``; returns the keys that could not be deleted"""
+        raise NotImplementedError
+
+    def create_multipart_upload(self, key: str, content_type: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, data: bytes) -> str:
+        """Store one part; returns its etag"""
+        raise NotImplementedError
+
+    def complete_multipart_upload(self, key: str, upload_id: str, parts: Dict[int, str]) -> str:
+        """Join the parts (part number to etag) into the object; returns its etag"""
+        raise NotImplementedError
+
+    def abort_multipart_upload(self, key: str, upload_id: str):
+        raise NotImplementedError
+
+    def presigned_put_url(self, key: str, expires: timedelta) -> str:
+        raise NotImplementedError(f"{self.name} storage does not offer presigned URLs")
+
+    def presigned_get_url(self, key: str, expires: timedelta, filename: str,
+                          content_type: str, content_encoding: Optional[str] = None) -> str:
+        raise NotImplementedError(f"{self.name} storage does not offer presigned URLs")
+
+    def local_path(self, key: str) -> Optional[str]:
+        """Path of the object on this host, when the driver keeps it on disk"""
+        return None
+
+
+# MinIO
+
+NOT_FOUND_CODES = {"NoSuchKey", "NoSuchUpload", "NoSuchBucket", "NoSuchObject"}
+
+
+@contextmanager
+def _s3_errors():
+    try:
+        yield
+    except S3Error as e:
+        if e.code in NOT_FOUND_CODES:
+            raise ObjectNotFoundError(e.message) from e
+        raise StorageError(f"{e.code}: {e.message}") from e
+
+
+class _MinioObject:
+    """A ``get_object`` response; closing it returns the connection to the pool"""
+
+    def __init__(self, response):
+        self._response = response
+
+    def read(self, size: int = -1) -> bytes:
+        with _s3_errors():
+            return self._response.read(None if size < 0 else size)
+
+    def close(self):
+        self._response.close()
+        self._response.release_conn()
+
+
+class MinioStore(ObjectStore):
+    name = "minio"
+    supports_presigned_urls = True
+
+    def __init__(self, client: Minio, bucket: str, presign_client: Optional[Minio] = None):
+        self.client = client
+        self.bucket = bucket
+        # Signs URLs for the endpoint clients can reach
+        self.presign_client = presign_client or client
+
+    @property
+    def location(self) -> str:
+        return self.bucket
+
+    def ensure_ready(self):
+        with _s3_errors():
+            if not self.client.bucket_exists(self.bucket):
+                self.client.make_bucket(self.bucket)
+
+    def check(self):
+        with _s3_errors():
+            self.client.bucket_exists(self.bucket)
+
+    def put_stream(self, key, stream, content_type=None, max_size=None):
+        with _s3_errors():
+            return stream_to_minio(self.client, self.bucket, key, stream,
+                                   content_type=content_type, max_size=max_size)
+
+    def put_bytes(self, key, data, content_type=None):
+        with _s3_errors():
+            self.client.put_object(self.bucket, key, io.BytesIO(data), len(data),
+                                   content_type=content_type or "application/octet-stream")
+
+    def open(self, key, offset=0, length=None):
+        ranged = {"offset": offset, "length": length} if offset or length else {}
+        with _s3_errors():
+            return _MinioObject(self.client.get_object(self.bucket, key, **ranged))
+
+    def stat(self, key):
+        with _s3_errors():
+            stat = self.client.stat_object(self.bucket, key)
+        return ObjectInfo(stat.size, stat.etag, stat.content_type, stat.last_modified)
+
+    def copy(self, source, target):
+        with _s3_errors():
+            self.client.compose_object(self.bucket, target, [ComposeSource(self.bucket, source)])
+
+    def remove(self, key):
+        with _s3_errors():
+            self.client.remove_object(self.bucket, key)
+
+    def remove_many(self, keys):
+        with _s3_errors():
+            return [RemoveError(error.name, error.message)
+                    for error in remove_objects(self.client, self.bucket, keys)]
+
+    def create_multipart_upload(self, key, content_type=None):
+        with _s3_errors():
+            return create_multipart_upload(self.client, self.bucket, key, content_type)
+
+    def upload_part(self, key, upload_id, part_number, data):
+        with _s3_errors():
+            return upload_part(self.client, self.bucket, key, upload_id, part_number, data)
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        with _s3_errors():
+            return complete_multipart_upload(self.client, self.bucket, key, upload_id, parts).etag
+
+    def abort_multipart_upload(self, key, upload_id):
+        with _s3_errors():
+            abort_multipart_upload(self.client, self.bucket, key, upload_id)
+
+    def presigned_put_url(self, key, expires):
+        return self.presign_client.presigned_put_object(self.bucket, key, expires=expires)
+
+    def presigned_get_url(self, key, expires, filename, content_type, content_encoding=None):
+        response_headers = {
+            "response-content-disposition": f"attachment; filename={filename}",
+            "response-content-type": content_type,
+        }
+        if content_encoding:
+            response_headers["response-content-encoding"] = content_encoding
+        return self.presign_client.presigned_get_object(
+            self.bucket, key, expires=expires, response_headers=response_headers
+        )
+
+
+# Local filesystem
+
+UPLOADS_DIR = ".uploads"
+TEMP_DIR = ".tmp"
+COPY_CHUNK = 1024 * 1024
+
+
+class _MappedObject:
+    """Reads a byte range straight out of a memory map of the file"""
+
+    def __init__(self, mapped: Optional[mmap.mmap], start: int, end: int):
+        self._mapped = mapped
+        self._position = start
+        self._end = end
+
+    def read(self, size: int = -1) -> bytes:
+        if self._mapped is None:
+            return b""
+        stop = self._end if size < 0 else min(self._end, self._position + size)
+        data = self._mapped[self._position:stop]
+        self._position = max(self._position, stop)
+        return data
+
+    def close(self):
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+
+
+def open_mapped(path: str, offset: int = 0, length: Optional[int] = None) -> _MappedObject:
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        end = size if length is None else min(size, offset + length)
+        if offset >= end:
+            return _MappedObject(None, 0, 0)
+        # The map holds its own reference to the file, so it can be closed here
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mapped, "madvise"):
+        mapped.madvise(mmap.MADV_SEQUENTIAL)
+    return _MappedObject(mapped, offset, end)
+
+
+def _send_file(source, target):
+    """Append all of ``source`` to ``target`` with sendfile, without the bytes
+    passing through user space"""
+    size = os.fstat(source.fileno()).st_size
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(target.fileno(), source.fileno(), offset, size - offset)
+        if not sent:
+            break
+        offset += sent
+
+
+@contextmanager
+def _not_found(key: str):
+    try:
+        yield
+    except FileNotFoundError as e:
+        raise ObjectNotFoundError(f"{key} does not exist") from e
+
+
+class LocalStore(ObjectStore):
+    name = "local"
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    @property
+    def location(self) -> str:
+        return self.root
+
+    def path(self, key: str) -> str:
+        parts = key.split("/")
+        if not key or key.startswith("/") or any(part in ("", ".", "..") for part in parts) \
+                or parts[0] in (UPLOADS_DIR, TEMP_DIR):
+            raise ValueError(f"Invalid object key {key!r}")
+        return os.path.join(self.root, *parts)
+
+    def ensure_ready(self):
+        for directory in (self.root, os.path.join(self.root, UPLOADS_DIR), os.path.join(self.root, TEMP_DIR)):
+            os.makedirs(directory, exist_ok=True)
+
+    def check(self):
+        if not os.access(self.root, os.W_OK):
+            raise StorageError(f"{self.root} is not writable")
+
+    @contextmanager
+    def _writing(self, key: str):
+        """A temporary file that replaces the object at ``key`` once written"""
+        target = self.path(key)
+        fd, temporary = tempfile.mkstemp(dir=os.path.join(self.root, TEMP_DIR))
+        try:
+            with os.fdopen(fd, "wb") as file:
+                yield file
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(temporary, target)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    def put_stream(self, key, stream, content_type=None, max_size=None):
+        reader = HashingReader(stream, max_size)
+        with self._writing(key) as file:
+            while True:
+                chunk = reader.read(COPY_CHUNK)
+                if not chunk:
+                    break
+                file.write(chunk)
+        return StoredObject(size=reader.size, sha256=reader.sha256)
+
+    def put_bytes(self, key, data, content_type=None):
+        with self._writing(key) as file:
+            file.write(data)
+
+    def open(self, key, offset=0, length=None):
+        with _not_found(key):
+            return open_mapped(self.path(key), offset, length)
+
+    def read(self, key):
+        with _not_found(key), open(self.path(key), "rb") as file:
+            return file.read()
+
+    def stat(self, key):
+        with _not_found(key):
+            stat = os.stat(self.path(key))
+        return ObjectInfo(
+            size=stat.st_size,
+            etag=f"{stat.st_mtime_ns:x}-{stat.st_size:x}",
+            content_type=None,
+            last_modified=datetime.utcfromtimestamp(stat.st_mtime),
+        )
+
+    def copy(self, source, target):
+        with _not_found(source), self._writing(target) as file, open(self.path(source), "rb") as original:
+            _send_file(original, file)
+
+    def remove(self, key):
+        path = self.path(key)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return
+        self._prune(os.path.dirname(path))
+
+    def _prune(self, directory: str):
+        """Drop directories emptied by a removal, up to the root"""
+        while directory != self.root and directory.startswith(self.root):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
+
+    def remove_many(self, keys):
+        errors = []
+        for key in keys:
+            try:
+                self.remove(key)
+            except (OSError, ValueError) as e:
+                errors.append(RemoveError(key, str(e)))
+        return errors
+
+    def _upload_dir(self, upload_id: str) -> str:
+        if not upload_id.isalnum():
+            raise ValueError(f"Invalid upload id {upload_id!r}")
+        return os.path.join(self.root, UPLOADS_DIR, upload_id)
+
+    def create_multipart_upload(self, key, content_type=None):
+        self.path(key)
+        upload_id = secrets.token_hex(16)
+        os.makedirs(self._upload_dir(upload_id))
+        return upload_id
+
+    def upload_part(self, key, upload_id, part_number, data):
+        directory = self._upload_dir(upload_id)
+        if not os.path.isdir(directory):
+            raise ObjectNotFoundError(f"Upload {upload_id} does not exist")
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix=".part")
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(temporary, os.path.join(directory, str(part_number)))
+        return hashlib.md5(data).hexdigest()
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        directory = self._upload_dir(upload_id)
+        if not os.path.isdir(directory):
+            raise ObjectNotFoundError(f"Upload {upload_id} does not exist")
+        digests = hashlib.md5()
+        with self._writing(key) as target:
+            for number, etag in sorted(parts.items()):
+                with _not_found(f"part {number}"), open(os.path.join(directory, str(number)), "rb") as part:
+                    _send_file(part, target)
+                digests.update(bytes.fromhex(etag))
+        shutil.rmtree(directory, ignore_errors=True)
+        # Same shape as an S3 multipart etag
+        return f"{digests.hexdigest()}-{len(parts)}"
+
+    def abort_multipart_upload(self, key, upload_id):
+        directory = self._upload_dir(upload_id)
+        if not os.path.isdir(directory):
+            raise ObjectNotFoundError(f"Upload {upload_id} does not exist")
+        shutil.rmtree(directory)
+
+    def local_path(self, key):
+        path = self.path(key)
+        if not os.path.isfile(path):
+            raise ObjectNotFoundError(f"{key} does not exist")
+        return path
+
+
+class LocalFileResponse(StreamingResponse):
+    """``count`` bytes of a local file from ``offset``.
+
+    Servers offering the ASGI zero-copy send extension get the open file and
+    ``sendfile`` it to the socket themselves; with any other server the range
+    is streamed from a memory map of the file.
+    """
+
+    def __init__(self, path: str, offset: int, count: int, **kwargs):
+        self.path = path
+        self.offset = offset
+        self.count = count
+        super().__init__(self._mapped_chunks(), **kwargs)
+
+    async def _mapped_chunks(self):
+        reader = await run_storage_io(open_mapped, self.path, self.offset, self.count)
+        async for chunk in iter_object(reader):
+            yield chunk
+
+    async def __call__(self, scope, receive, send):
+        if ZEROCOPY_SEND not in (scope.get("extensions") or {}):
+            await super().__call__(scope, receive, send)
+            return
+        with open(self.path, "rb") as file:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": ZEROCOPY_SEND, "file": file, "offset": self.offset,
+                        "count": self.count, "more_body": False})
+
+
+def minio_pool(maxsize: int) -> urllib3.PoolManager:
+    """minio-py's default HTTP pool, sized for the storage executor"""
+    timeout = timedelta(minutes=5).seconds
+    return urllib3.PoolManager(
+        timeout=urllib3.Timeout(connect=timeout, read=timeout),
+        maxsize=maxsize,
+        cert_reqs="CERT_REQUIRED",
+        ca_certs=os.environ.get("SSL_CERT_FILE") or certifi.where(),
+        retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504]),
+    )
+
+
+def create_object_store(settings) -> ObjectStore:
+    if settings.STORAGE_BACKEND == "local":
+        return LocalStore(settings.LOCAL_STORAGE_PATH)
+    if settings.STORAGE_BACKEND != "minio":
+        raise ValueError(f"Unknown STORAGE_BACKEND {settings.STORAGE_BACKEND!r}, expected 'minio' or 'local'")
+
+    from metrics import TimedMinio
+    client = Minio(
+        settings.MINIO_ENDPOINT,
+        access_key=settings.MINIO_ACCESS_KEY,
+        secret_key=settings.MINIO_SECRET_KEY,
+        secure=settings.MINIO_SECURE,
+        http_client=minio_pool(settings.MINIO_MAX_POOL_SIZE)
+    )
+    if settings.METRICS_ENABLED:
+        client = TimedMinio(client)
+    # Signing is local-only: with the region pinned, minio-py never calls out
+    # to look up the bucket location
+    presign_client = Minio(
+        settings.MINIO_PUBLIC_ENDPOINT,
+        access_key=settings.MINIO_ACCESS_KEY,
+        secret_key=settings.MINIO_SECRET_KEY,
+        secure=settings.MINIO_PUBLIC_SECURE,
+        region=settings.MINIO_REGION
+    )
+    return MinioStore(client, settings.MINIO_BUCKET_NAME, presign_client)
@@ -0,0 +1,114 @@
+"""Keyset pagination for folder listings.
+
+A listing is one stable ordering: every subfolder (phase ``folder``) followed
+by every file (phase ``file``), each sorted by the requested key with ``_id``
+as the tie-breaker. The opaque cursor records the phase and the sort key and
+``_id`` of the last item returned, so each page is an index range scan rather
+than a skip over everything before it.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING
+
+
+class ListingSort(str, Enum):
+    NAME = "name"
+    SIZE = "size"
+    DATE = "date"
+
+
+class SortOrder(str, Enum):
+    ASC = "asc"
+    DESC = "desc"
+
+
+PHASES = ("folder", "file")
+
+# Folders have no size, so a size sort orders them by name
+SORT_FIELDS = {
+    "folder": {ListingSort.NAME: "name", ListingSort.SIZE: "name", ListingSort.DATE: "created_date"},
+    "file": {ListingSort.NAME: "name", ListingSort.SIZE: "size", ListingSort.DATE: "upload_date"},
+}
+
+# Only the fields a listing row needs
+PROJECTIONS = {
+    "folder": {"name": 1, "created_date": 1, "folder_id": 1, "parent_folder_id": 1, "usage": 1},
+    "file": {
+        "name": 1, "size": 1, "content_type": 1, "upload_date": 1,
+        "file_id": 1, "folder_id": 1, "thumbnail.status": 1,
+    },
+}
+
+
+class InvalidCursorError(ValueError):
+    """Raised for cursors that are malformed or from a different sort"""
+
+
+def sort_spec(phase: str, sort: ListingSort, order: SortOrder) -> List[Tuple[str, int]]:
+    direction = ASCENDING if order == SortOrder.ASC else DESCENDING
+    return [(SORT_FIELDS[phase][sort], direction), ("_id", direction)]
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"d": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value["d"])
+    return value
+
+
+def encode_cursor(
+    phase: str,
+    sort: ListingSort,
+    order: SortOrder,
+    doc: Optional[Dict[str, Any]] = None,
+) -> str:
+    """Cursor positioned after ``doc``, or at the start of ``phase`` if None"""
+    payload: Dict[str, Any] = {"p": phase, "s": sort.value, "o": order.value}
+    if doc is not None:
+        payload["k"] = _encode_value(doc.get(SORT_FIELDS[phase][sort]))
+        payload["i"] = str(doc["_id"])
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: ListingSort, order: SortOrder) -> Dict[str, Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        if payload["p"] not in PHASES:
+            raise InvalidCursorError("Invalid cursor")
+        if payload["s"] != sort.value or payload["o"] != order.value:
+            raise InvalidCursorError("Cursor was issued for a different sort order")
+        if "i" in payload:
+            payload["k"] = _decode_value(payload["k"])
+            payload["i"] = ObjectId(payload["i"])
+        return payload
+    except InvalidCursorError:
+        raise
+    except (binascii.Error, ValueError, KeyError, TypeError, InvalidId):
+        raise InvalidCursorError("Invalid cursor")
+
+
+def keyset_filter(
+    phase: str, sort: ListingSort, order: SortOrder, cursor: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Extra filter selecting items strictly after the cursor in ``phase``"""
+    if not cursor or cursor["p"] != phase or "i" not in cursor:
+        return {}
+    field = SORT_FIELDS[phase][sort]
+    op = "$gt" if order == SortOrder.ASC else "$lt"
+    return {"$or": [
+        {field: {op: cursor["k"]}},
+        {field: cursor["k"], "_id": {op: cursor["i"]}},
+    ]}
@@ -0,0 +1,112 @@
+"""Password hashing off the event loop.
+
+bcrypt is deliberately slow (100-300 ms of CPU per hash or verify), so running
+it inline in an ``async def`` handler freezes every other request on the
+worker. ``PasswordHasher`` runs it in a dedicated process pool behind a bounded
+admission queue: once ``max_queue`` calls are already waiting for a free
+worker, further calls fail fast with ``HashQueueFullError`` instead of piling
+up behind a login storm.
+"""
+import asyncio
+import multiprocessing
+import statistics
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from passlib.context import CryptContext
+from config import settings
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def hash_password_sync(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_password_sync(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def _ready() -> bool:
+    # Run in each new worker: by then it has imported this module and passlib
+    return True
+
+
+class HashQueueFullError(RuntimeError):
+    """Raised when too many hashing calls are already waiting for a worker"""
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, max_queue: int, latency_window: int = 1024):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._latencies_ms: "deque[float]" = deque(maxlen=latency_window)
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn, not fork: the parent already runs threads (storage I/O pool)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    @property
+    def queue_depth(self) -> int:
+        """Calls admitted but still waiting for a free worker"""
+        return max(0, self.pending - self.workers)
+
+    async def _run(self, func: Callable[..., Any], *args) -> Any:
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise HashQueueFullError("Password hashing queue is full")
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool(), func, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            self._latencies_ms.append((time.perf_counter() - started) * 1000)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password_sync, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password_sync, plain_password, hashed_password)
+
+    async def start(self):
+        """Start every worker process now rather than on the first sign-ins"""
+        loop = asyncio.get_running_loop()
+        pool = self._pool()
+        await asyncio.gather(*(loop.run_in_executor(pool, _ready) for _ in range(self.workers)))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool occupancy and latency (queue wait included) of recent calls"""
+        latencies = sorted(self._latencies_ms)
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": min(self.pending, self.workers),
+            "queue_depth": self.queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "latency_ms": {
+                "p50": round(statistics.median(latencies), 2) if latencies else 0.0,
+                "p95": round(latencies[int(0.95 * (len(latencies) - 1))], 2) if latencies else 0.0,
+                "max": round(latencies[-1], 2) if latencies else 0.0,
+            },
+        }
+
+
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE)
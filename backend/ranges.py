@@ -0,0 +1,134 @@
+import re
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import List, Optional, Tuple
+
+# Inclusive (start, end) byte offsets, as in Content-Range
+ByteRange = Tuple[int, int]
+
+# More ranges than this are almost certainly abusive; serve the full object
+MAX_RANGES = 16
+
+_RANGE_SPEC = re.compile(r"^(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiableError(Exception):
+    """Raised when none of the requested ranges overlap the object"""
+
+
+def parse_range_header(header: Optional[str], size: int) -> Optional[List[ByteRange]]:
+    """Parse a ``Range`` header against an object of ``size`` bytes.
+
+    Returns None when the full object should be served (no header, a unit
+    other than bytes, or a malformed spec, all of which RFC 9110 says to
+    ignore). Overlapping ranges are coalesced.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(","):
+        match = _RANGE_SPEC.match(part.strip())
+        if not match:
+            return None
+        first, last = match.groups()
+        if not first and not last:
+            return None
+        if not first:
+            # Suffix range: the last N bytes
+            suffix = int(last)
+            if suffix == 0 or size == 0:
+                continue
+            ranges.append((max(0, size - suffix), size - 1))
+            continue
+        start = int(first)
+        end = int(last) if last else size - 1
+        if end < start:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+    if not ranges:
+        raise RangeNotSatisfiableError(f"bytes */{size}")
+    return coalesce_ranges(ranges)
+
+
+def coalesce_ranges(ranges: List[ByteRange]) -> List[ByteRange]:
+    """Merge overlapping or adjacent ranges, keeping request order otherwise"""
+    merged: List[ByteRange] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    if len(merged) == len(ranges):
+        return ranges
+    return merged
+
+
+def http_date(value: datetime) -> str:
+    """Format a naive UTC datetime (as stored in Mongo) as an HTTP-date"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value, usegmt=True)
+
+
+def if_range_matches(
+    if_range: Optional[str],
+    etag: Optional[str] = None,
+    last_modified: Optional[datetime] = None,
+) -> bool:
+    """Evaluate ``If-Range``; a Range is only honoured when this is True"""
+    if not if_range:
+        return True
+    value = if_range.strip()
+    if value.startswith("W/"):
+        # If-Range requires a strong comparison, so weak tags never match
+        return False
+    if value.startswith('"'):
+        return etag is not None and value == etag
+    if last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return False
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return since == last_modified.replace(microsecond=0)
+
+
+def content_range(start: int, end: int, size: int) -> str:
+    return f"bytes {start}-{end}/{size}"
+
+
+def multipart_part_header(
+    boundary: str, content_type: str, start: int, end: int, size: int
+) -> bytes:
+    return (
+        f"--{boundary}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Range: {content_range(start, end, size)}\r\n\r\n"
+    ).encode("latin-1")
+
+
+def multipart_trailer(boundary: str) -> bytes:
+    return f"--{boundary}--\r\n".encode("latin-1")
+
+
+def multipart_length(
+    boundary: str, content_type: str, ranges: List[ByteRange], size: int
+) -> int:
+    """Exact byte length of a multipart/byteranges body for ``ranges``"""
+    total = len(multipart_trailer(boundary))
+    for start, end in ranges:
+        header = multipart_part_header(boundary, content_type, start, end, size)
+        # Each part body is followed by a CRLF before the next delimiter
+        total += len(header) + (end - start + 1) + 2
+    return total
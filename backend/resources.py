@@ -0,0 +1,34 @@
+"""Clients and caches owned by one app.
+
+``main.create_resources`` builds them without any network I/O (the Mongo and
+MinIO clients connect on first use). The app's lifespan creates them, stores
+them on ``app.state.resources`` and stops or closes them on shutdown; routes
+and ``auth`` reach them through the ``get_resources`` dependency. Each app
+built by ``main.create_app`` therefore has its own, and tests give an app
+theirs by setting ``app.state.resources``.
+"""
+from fastapi import Request
+
+
+class Resources:
+    def __init__(self, client, db, object_store, compressor, listing_cache, thumbnail_pipeline=None):
+        self.client = client
+        self.db = db
+        self.files_collection = db.files
+        self.folders_collection = db.folders
+        self.users_collection = db.users
+        self.upload_sessions_collection = db.upload_sessions
+        self.blobs_collection = db.blobs
+        self.jobs_collection = db.jobs
+        self.folder_versions_collection = db.folder_versions
+        self.usage_collection = db.usage
+        # MinIO or the local filesystem, per STORAGE_BACKEND
+        self.object_store = object_store
+        self.compressor = compressor
+        self.listing_cache = listing_cache
+        self.thumbnail_pipeline = thumbnail_pipeline
+
+
+def get_resources(request: Request) -> Resources:
+    """The resources of the app serving this request, set up by its lifespan"""
+    return request.app.state.resources
@@ -0,0 +1,133 @@
+"""Indexed filename search.
+
+Every file and folder document carries ``name_grams``: the trigrams of its
+normalized name, one- and two-character word prefixes (marked with ``^``) and
+the name's first one to three characters (marked with ``<``). A multikey
+``(user_id, name_grams)`` index turns a search into an index lookup on
+``$all`` of the term's grams; the candidates are then verified and ranked in
+Python, so gram collisions can only cost a little work, never a wrong hit.
+
+Candidates are capped per query. Names starting with the term rank best, so
+they are looked up on their own as well (``prefix=True`` adds the start gram),
+and a cap on the broader lookup can only drop weaker matches.
+
+Documents written before these grams existed are backfilled with
+``python search.py --backfill``.
+"""
+import argparse
+import asyncio
+import re
+import sys
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+
+WORD_PREFIX = "^"
+NAME_START = "<"
+
+_WORD = re.compile(r"\w+")
+
+
+def normalize(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+def name_grams(name: str) -> List[str]:
+    """Index terms for a name: all trigrams, short word prefixes and its start"""
+    norm = normalize(name)
+    grams = {norm[i:i + 3] for i in range(len(norm) - 2)}
+    grams.update(NAME_START + norm[:n] for n in range(1, min(len(norm), 3) + 1))
+    for word in _WORD.findall(norm):
+        grams.add(WORD_PREFIX + word[:1])
+        grams.add(WORD_PREFIX + word[:2])
+    return sorted(grams)
+
+
+def search_fields(name: Optional[str]) -> Dict[str, Any]:
+    """Fields to $set alongside ``name`` whenever a name is written"""
+    return {"name_grams": name_grams(name) if name else []}
+
+
+def query_grams(term: str) -> List[str]:
+    """Grams a matching name must contain; short terms match word prefixes"""
+    norm = normalize(term)
+    if len(norm) < 3:
+        return [WORD_PREFIX + norm]
+    return sorted({norm[i:i + 3] for i in range(len(norm) - 2)})
+
+
+def match_rank(term: str, name: str) -> Optional[int]:
+    """Rank a candidate (lower is better), or None if it doesn't match"""
+    norm_term = normalize(term)
+    norm_name = normalize(name)
+    if norm_name == norm_term:
+        return 0
+    if norm_name.startswith(norm_term):
+        return 1
+    if any(word.startswith(norm_term) for word in _WORD.findall(norm_name)):
+        return 2
+    if len(norm_term) >= 3 and norm_term in norm_name:
+        return 3
+    return None
+
+
+def rank_matches(term: str, docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Drop false-positive candidates and order the rest by relevance"""
+    ranked: List[Tuple[Tuple[int, int, str], Dict[str, Any]]] = []
+    for doc in docs:
+        rank = match_rank(term, doc["name"])
+        if rank is not None:
+            ranked.append(((rank, len(doc["name"]), normalize(doc["name"])), doc))
+    ranked.sort(key=lambda item: item[0])
+    return [doc for _, doc in ranked]
+
+
+def search_query(user_id: str, term: str, prefix: bool = False) -> Dict[str, Any]:
+    """Index candidates for ``term``; with ``prefix``, only names starting like it"""
+    grams = query_grams(term)
+    if prefix:
+        grams.append(NAME_START + normalize(term)[:3])
+    return {"user_id": user_id, "name_grams": {"$all": grams}}
+
+
+async def backfill_name_grams(db, batch_size: int = 1000) -> int:
+    """Populate ``name_grams`` on files and folders that predate it or its start grams"""
+    updated = 0
+    for collection in (db.files, db.folders):
+        batch = []
+        # No gram in ["<", "=") means no start gram (or no grams at all)
+        cursor = collection.find(
+            {"name_grams": {"$not": {"$elemMatch": {"$gte": NAME_START, "$lt": "="}}}},
+            {"_id": 1, "name": 1}
+        )
+        async for doc in cursor:
+            batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": search_fields(doc["name"])}))
+            if len(batch) >= batch_size:
+                updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+                batch = []
+        if batch:
+            updated += (await collection.bulk_write(batch, ordered=False)).modified_count
+    return updated
+
+
+async def main() -> int:
+    from pymongo import AsyncMongoClient
+    from config import settings
+
+    client = AsyncMongoClient(settings.MONGODB_URL)
+    try:
+        updated = await backfill_name_grams(client[settings.MONGODB_DB_NAME])
+        print(f"Backfilled name_grams on {updated} documents")
+        return 0
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Filename search index maintenance")
+    parser.add_argument("--backfill", action="store_true",
+                        help="add name_grams to documents that lack it or its start grams")
+    if not parser.parse_args().backfill:
+        parser.print_help()
+        sys.exit(0)
+    sys.exit(asyncio.run(main()))
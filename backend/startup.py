@@ -0,0 +1,73 @@
+"""Worker startup: lazy clients, then concurrent, retried readiness steps.
+
+Importing ``main`` creates no clients. ``main.create_app`` builds the app
+around a lifespan that creates them (see ``resources``); ``AsyncMongoClient``
+and the MinIO client connect on first use, so tests need no running services.
+The lifespan then runs the startup steps (Mongo ping and indexes, bucket or
+directory check) concurrently through ``run_steps``. Each step is retried with exponential
+backoff, so a worker started while MongoDB or MinIO is briefly unavailable
+waits for it instead of exiting; once ``STARTUP_RETRIES`` are used up the
+error is raised and the worker fails as before.
+
+How long each step took is logged and exported as
+``app_startup_seconds{phase}``, next to ``import`` for the module import and
+``total`` for the whole lifespan startup. The password hashing processes are
+spawned in the background after startup, ahead of the first sign-in.
+``python -m benchmarks.bench_startup`` measures import and cold-start time.
+"""
+import asyncio
+import logging
+import random
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict
+from pymongo import AsyncMongoClient
+from metrics import STARTUP_SECONDS, MongoCommandMetrics
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRY_DELAY = 30.0  # seconds between attempts, at most
+
+
+def create_mongo_client(settings) -> AsyncMongoClient:
+    """The app's Mongo client, with a pool sized by settings; connects lazily"""
+    return AsyncMongoClient(
+        settings.MONGODB_URL,
+        maxPoolSize=settings.MONGODB_MAX_POOL_SIZE,
+        minPoolSize=settings.MONGODB_MIN_POOL_SIZE,
+        serverSelectionTimeoutMS=settings.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+        event_listeners=[MongoCommandMetrics()] if settings.METRICS_ENABLED else []
+    )
+
+
+async def retry(step: Callable[[], Awaitable[Any]], name: str, attempts: int,
+                delay: float) -> Any:
+    """Await ``step()`` up to ``attempts`` times, backing off exponentially with jitter"""
+    for attempt in range(1, attempts + 1):
+        try:
+            return await step()
+        except Exception as e:
+            if attempt >= attempts:
+                logger.error(f"Startup step {name} failed after {attempt} attempts: {e}")
+                raise
+            wait = min(delay * 2 ** (attempt - 1), MAX_RETRY_DELAY) * random.uniform(0.5, 1)
+            logger.warning(
+                f"Startup step {name} failed (attempt {attempt}/{attempts}), "
+                f"retrying in {wait:.2f}s: {e}"
+            )
+            await asyncio.sleep(wait)
+
+
+async def run_steps(steps: Dict[str, Callable[[], Awaitable[Any]]], attempts: int,
+                    delay: float) -> Dict[str, float]:
+    """Run named startup steps concurrently, each retried; returns seconds per step"""
+    timings: Dict[str, float] = {}
+
+    async def timed_step(name, step):
+        started = perf_counter()
+        await retry(step, name, attempts, delay)
+        timings[name] = perf_counter() - started
+        STARTUP_SECONDS.set(timings[name], phase=name)
+
+    # The first step to give up fails startup with its own exception
+    await asyncio.gather(*(timed_step(name, step) for name, step in steps.items()))
+    return timings
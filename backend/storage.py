@@ -0,0 +1,165 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, BinaryIO, Callable, Dict, Iterable, List, NamedTuple, Optional, TypeVar
+from minio import Minio
+from minio.datatypes import Part
+from minio.deleteobjects import DeleteError, DeleteObject
+from config import settings
+
+T = TypeVar("T")
+
+# Storage calls block (minio-py is synchronous, and so is file I/O); they all
+# run on this bounded pool so a slow PUT or GET never stalls the event loop,
+# and storage concurrency stays capped.
+storage_executor = ThreadPoolExecutor(
+    max_workers=settings.STORAGE_IO_WORKERS,
+    thread_name_prefix="storage-io",
+)
+
+
+async def run_storage_io(func: Callable[..., T], *args, **kwargs) -> T:
+    """Run a blocking storage call on the storage executor"""
+    loop = asyncio.get_running_loop()
+    # In the caller's context, so the call is timed against its request
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        storage_executor, functools.partial(context.run, func, *args, **kwargs)
+    )
+
+
+async def iter_object(reader, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """Stream an opened object (``ObjectStore.open``) without blocking the event loop"""
+    try:
+        while True:
+            chunk = await run_storage_io(reader.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        reader.close()
+
+
+class FileTooLargeError(Exception):
+    """Raised when an upload stream grows past the allowed size"""
+
+
+class StoredObject(NamedTuple):
+    size: int
+    sha256: str
+    compression: Optional[Dict[str, Any]] = None  # see ``compression``
+
+
+class HashingReader:
+    """File-like wrapper that counts and hashes bytes as they are read.
+
+    MinIO pulls one part at a time through ``read()``, so the size limit is
+    enforced mid-stream without ever holding more than a part in memory.
+    """
+
+    def __init__(self, stream: BinaryIO, max_size: Optional[int] = None):
+        self._stream = stream
+        self._max_size = max_size
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._stream.read(size)
+        self.size += len(data)
+        if self._max_size is not None and self.size > self._max_size:
+            raise FileTooLargeError(
+                f"File exceeds maximum size of {self._max_size} bytes"
+            )
+        self._hash.update(data)
+        return data
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+
+def stream_to_minio(
+    client: Minio,
+    bucket_name: str,
+    object_name: str,
+    stream: BinaryIO,
+    content_type: Optional[str] = None,
+    max_size: Optional[int] = None,
+    part_size: int = settings.UPLOAD_PART_SIZE,
+) -> StoredObject:
+    """Pipe a file-like stream into MinIO using fixed-size multipart parts"""
+    reader = HashingReader(stream, max_size)
+    client.put_object(
+        bucket_name,
+        object_name,
+        reader,
+        length=-1,
+        content_type=content_type or "application/octet-stream",
+        part_size=part_size,
+        # Parts are uploaded one at a time so peak memory is a single part
+        num_parallel_uploads=1,
+    )
+    return StoredObject(size=reader.size, sha256=reader.sha256)
+
+
+# minio-py only exposes the individual multipart calls as underscore methods;
+# these thin wrappers keep that detail out of the request handlers.
+def create_multipart_upload(
+    client: Minio,
+    bucket_name: str,
+    object_name: str,
+    content_type: Optional[str] = None,
+) -> str:
+    return client._create_multipart_upload(
+        bucket_name,
+        object_name,
+        {"Content-Type": content_type or "application/octet-stream"},
+    )
+
+
+def upload_part(
+    client: Minio,
+    bucket_name: str,
+    object_name: str,
+    upload_id: str,
+    part_number: int,
+    data: bytes,
+) -> str:
+    return client._upload_part(
+        bucket_name, object_name, data, None, upload_id, part_number
+    )
+
+
+def complete_multipart_upload(
+    client: Minio,
+    bucket_name: str,
+    object_name: str,
+    upload_id: str,
+    parts: Dict[int, str],
+):
+    """Stitch uploaded parts together; ``parts`` maps part number to etag"""
+    return client._complete_multipart_upload(
+        bucket_name,
+        object_name,
+        upload_id,
+        [Part(number, etag) for number, etag in sorted(parts.items())],
+    )
+
+
+def abort_multipart_upload(
+    client: Minio,
+    bucket_name: str,
+    object_name: str,
+    upload_id: str,
+):
+    client._abort_multipart_upload(bucket_name, object_name, upload_id)
+
+
+def remove_objects(client: Minio, bucket_name: str, object_names: Iterable[str]) -> List[DeleteError]:
+    """Batched delete (up to 1000 keys per request); returns per-object errors"""
+    # remove_objects is lazy: nothing is sent until the result is consumed
+    return list(client.remove_objects(
+        bucket_name, (DeleteObject(name) for name in object_names)
+    ))
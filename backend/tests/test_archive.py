@@ -0,0 +1,186 @@
+import asyncio
+import io
+import zipfile
+from datetime import datetime
+from unittest.mock import patch
+import archive
+from archive import (
+    ArchiveEntry, ZipMember, ZipWriter, build_entries, folder_paths, should_compress,
+    stream_archive, unique_path
+)
+
+
+class FakeObject:
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+        self.closed = False
+
+    def read(self, size):
+        return self._data.read(size)
+
+    def close(self):
+        self.closed = True
+
+
+def collect(entries, objects, **kwargs):
+    opened = []
+
+    def open_object(name):
+        if isinstance(objects[name], Exception):
+            raise objects[name]
+        obj = FakeObject(objects[name])
+        opened.append(obj)
+        return obj
+
+    async def run():
+        return b"".join([chunk async for chunk in stream_archive(entries, open_object, **kwargs)])
+
+    return asyncio.run(run()), opened
+
+
+def member(name, data=b"", **kwargs):
+    return ZipMember(name, len(data), datetime(2024, 5, 6, 7, 8, 10), **kwargs)
+
+
+class TestZipWriter:
+    def test_roundtrip_deflated_stored_and_directories(self):
+        text = b"hello world " * 5000
+        objects = {"a": text, "b": b"\xff\xd8jpegbytes"}
+        entries = [
+            ArchiveEntry(member("docs/", is_dir=True, compress=False), None),
+            ArchiveEntry(member("docs/notes.txt", text), "a"),
+            ArchiveEntry(member("фото.jpg", objects["b"], compress=False), "b"),
+        ]
+
+        data, opened = collect(entries, objects, chunk_size=1000)
+
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            assert zf.testzip() is None
+            assert zf.namelist() == ["docs/", "docs/notes.txt", "фото.jpg"]
+            assert zf.read("docs/notes.txt") == text
+            assert zf.read("фото.jpg") == objects["b"]
+            assert zf.getinfo("docs/notes.txt").compress_type == zipfile.ZIP_DEFLATED
+            assert zf.getinfo("фото.jpg").compress_type == zipfile.ZIP_STORED
+            assert zf.getinfo("docs/").is_dir()
+            assert zf.getinfo("docs/notes.txt").date_time == (2024, 5, 6, 7, 8, 10)
+        assert all(obj.closed for obj in opened)
+
+    def test_zip64_records(self):
+        objects = {str(i): f"file {i}".encode() for i in range(3)}
+        entries = [ArchiveEntry(member(f"f{i}.txt", objects[str(i)]), str(i)) for i in range(3)]
+
+        with patch.object(archive, "ZIP64_MEMBER_THRESHOLD", 0), \
+             patch.object(archive, "ZIP64_COUNT_LIMIT", 2):
+            data, _ = collect(entries, objects)
+
+        assert b"PK\x06\x06" in data and b"PK\x06\x07" in data
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            assert zf.testzip() is None
+            assert [zf.read(f"f{i}.txt") for i in range(3)] == [objects[str(i)] for i in range(3)]
+
+    def test_central_directory_moves_large_offsets_to_zip64_extra(self):
+        writer = ZipWriter()
+        writer.begin(member("big.bin", compress=False))
+        writer._header_offset = archive.ZIP64_LIMIT + 10
+        writer.end()
+        record = writer._central[0]
+        assert record[42:46] == b"\xff\xff\xff\xff"
+        assert record.endswith((archive.ZIP64_LIMIT + 10).to_bytes(8, "little"))
+
+    def test_missing_object_is_left_out(self):
+        objects = {"a": b"kept", "b": OSError("gone")}
+        entries = [
+            ArchiveEntry(member("a.txt", b"kept"), "a"),
+            ArchiveEntry(member("b.txt", b"xxxx"), "b"),
+        ]
+
+        data, _ = collect(entries, objects)
+
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            assert zf.namelist() == ["a.txt"]
+
+    def test_read_ahead_is_bounded(self):
+        objects = {str(i): b"x" for i in range(10)}
+        entries = [ArchiveEntry(member(f"{i}.txt", b"x"), str(i)) for i in range(10)]
+
+        def open_object(name):
+            return FakeObject(objects[name])
+
+        async def run():
+            stream = stream_archive(entries, open_object, read_ahead=3)
+            await stream.__anext__()
+            await stream.aclose()
+
+        with patch("archive.run_storage_io", wraps=archive.run_storage_io) as io_calls:
+            asyncio.run(run())
+        # the member being written plus three opened ahead of it
+        opens = [call for call in io_calls.call_args_list if call.args[0] is open_object]
+        assert len(opens) == 4
+
+
+class TestEntries:
+    def test_should_compress(self):
+        assert should_compress("notes.txt", "text/plain")
+        assert should_compress("drawing.svg", "image/svg+xml")
+        assert not should_compress("photo.jpg", "image/jpeg")
+        assert not should_compress("movie.bin", "video/mp4")
+        assert not should_compress("bundle.zip", "application/octet-stream")
+        assert not should_compress("report.docx", None)
+
+    def test_unique_path(self):
+        used = set()
+        assert [unique_path("a/b.txt", used) for _ in range(3)] == ["a/b.txt", "a/b (1).txt", "a/b (2).txt"]
+
+    def test_folder_paths_relative_to_selected_root(self):
+        docs = [
+            {"folder_id": "b", "name": "B", "ancestors": [{"folder_id": "a", "name": "A"}]},
+            {"folder_id": "c", "name": "C/D", "ancestors": [
+                {"folder_id": "a", "name": "A"}, {"folder_id": "b", "name": "B"}
+            ]},
+        ]
+        assert folder_paths(docs, {"b"}) == {"b": "B", "c": "B/C_D"}
+
+    def test_build_entries(self):
+        folders = [{"folder_id": "b", "name": "B", "ancestors": []}]
+        files = [
+            {"file_id": "1", "name": "x.txt", "size": 1, "folder_id": "b"},
+            {"file_id": "2", "name": "x.txt", "size": 1, "folder_id": None},
+            {"file_id": "3", "name": "y.png", "size": 1, "folder_id": "b",
+             "content_type": "image/png", "object_name": "blobs/abc"},
+        ]
+
+        entries = build_entries(folders, files, {"b"}, lambda doc: doc.get("object_name") or doc["file_id"])
+
+        assert [(e.member.name, e.object_name, e.member.compress) for e in entries] == [
+            ("B/", None, False),
+            ("B/x.txt", "1", True),
+            ("B/y.png", "blobs/abc", False),
+            ("x.txt", "2", True),
+        ]
+
+    def test_same_named_sibling_folders_keep_their_files(self):
+        folders = [
+            {"folder_id": "r", "name": "R", "ancestors": []},
+            {"folder_id": "a1", "name": "A", "ancestors": [{"folder_id": "r", "name": "R"}]},
+            {"folder_id": "a2", "name": "A", "ancestors": [{"folder_id": "r", "name": "R"}]},
+            {"folder_id": "s", "name": "S", "ancestors": [
+                {"folder_id": "r", "name": "R"}, {"folder_id": "a2", "name": "A"}
+            ]},
+        ]
+        files = [
+            {"file_id": "1", "name": "x.txt", "size": 1, "folder_id": "a1"},
+            {"file_id": "2", "name": "x.txt", "size": 1, "folder_id": "a2"},
+            {"file_id": "3", "name": "y.txt", "size": 1, "folder_id": "s"},
+        ]
+
+        entries = build_entries(folders, files, {"r"}, lambda doc: doc["file_id"])
+
+        assert [(e.member.name, e.member.is_dir) for e in entries] == [
+            ("R/", True),
+            ("R/A/", True),
+            ("R/A (1)/", True),
+            ("R/A (1)/S/", True),
+            ("R/A (1)/S/y.txt", False),
+            ("R/A (1)/x.txt", False),
+            ("R/A/x.txt", False),
+        ]
@@ -0,0 +1,233 @@
+import asyncio
+from unittest.mock import AsyncMock
+from bson import ObjectId
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+from batch import (
+    apply_plan, lookup_ids, plan_batch, released_files, touched_folders, usage_changes
+)
+from models import BatchOperation
+
+
+def op(action, item_type, item_id, **kwargs):
+    return BatchOperation(action=action, item_type=item_type, item_id=item_id, **kwargs)
+
+
+def file_doc(file_id, folder_id=None):
+    return {"_id": ObjectId(), "file_id": file_id, "folder_id": folder_id}
+
+
+def folder_doc(folder_id, ancestors=()):
+    return {"_id": ObjectId(), "folder_id": folder_id, "name": folder_id.upper(),
+            "ancestors": [{"folder_id": a, "name": a.upper()} for a in ancestors]}
+
+
+class TestLookupIds:
+    def test_includes_move_targets(self):
+        ops = [op("move", "file", "f1", target_folder_id="t"), op("rename", "folder", "a", name="x")]
+        assert lookup_ids(ops) == (["f1"], ["a", "t"])
+
+
+class TestPlanBatch:
+    def test_builds_writes_per_collection(self):
+        files = {"f1": file_doc("f1"), "f2": file_doc("f2"), "f3": file_doc("f3")}
+        folders = {"a": folder_doc("a"), "t": folder_doc("t")}
+        ops = [
+            op("move", "file", "f1", target_folder_id="t"),
+            op("rename", "file", "f2", name="new.txt"),
+            op("delete", "file", "f3"),
+            op("move", "folder", "a", target_folder_id="t"),
+            op("rename", "folder", "t", name="Target"),
+        ]
+
+        plan = plan_batch("u", ops, files, folders)
+
+        assert plan.results == [None] * 5
+        assert [type(w) for _, w in plan.file_writes] == [UpdateOne, UpdateOne]
+        assert [i for i, _ in plan.folder_writes] == [3, 3, 4, 4]
+        assert [type(w) for _, w in plan.folder_writes] == [UpdateOne, UpdateMany, UpdateOne, UpdateMany]
+        assert plan.deleted_files == {2: files["f3"]}
+
+    def test_reports_invalid_operations(self):
+        files = {"f1": file_doc("f1")}
+        folders = {"a": folder_doc("a"), "c": folder_doc("c", ancestors=["a"])}
+        ops = [
+            op("delete", "file", "missing"),
+            op("rename", "file", "f1"),
+            op("rename", "file", "f1", name="again"),
+            op("move", "folder", "a", target_folder_id="c"),
+            op("move", "folder", "c", target_folder_id="nowhere"),
+        ]
+
+        plan = plan_batch("u", ops, files, folders)
+
+        assert [r["error"] for r in plan.results] == [
+            "File not found",
+            "Rename requires a name",
+            "Item appears more than once in the batch",
+            "Cannot move a folder into itself",
+            "Target folder not found",
+        ]
+        assert not plan.file_writes and not plan.folder_writes
+
+    def test_rejects_nested_moves(self):
+        folders = {
+            "a": folder_doc("a"), "c": folder_doc("c", ancestors=["a"]),
+            "b": folder_doc("b"), "t": folder_doc("t"),
+        }
+        ops = [
+            op("move", "folder", "a", target_folder_id="t"),
+            op("move", "folder", "c", target_folder_id="t"),
+            op("move", "folder", "b", target_folder_id="a"),
+        ]
+
+        plan = plan_batch("u", ops, {}, folders)
+
+        assert plan.results[0] is None
+        assert plan.results[1]["error"] == "A folder containing this item is also being moved or deleted"
+        assert plan.results[2]["error"] == "Target folder is also being moved or deleted"
+
+    def test_rejects_file_operations_inside_changing_folders(self):
+        files = {
+            "f1": {**file_doc("f1", folder_id="a"), "size": 100},
+            "f2": file_doc("f2", folder_id="c"),
+            "f3": file_doc("f3", folder_id="x"),
+            "f4": file_doc("f4"),
+        }
+        folders = {
+            "a": folder_doc("a"), "b": folder_doc("b"), "t": folder_doc("t", ancestors=["a"]),
+            "c": folder_doc("c", ancestors=["a", "t"]), "x": folder_doc("x"), "gone": folder_doc("gone"),
+        }
+        ops = [
+            op("move", "folder", "t", target_folder_id="b"),
+            op("delete", "folder", "gone"),
+            op("move", "file", "f1", target_folder_id="t"),
+            op("delete", "file", "f2"),
+            op("move", "file", "f3", target_folder_id="gone"),
+            op("move", "file", "f4", target_folder_id="x"),
+        ]
+
+        plan = plan_batch("u", ops, files, folders)
+        asyncio.run(apply_plan(plan, AsyncMock(), AsyncMock()))
+
+        assert [r and r.get("error") for r in plan.results] == [
+            None,
+            None,
+            "Target folder is also being moved or deleted",
+            "A folder containing this item is also being moved or deleted",
+            "Target folder is also being moved or deleted",
+            None,
+        ]
+        # The file stays in a, so only t's own move changes the rollups
+        changes = usage_changes(plan, files, folders)
+        assert "files" not in changes.folders["a"] and "files" not in changes.folders["t"]
+        assert dict(changes.folders["a"]) == {"folders": -1, "total_folders": -1}
+        assert dict(changes.folders["b"]) == {"folders": 1, "total_folders": 1}
+
+    def test_folder_delete_is_deferred(self):
+        plan = plan_batch("u", [op("delete", "folder", "a")], {}, {"a": folder_doc("a")})
+        assert plan.deleted_folders == {0: "a"}
+        assert not plan.folder_writes
+
+
+class TestApplyPlan:
+    def test_maps_write_errors_to_operations(self):
+        files_coll = AsyncMock()
+        files_coll.bulk_write.side_effect = BulkWriteError({
+            "writeErrors": [{"index": 1, "errmsg": "boom"}]
+        })
+        folders_coll = AsyncMock()
+        files = {"f1": file_doc("f1"), "f2": file_doc("f2"), "f3": file_doc("f3")}
+        ops = [
+            op("delete", "file", "f1"),
+            op("rename", "file", "f2", name="a.txt"),
+            op("rename", "file", "f3", name="b.txt"),
+        ]
+        plan = plan_batch("u", ops, files, {})
+
+        asyncio.run(apply_plan(plan, files_coll, folders_coll))
+
+        assert [r["status"] for r in plan.results] == ["ok", "ok", "error"]
+        assert plan.results[2]["error"] == "boom"
+        assert released_files(plan) == [files["f1"]]
+        folders_coll.bulk_write.assert_not_called()
+
+    def test_file_deleted_elsewhere_is_not_released_again(self):
+        files = {
+            "f1": {**file_doc("f1", folder_id="a"), "size": 3},
+            "f2": {**file_doc("f2", folder_id="a"), "size": 5},
+        }
+        folders = {"a": folder_doc("a")}
+        files_coll = AsyncMock()
+        # Another request removed f2 after the batch loaded it
+        files_coll.find_one_and_delete.side_effect = lambda query, projection: (
+            None if query["_id"] == files["f2"]["_id"] else {"_id": query["_id"]}
+        )
+        plan = plan_batch("u", [op("delete", "file", "f1"), op("delete", "file", "f2")], files, folders)
+
+        asyncio.run(apply_plan(plan, files_coll, AsyncMock()))
+
+        assert [r["status"] for r in plan.results] == ["ok", "error"]
+        assert plan.results[1]["error"] == "File not found"
+        assert released_files(plan) == [files["f1"]]
+        assert dict(usage_changes(plan, files, folders).user) == {"files": -1, "bytes": -3}
+        files_coll.bulk_write.assert_not_called()
+
+    def test_ordered_folder_writes_stop_at_first_error(self):
+        folders_coll = AsyncMock()
+        folders_coll.bulk_write.side_effect = BulkWriteError({
+            "writeErrors": [{"index": 1, "errmsg": "boom"}]
+        })
+        folders = {"a": folder_doc("a"), "b": folder_doc("b")}
+        ops = [op("rename", "folder", "a", name="A2"), op("rename", "folder", "b", name="B2")]
+        plan = plan_batch("u", ops, {}, folders)
+
+        asyncio.run(apply_plan(plan, AsyncMock(), folders_coll))
+
+        assert plan.results[0]["error"] == "boom"
+        assert plan.results[1]["error"] == "Not applied after an earlier error in the batch"
+
+    def test_touched_folders_cover_sources_and_targets(self):
+        files = {"f1": file_doc("f1", folder_id="src"), "f2": file_doc("f2", folder_id="other")}
+        folders = {"a": {**folder_doc("a"), "parent_folder_id": None}, "t": folder_doc("t")}
+        ops = [
+            op("move", "file", "f1", target_folder_id="t"),
+            op("delete", "file", "f2"),
+            op("rename", "folder", "a", name="A2"),
+        ]
+        files_coll = AsyncMock()
+        files_coll.find_one_and_delete.return_value = None
+        plan = plan_batch("u", ops, files, folders)
+
+        asyncio.run(apply_plan(plan, files_coll, AsyncMock()))
+
+        # f2's delete found nothing, so its folder is untouched
+        assert touched_folders(plan, files, folders) == {"src", "t", None}
+
+    def test_usage_changes_follow_moves_and_deletes(self):
+        files = {"f1": {**file_doc("f1", folder_id="src"), "size": 10}, "f2": {**file_doc("f2"), "size": 5}}
+        folders = {
+            "src": folder_doc("src", ancestors=["top"]),
+            "t": folder_doc("t"),
+            "a": {**folder_doc("a", ancestors=["top"]), "usage": {"total_files": 2, "total_bytes": 7}},
+        }
+        ops = [
+            op("move", "file", "f1", target_folder_id="t"),
+            op("delete", "file", "f2"),
+            op("move", "folder", "a", target_folder_id="t"),
+            op("rename", "folder", "src", name="S"),
+        ]
+        plan = plan_batch("u", ops, files, folders)
+        asyncio.run(apply_plan(plan, AsyncMock(), AsyncMock()))
+
+        changes = usage_changes(plan, files, folders)
+
+        assert dict(changes.folders["src"]) == {"files": -1, "bytes": -10, "total_files": -1, "total_bytes": -10}
+        assert dict(changes.folders["top"]) == {
+            "total_files": -3, "total_bytes": -17, "total_folders": -1, "folders": -1
+        }
+        assert dict(changes.folders["t"]) == {
+            "files": 1, "bytes": 10, "total_files": 3, "total_bytes": 17, "folders": 1, "total_folders": 1
+        }
+        # Moves stay within the user; only the delete changes their totals
+        assert dict(changes.user) == {"files": -1, "bytes": -5}
@@ -0,0 +1,289 @@
+import asyncio
+import io
+import threading
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+from pymongo.errors import DuplicateKeyError
+from blobs import (
+    adopt_staged_object, release_object, release_objects, dedup_stats, object_key
+)
+from object_store import LocalStore, MinioStore
+from storage import StoredObject
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class BlobDocs:
+    """Just enough of a collection, with single-document atomicity, for the blob protocol"""
+
+    def __init__(self, *docs):
+        self.docs = {doc["_id"]: dict(doc) for doc in docs}
+
+    @staticmethod
+    def _matches(doc, query):
+        for field, condition in query.items():
+            value = doc.get(field)
+            if not isinstance(condition, dict):
+                if value != condition:
+                    return False
+            elif "$exists" in condition and (field in doc) != condition["$exists"]:
+                return False
+            elif "$gt" in condition and not (value is not None and value > condition["$gt"]):
+                return False
+            elif "$lte" in condition and not (value is not None and value <= condition["$lte"]):
+                return False
+            elif "$in" in condition and value not in condition["$in"]:
+                return False
+        return True
+
+    def _find(self, query):
+        return [doc for doc in self.docs.values() if self._matches(doc, query)]
+
+    @staticmethod
+    def _apply(doc, update):
+        for field, amount in update.get("$inc", {}).items():
+            doc[field] = doc.get(field, 0) + amount
+        doc.update(update.get("$set", {}))
+
+    async def find_one(self, query, projection=None):
+        found = self._find(query)
+        return dict(found[0]) if found else None
+
+    async def find_one_and_update(self, query, update, return_document=False):
+        found = self._find(query)
+        if not found:
+            return None
+        before = dict(found[0])
+        self._apply(found[0], update)
+        return dict(found[0]) if return_document else before
+
+    async def update_one(self, query, update, upsert=False):
+        found = self._find(query)
+        if found:
+            self._apply(found[0], update)
+            return SimpleNamespace(upserted_id=None)
+        if query["_id"] in self.docs:
+            raise DuplicateKeyError("E11000 duplicate key error")
+        doc = {"_id": query["_id"], **update.get("$setOnInsert", {})}
+        self._apply(doc, update)
+        self.docs[doc["_id"]] = doc
+        return SimpleNamespace(upserted_id=doc["_id"])
+
+    async def delete_one(self, query):
+        for doc in self._find(query)[:1]:
+            del self.docs[doc["_id"]]
+
+    async def delete_many(self, query):
+        for doc in self._find(query):
+            del self.docs[doc["_id"]]
+
+
+class TestObjectKey:
+    def test_falls_back_to_file_id(self):
+        assert object_key({"file_id": "f1"}) == "f1"
+        assert object_key({"file_id": "f1", "object_name": "blobs/abc"}) == "blobs/abc"
+
+
+class TestAdoptStagedObject:
+    def test_new_blob_is_copied_into_place(self):
+        blobs = AsyncMock()
+        blobs.find_one_and_update.return_value = None
+        client = MagicMock()
+
+        key, deduplicated, compression = run(adopt_staged_object(
+            blobs, MinioStore(client, "files"), "staging/f1", StoredObject(size=5, sha256="abc")
+        ))
+
+        assert (key, deduplicated, compression) == ("blobs/abc", False, None)
+        assert client.compose_object.call_args.args[:2] == ("files", "blobs/abc")
+        upsert = blobs.update_one.call_args
+        assert upsert.args[1]["$inc"] == {"refcount": 1}
+        assert upsert.args[1]["$setOnInsert"]["size"] == 5
+        assert upsert.kwargs["upsert"] is True
+        client.remove_object.assert_called_once_with("files", "staging/f1")
+
+    def test_existing_blob_drops_staged_copy(self):
+        blobs = AsyncMock()
+        blobs.find_one_and_update.return_value = {"_id": "abc", "refcount": 3}
+        client = MagicMock()
+
+        key, deduplicated, compression = run(adopt_staged_object(
+            blobs, MinioStore(client, "files"), "staging/f1", StoredObject(size=5, sha256="abc")
+        ))
+
+        assert (key, deduplicated, compression) == ("blobs/abc", True, None)
+        client.compose_object.assert_not_called()
+        blobs.update_one.assert_not_called()
+        client.remove_object.assert_called_once_with("files", "staging/f1")
+
+    def test_compression_follows_the_blob(self):
+        zstd = {"codec": "zstd", "stored_size": 2}
+        blobs = AsyncMock()
+        blobs.find_one_and_update.return_value = None
+        stored = StoredObject(size=5, sha256="abc", compression=zstd)
+
+        _, _, compression = run(adopt_staged_object(blobs, MinioStore(MagicMock(), "files"), "staging/f1", stored))
+
+        assert compression == zstd
+        assert blobs.update_one.call_args.args[1]["$setOnInsert"]["compression"] == zstd
+
+        # A later upload of the same bytes stored raw still reads the blob as compressed
+        blobs.find_one_and_update.return_value = {"_id": "abc", "refcount": 1, "compression": zstd}
+        _, _, compression = run(adopt_staged_object(
+            blobs, MinioStore(MagicMock(), "files"), "staging/f2", StoredObject(size=5, sha256="abc")
+        ))
+        assert compression == zstd
+
+
+class TestReleaseObject:
+    def test_plain_object_is_removed(self):
+        blobs = AsyncMock()
+        client = MagicMock()
+        assert run(release_object(blobs, MinioStore(client, "files"), {"file_id": "f1"})) is True
+        client.remove_object.assert_called_once_with("files", "f1")
+        blobs.find_one_and_update.assert_not_called()
+
+    def test_shared_blob_is_kept(self):
+        blobs = AsyncMock()
+        blobs.find_one_and_update.return_value = {"_id": "abc", "refcount": 1}
+        client = MagicMock()
+        doc = {"file_id": "f1", "object_name": "blobs/abc"}
+        assert run(release_object(blobs, MinioStore(client, "files"), doc)) is False
+        client.remove_object.assert_not_called()
+
+    def test_last_reference_collects_blob(self):
+        blobs = AsyncMock()
+        blobs.find_one_and_update.return_value = {"_id": "abc", "refcount": 0}
+        client = MagicMock()
+        doc = {"file_id": "f1", "object_name": "blobs/abc"}
+        client.remove_objects.return_value = iter([])
+        assert run(release_object(blobs, MinioStore(client, "files"), doc)) is True
+        names = [obj.name for obj in client.remove_objects.call_args.args[1]]
+        assert names == ["blobs/abc", "derivatives/blobs/abc/thumbnail.jpg"]
+        # Marked while the object is removed, deleted after
+        assert "collecting" in blobs.find_one_and_update.call_args.args[1]["$set"]
+        assert blobs.delete_one.call_args.args[0]["_id"] == "abc"
+
+    def test_thumbnail_is_removed_with_plain_object(self):
+        blobs = AsyncMock()
+        client = MagicMock()
+        client.remove_objects.return_value = iter([])
+        doc = {"file_id": "f1", "thumbnail": {"status": "ready"}}
+        assert run(release_object(blobs, MinioStore(client, "files"), doc)) is True
+        names = [obj.name for obj in client.remove_objects.call_args.args[1]]
+        assert names == ["f1", "derivatives/f1/thumbnail.jpg"]
+        client.remove_object.assert_not_called()
+
+    def test_rereferenced_blob_is_not_collected(self):
+        blobs = AsyncMock()
+        # Decremented to zero, but re-referenced before it could be marked for collection
+        blobs.find_one_and_update.side_effect = [{"_id": "abc", "refcount": 0}, None]
+        client = MagicMock()
+        doc = {"file_id": "f1", "object_name": "blobs/abc"}
+        assert run(release_object(blobs, MinioStore(client, "files"), doc)) is False
+        client.remove_object.assert_not_called()
+
+
+class TestDedupStats:
+    def test_ratio_and_bytes_saved(self):
+        blobs = AsyncMock()
+        cursor = MagicMock()
+        cursor.__aiter__.return_value = [{
+            "_id": None, "blobs": 2, "references": 5,
+            "physical_bytes": 300, "logical_bytes": 900,
+        }]
+        blobs.aggregate.return_value = cursor
+
+        stats = run(dedup_stats(blobs))
+
+        assert stats["bytes_saved"] == 600
+        assert stats["dedup_ratio"] == 3.0
+
+    def test_empty(self):
+        blobs = AsyncMock()
+        cursor = MagicMock()
+        cursor.__aiter__.return_value = []
+        blobs.aggregate.return_value = cursor
+
+        stats = run(dedup_stats(blobs))
+
+        assert stats["bytes_saved"] == 0
+        assert stats["dedup_ratio"] == 1.0
+
+
+class TestReleaseObjects:
+    def test_batches_refcounts_and_deletes(self):
+        blobs = AsyncMock()
+        blobs.find = MagicMock()
+        blobs.find.return_value.__aiter__.return_value = [{"_id": "abc"}]
+        blobs.find_one_and_update.return_value = {"_id": "abc"}
+        client = MagicMock()
+        client.remove_objects.return_value = iter([])
+        docs = [
+            {"file_id": "f1"},
+            {"file_id": "f2", "object_name": "blobs/abc"},
+            {"file_id": "f3", "object_name": "blobs/abc"},
+            {"file_id": "f4", "object_name": "blobs/def"},
+        ]
+
+        removed = run(release_objects(blobs, MinioStore(client, "files"), docs))
+
+        ops = blobs.bulk_write.call_args.args[0]
+        assert sorted((op._filter["_id"], op._doc["$inc"]["refcount"]) for op in ops) == [
+            ("abc", -2), ("def", -1)
+        ]
+        names = [obj.name for obj in client.remove_objects.call_args.args[1]]
+        assert names == ["f1", "blobs/abc", "derivatives/blobs/abc/thumbnail.jpg"]
+        assert removed == 2
+        assert blobs.delete_many.call_args.args[0]["_id"] == {"$in": ["abc"]}
+
+
+class TestCollectionRace:
+    def test_adopt_during_collection_keeps_the_bytes(self, tmp_path):
+        copied = threading.Event()
+
+        class Store(LocalStore):
+            def copy(self, source, target):
+                super().copy(source, target)
+                copied.set()
+
+            def remove_many(self, keys):
+                # The adopter copies while the collector is mid-removal
+                assert copied.wait(5)
+                return super().remove_many(keys)
+
+        store = Store(str(tmp_path))
+        store.ensure_ready()
+        store.put_stream("blobs/abc", io.BytesIO(b"bytes"))
+        store.put_stream("staging/f2", io.BytesIO(b"bytes"))
+        blobs = BlobDocs({"_id": "abc", "refcount": 1, "size": 5})
+
+        async def interleave():
+            await asyncio.gather(
+                release_object(blobs, store, {"file_id": "f1", "object_name": "blobs/abc"}),
+                adopt_staged_object(blobs, store, "staging/f2", StoredObject(size=5, sha256="abc")),
+            )
+
+        run(interleave())
+
+        assert store.read("blobs/abc") == b"bytes"
+        assert blobs.docs["abc"]["refcount"] == 1
+        assert "collecting" not in blobs.docs["abc"]
+        assert not (tmp_path / "staging" / "f2").exists()
+
+    def test_adopt_after_whole_collection_copies_again(self, tmp_path):
+        store = LocalStore(str(tmp_path))
+        store.ensure_ready()
+        store.put_stream("staging/f2", io.BytesIO(b"bytes"))
+        blobs = BlobDocs()
+        store.copy = MagicMock()  # the copy lands, then a collection removes it
+
+        key, deduplicated, _ = run(adopt_staged_object(
+            blobs, store, "staging/f2", StoredObject(size=5, sha256="abc")
+        ))
+
+        assert (key, deduplicated) == ("blobs/abc", False)
+        assert [c.args for c in store.copy.call_args_list] == [("staging/f2", "blobs/abc")] * 2
+        assert blobs.docs["abc"]["refcount"] == 1
@@ -0,0 +1,70 @@
+from cache import TTLCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache:
+    def test_get_counts_hits_and_misses(self):
+        cache = TTLCache(maxsize=4, ttl=10)
+        assert cache.get("a") is None
+        cache.set("a", 1)
+        assert cache.get("a") == 1
+        assert cache.stats() == {"size": 1, "maxsize": 4, "hits": 1, "misses": 1, "hit_ratio": 0.5}
+
+    def test_entries_expire(self):
+        timer = FakeTimer()
+        cache = TTLCache(maxsize=4, ttl=10, timer=timer)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=1)
+        timer.now = 5
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        timer.now = 10
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+
+    def test_pop_and_clear(self):
+        cache = TTLCache(maxsize=4, ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.pop("a")
+        cache.pop("missing")
+        assert cache.get("a") is None
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_zero_size_disables_caching(self):
+        cache = TTLCache(maxsize=0, ttl=10)
+        cache.set("a", 1)
+        assert cache.get("a") is None
+
+    def test_weight_is_tracked_and_bounded(self):
+        cache = TTLCache(maxsize=10, ttl=10, weigher=len, max_weight=10)
+        cache.set("a", b"xxxx")
+        cache.set("b", b"yyyy")
+        cache.set("a", b"zz")
+        assert cache.weight == 6
+        cache.set("c", b"wwwwww")
+        # "b" is least recently used and goes to make room
+        assert cache.get("b") is None
+        assert cache.weight == 8
+        cache.set("huge", b"x" * 11)
+        assert cache.get("huge") is None
+        cache.pop("a")
+        assert cache.stats()["weight"] == 6
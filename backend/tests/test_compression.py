@@ -0,0 +1,87 @@
+import io
+import hashlib
+import os
+from unittest.mock import MagicMock
+import pytest
+from compression import Compressor, accepts_encoding, compressible_type, open_stored
+from object_store import LocalStore
+from storage import FileTooLargeError, StoredObject
+
+TEXT = b"".join(b"%d,customer-%d,2024-01-01,ok\n" % (i, i % 97) for i in range(20000))
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LocalStore(str(tmp_path))
+    store.ensure_ready()
+    return store
+
+
+def compressor(**kwargs):
+    pytest.importorskip("zstandard")
+    return Compressor(True, **kwargs)
+
+
+class TestContentNegotiation:
+    def test_compressible_types(self):
+        assert compressible_type("text/csv")
+        assert compressible_type("text/x-python; charset=utf-8")
+        assert compressible_type("application/vnd.api+json")
+        assert compressible_type("application/msword")
+        assert not compressible_type("image/png")
+        assert not compressible_type("application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+        assert not compressible_type(None)
+
+    def test_accept_encoding(self):
+        assert accepts_encoding("gzip, deflate, br, zstd", "zstd")
+        assert accepts_encoding("*", "zstd")
+        assert not accepts_encoding("gzip, zstd;q=0", "zstd")
+        assert not accepts_encoding("*, zstd;q=0", "zstd")
+        assert not accepts_encoding("gzip", "zstd")
+        assert not accepts_encoding(None, "zstd")
+
+
+class TestCompressor:
+    def test_disabled_stores_as_sent(self):
+        store = MagicMock()
+        store.put_stream.return_value = StoredObject(size=3, sha256="abc")
+
+        stored = Compressor(False).put_stream(store, "f1", io.BytesIO(TEXT), content_type="text/csv")
+
+        assert stored.compression is None
+        assert store.put_stream.call_args.kwargs["max_size"] is None
+
+    def test_text_is_compressed_and_reads_back(self, store):
+        stored = compressor().put_stream(store, "f1", io.BytesIO(TEXT), content_type="text/csv")
+
+        assert (stored.size, stored.sha256) == (len(TEXT), hashlib.sha256(TEXT).hexdigest())
+        assert stored.compression["codec"] == "zstd"
+        assert stored.compression["stored_size"] == store.stat("f1").size < len(TEXT) // 4
+        reader = open_stored(store, "f1", stored.compression)
+        assert reader.read() == TEXT
+        reader.close()
+
+    def test_ranges_of_original_bytes(self, store):
+        stored = compressor().put_stream(store, "f1", io.BytesIO(TEXT), content_type="text/csv")
+
+        reader = open_stored(store, "f1", stored.compression, offset=300000, length=10)
+        assert reader.read(4) + reader.read(100) == TEXT[300000:300010]
+        assert reader.read(100) == b""
+        reader.close()
+        assert open_stored(store, "f1", stored.compression, offset=len(TEXT) + 5).read() == b""
+
+    def test_incompressible_sample_is_stored_raw(self, store):
+        noise = os.urandom(200000)
+
+        stored = compressor(sample_size=4096).put_stream(
+            store, "f1", io.BytesIO(noise), content_type="text/plain"
+        )
+
+        assert stored.compression is None
+        assert (stored.size, stored.sha256) == (len(noise), hashlib.sha256(noise).hexdigest())
+        assert store.read("f1") == noise
+
+    def test_size_limit_applies_to_original_bytes(self, store):
+        with pytest.raises(FileTooLargeError):
+            compressor().put_stream(store, "f1", io.BytesIO(TEXT), content_type="text/csv",
+                                    max_size=len(TEXT) - 1)
@@ -0,0 +1,60 @@
+from datetime import datetime
+from conditional import file_etag, listing_etag, none_match, modified_since, is_not_modified
+
+
+class TestValidators:
+    def test_file_etag_prefers_checksum(self):
+        assert file_etag({"sha256": "abc", "etag": "def"}) == '"abc"'
+        assert file_etag({"etag": "def"}) == '"def"'
+        assert file_etag({}) is None
+
+    def test_listing_etag_is_weak_and_query_specific(self):
+        etag = listing_etag(3, "u", "f", "name")
+        assert etag.startswith('W/"3-')
+        assert etag == listing_etag(3, "u", "f", "name")
+        assert etag != listing_etag(4, "u", "f", "name")
+        assert etag != listing_etag(3, "u", "f", "size")
+
+
+class TestNoneMatch:
+    def test_matching_tag(self):
+        assert not none_match('"abc"', '"abc"')
+        assert not none_match('"x", "abc"', '"abc"')
+
+    def test_weak_comparison(self):
+        assert not none_match('W/"abc"', '"abc"')
+        assert not none_match('"abc"', 'W/"abc"')
+
+    def test_other_tags(self):
+        assert none_match('"x", "y"', '"abc"')
+
+    def test_wildcard(self):
+        assert not none_match("*", '"abc"')
+
+
+class TestModifiedSince:
+    modified = datetime(2024, 1, 1, 12, 0, 0, 500000)
+
+    def test_same_second_is_not_modified(self):
+        assert not modified_since("Mon, 01 Jan 2024 12:00:00 GMT", self.modified)
+
+    def test_newer_is_modified(self):
+        assert modified_since("Mon, 01 Jan 2024 11:59:59 GMT", self.modified)
+
+    def test_invalid_date_is_ignored(self):
+        assert modified_since("yesterday", self.modified)
+
+
+class TestIsNotModified:
+    modified = datetime(2024, 1, 1, 12, 0, 0)
+
+    def test_if_none_match_wins_over_if_modified_since(self):
+        headers = {"if-none-match": '"other"', "if-modified-since": "Mon, 01 Jan 2024 12:00:00 GMT"}
+        assert not is_not_modified(headers, '"abc"', self.modified)
+
+    def test_if_modified_since_alone(self):
+        headers = {"if-modified-since": "Mon, 01 Jan 2024 12:00:00 GMT"}
+        assert is_not_modified(headers, '"abc"', self.modified)
+
+    def test_unconditional(self):
+        assert not is_not_modified({}, '"abc"', self.modified)
@@ -0,0 +1,69 @@
+import pytest
+import asyncio
+from unittest.mock import AsyncMock
+
+from folder_tree import (
+    FolderCycleError, breadcrumb, child_ancestors, compute_ancestors, rebase_subtree
+)
+
+
+def folder(folder_id, name, parent=None, ancestors=None):
+    doc = {"folder_id": folder_id, "name": name, "parent_folder_id": parent}
+    if ancestors is not None:
+        doc["ancestors"] = ancestors
+    return doc
+
+
+class TestAncestors:
+    def test_child_ancestors_extend_parent_path(self):
+        parent = folder("b", "B", "a", ancestors=[{"folder_id": "a", "name": "A"}])
+        assert child_ancestors(parent) == [
+            {"folder_id": "a", "name": "A"}, {"folder_id": "b", "name": "B"}
+        ]
+        assert child_ancestors(None) == []
+
+    def test_breadcrumb_from_single_document(self):
+        doc = folder("c", "C", "b", ancestors=[{"folder_id": "a", "name": "A"}, {"folder_id": "b", "name": "B"}])
+        assert [crumb["name"] for crumb in breadcrumb(doc)] == ["Home", "A", "B", "C"]
+
+    def test_compute_ancestors_for_backfill(self):
+        folders = {
+            "a": folder("a", "A"),
+            "b": folder("b", "B", "a"),
+            "c": folder("c", "C", "b"),
+            "orphan": folder("orphan", "O", "missing"),
+        }
+        resolved = compute_ancestors(folders)
+        assert [a["folder_id"] for a in resolved["c"]] == ["a", "b"]
+        assert resolved["a"] == []
+        assert resolved["orphan"] == []
+
+    def test_compute_ancestors_survives_cycles(self):
+        folders = {"a": folder("a", "A", "b"), "b": folder("b", "B", "a")}
+        resolved = compute_ancestors(folders)
+        assert len(resolved) == 2
+
+
+class TestRebaseSubtree:
+    def test_rewrites_folder_and_descendant_prefix(self):
+        collection = AsyncMock()
+        moving = folder("c", "C", "b", ancestors=[{"folder_id": "a", "name": "A"}, {"folder_id": "b", "name": "B"}])
+        target = folder("x", "X", None, ancestors=[])
+
+        asyncio.run(rebase_subtree(collection, "user_id", moving, target))
+
+        own_update = collection.update_one.call_args.args[1]["$set"]
+        assert own_update == {"parent_folder_id": "x", "ancestors": [{"folder_id": "x", "name": "X"}]}
+        pipeline = collection.update_many.call_args.args[1]
+        concat = pipeline[0]["$set"]["ancestors"]["$concatArrays"]
+        assert concat[0] == [{"folder_id": "x", "name": "X"}]
+        assert concat[1]["$slice"][1] == 2
+
+    def test_refuses_to_move_into_own_subtree(self):
+        collection = AsyncMock()
+        moving = folder("a", "A", None, ancestors=[])
+        inside = folder("c", "C", "b", ancestors=[{"folder_id": "a", "name": "A"}])
+
+        with pytest.raises(FolderCycleError):
+            asyncio.run(rebase_subtree(collection, "user_id", moving, inside))
+        collection.update_one.assert_not_called()
@@ -0,0 +1,72 @@
+import pytest
+import asyncio
+import os
+from unittest.mock import AsyncMock, MagicMock
+
+from indexes import INDEXES, HOT_QUERIES, ensure_indexes, check_query_plans, plan_stages
+
+
+def explain_result(winning_plan):
+    return {"queryPlanner": {"winningPlan": winning_plan}}
+
+
+def mock_db(plans):
+    """Fake database whose find().explain() returns plans[collection]"""
+    collections = {}
+    for name in INDEXES:
+        collection = MagicMock()
+        collection.create_indexes = AsyncMock(return_value=[])
+        explain = AsyncMock(
+            return_value=explain_result(plans.get(name, {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}))
+        )
+        collection.find.return_value.explain = explain
+        collection.find.return_value.sort.return_value.explain = explain
+        collections[name] = collection
+    db = MagicMock()
+    db.__getitem__.side_effect = collections.__getitem__
+    return db, collections
+
+
+class TestIndexes:
+    def test_ensure_indexes_creates_every_collection(self):
+        db, collections = mock_db({})
+        asyncio.run(ensure_indexes(db))
+        for name, models in INDEXES.items():
+            collections[name].create_indexes.assert_awaited_once_with(models)
+
+    def test_email_index_is_unique(self):
+        email_index = INDEXES["users"][0].document
+        assert email_index["key"] == {"email": 1}
+        assert email_index["unique"] is True
+
+    def test_plan_stages_walks_nested_plans(self):
+        plan = {"stage": "SORT", "inputStage": {"stage": "OR", "inputStages": [
+            {"stage": "IXSCAN"}, {"stage": "COLLSCAN"}
+        ]}}
+        assert plan_stages(plan) == ["SORT", "OR", "IXSCAN", "COLLSCAN"]
+
+    def test_check_query_plans_flags_collscan(self):
+        db, _ = mock_db({"users": {"stage": "COLLSCAN"}})
+        collscans = asyncio.run(check_query_plans(db))
+        assert collscans == [query for query in HOT_QUERIES if query[0] == "users"]
+
+    def test_check_query_plans_passes_when_indexed(self):
+        db, _ = mock_db({})
+        assert asyncio.run(check_query_plans(db)) == []
+
+
+@pytest.mark.skipif(not os.getenv("MONGODB_TEST_URL"), reason="MONGODB_TEST_URL not set")
+def test_hot_queries_use_indexes_on_live_mongodb():
+    from pymongo import AsyncMongoClient
+
+    async def run():
+        client = AsyncMongoClient(os.environ["MONGODB_TEST_URL"])
+        try:
+            db = client["filemanager_index_check"]
+            await ensure_indexes(db)
+            return await check_query_plans(db)
+        finally:
+            await client.drop_database("filemanager_index_check")
+            await client.close()
+
+    assert asyncio.run(run()) == []
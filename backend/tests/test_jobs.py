@@ -0,0 +1,162 @@
+import asyncio
+from collections import Counter, defaultdict
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from bson import ObjectId
+from jobs import (
+    JobType, new_job, serialize_job, run_job, delete_subtree, move_subtree
+)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def async_cursor(docs):
+    cursor = MagicMock()
+    cursor.__aiter__.return_value = docs
+    return cursor
+
+
+class TestRunJob:
+    def test_records_completion(self):
+        jobs = AsyncMock()
+        job = new_job("u", JobType.DELETE_FOLDER, folder_ids=["f"])
+
+        async def work(report):
+            await report(done=1)
+
+        run(run_job(jobs, job, work))
+
+        updates = [call.args[1]["$set"] for call in jobs.update_one.call_args_list]
+        assert updates[0]["status"] == "running"
+        assert updates[1]["progress.done"] == 1
+        assert updates[-1]["status"] == "completed"
+
+    def test_records_failure(self):
+        jobs = AsyncMock()
+        job = new_job("u", JobType.DELETE_FOLDER, folder_ids=["f"])
+
+        async def work(report):
+            raise RuntimeError("boom")
+
+        run(run_job(jobs, job, work))
+
+        final = jobs.update_one.call_args.args[1]["$set"]
+        assert final["status"] == "failed"
+        assert final["error"] == "boom"
+
+    def test_serialize_hides_owner(self):
+        job = serialize_job(new_job("u", JobType.MOVE_FOLDER, folder_id="f", target_folder_id=None))
+        assert "user_id" not in job and "_id" not in job
+        assert job["type"] == "move_folder"
+        assert isinstance(job["created_at"], str)
+
+
+class TestDeleteSubtree:
+    def test_deletes_files_in_batches_then_folders(self):
+        folders = AsyncMock()
+        folders.find = MagicMock(side_effect=[
+            async_cursor([{"folder_id": "a"}, {"folder_id": "b", "ancestors": [{"folder_id": "a"}]}]),
+            async_cursor([]),
+        ])
+        folders.delete_many.return_value = MagicMock(deleted_count=2)
+        files = AsyncMock()
+        files.count_documents.return_value = 3
+        batches = [
+            [{"_id": ObjectId(), "file_id": "f1", "folder_id": "a", "size": 1},
+             {"_id": ObjectId(), "file_id": "f2", "folder_id": "b", "size": 2}],
+            [{"_id": ObjectId(), "file_id": "f3", "folder_id": "b", "size": 4}],
+            [],
+            [],
+        ]
+        files.find = MagicMock()
+        files.find.return_value.limit.return_value.to_list = AsyncMock(side_effect=batches)
+        report = AsyncMock()
+
+        touched = set()
+        with patch('jobs.release_objects', new_callable=AsyncMock) as release:
+            removed = run(delete_subtree(folders, files, AsyncMock(), MagicMock(),
+                                         "u", ["a"], report, batch_size=2, touched=touched))
+
+        assert folders.find.call_args.args[0] == {"user_id": "u", "$or": [
+            {"folder_id": {"$in": ["a"]}}, {"ancestors.folder_id": {"$in": ["a"]}}
+        ]}
+        assert files.find.call_args.args[0] == {"user_id": "u", "folder_id": {"$in": ["a", "b"]}}
+        assert files.delete_many.await_count == 2
+        assert [len(call.args[2]) for call in release.call_args_list] == [2, 1]
+        assert folders.delete_many.call_args.args[0] == {"user_id": "u", "folder_id": {"$in": ["a", "b"]}}
+        progress = {k: v for call in report.call_args_list for k, v in call.kwargs.items()}
+        assert progress["deleted_files"] == 3
+        assert progress["deleted_folders"] == 2
+        assert removed == {"a": {"files": 3, "bytes": 7, "folders": 2}}
+        assert touched == set()
+
+    def test_keeps_counts_when_failing_partway(self):
+        folders = AsyncMock()
+        folders.find = MagicMock(return_value=async_cursor(
+            [{"folder_id": "a"}, {"folder_id": "b", "ancestors": [{"folder_id": "a"}]}]
+        ))
+        files = AsyncMock()
+        files.count_documents.return_value = 3
+        files.find = MagicMock()
+        files.find.return_value.limit.return_value.to_list = AsyncMock(side_effect=[
+            [{"_id": ObjectId(), "file_id": "f1", "folder_id": "a", "size": 1}],
+            [{"_id": ObjectId(), "file_id": "f2", "folder_id": "b", "size": 2}],
+        ])
+        removed, touched = defaultdict(Counter), set()
+
+        with patch('jobs.release_objects', new_callable=AsyncMock,
+                   side_effect=[None, RuntimeError("storage down")]):
+            with pytest.raises(RuntimeError):
+                run(delete_subtree(folders, files, AsyncMock(), MagicMock(), "u", ["a"], AsyncMock(),
+                                   batch_size=1, removed=removed, touched=touched))
+
+        # Both batches' metadata went before the second release failed
+        assert removed == {"a": {"files": 2, "bytes": 3}}
+        assert touched == {"a", "b"}
+        folders.delete_many.assert_not_called()
+
+    def test_counts_folders_and_files_added_while_running(self):
+        folders = AsyncMock()
+        folders.find = MagicMock(side_effect=[
+            async_cursor([{"folder_id": "a"}]),
+            # Created under "a" after the first listing
+            async_cursor([{"folder_id": "late", "ancestors": [{"folder_id": "a"}]}]),
+            async_cursor([]),
+        ])
+        folders.delete_many.return_value = MagicMock(deleted_count=1)
+        files = AsyncMock()
+        files.count_documents.return_value = 0
+        files.find = MagicMock()
+        files.find.return_value.limit.return_value.to_list = AsyncMock(side_effect=[
+            [],
+            [{"_id": ObjectId(), "file_id": "f1", "folder_id": "late", "size": 10}], [],
+            # Uploaded into "a" after its files were swept and before it went
+            [{"_id": ObjectId(), "file_id": "f2", "folder_id": "a", "size": 5}], [],
+        ])
+
+        with patch('jobs.release_objects', new_callable=AsyncMock):
+            removed = run(delete_subtree(folders, files, AsyncMock(), MagicMock(),
+                                         "u", ["a"], AsyncMock(), batch_size=10))
+
+        assert [call.args[0]["folder_id"]["$in"] for call in folders.delete_many.call_args_list] == [
+            ["a"], ["late"]
+        ]
+        assert files.find.call_args.args[0]["folder_id"] == {"$in": ["a", "late"]}
+        assert removed == {"a": {"files": 2, "bytes": 15, "folders": 2}}
+
+
+class TestMoveSubtree:
+    def test_rebases_folder_and_descendants(self):
+        folders = AsyncMock()
+        folders.count_documents.return_value = 4
+        report = AsyncMock()
+        folder = {"folder_id": "a", "name": "A", "ancestors": []}
+        target = {"folder_id": "t", "name": "T", "ancestors": []}
+
+        run(move_subtree(folders, "u", folder, target, report))
+
+        assert folders.update_one.call_args.args[1]["$set"]["parent_folder_id"] == "t"
+        folders.update_many.assert_awaited_once()
+        assert report.call_args.kwargs == {"moved_folders": 4}
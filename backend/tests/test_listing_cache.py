@@ -0,0 +1,85 @@
+import asyncio
+from listing_cache import LocalListingCache, RedisListingCache, create_listing_cache, listing_key
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.expiry = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+        self.expiry[key] = ex
+
+    async def info(self, section):
+        return {"used_memory": sum(len(v) for v in self.data.values()), "maxmemory": 0}
+
+
+def test_listing_key_separates_folders_and_queries():
+    assert listing_key("u", None, "name") == listing_key("u", "", "name")
+    assert listing_key("u", "f", "name") != listing_key("u", "f", "size")
+    assert listing_key("u", "f", "name") != listing_key("v", "f", "name")
+
+
+class TestLocalListingCache:
+    def test_entries_are_valid_for_their_version(self):
+        cache = LocalListingCache(maxsize=10, max_bytes=1024, ttl=60)
+
+        async def go():
+            assert await cache.get("k", 1) is None
+            await cache.set("k", 1, b"[1]")
+            assert await cache.get("k", 1) == b"[1]"
+            # The folder changed since
+            assert await cache.get("k", 2) is None
+            return await cache.stats()
+
+        stats = run(go())
+
+        assert stats["hits"] == 1
+        assert stats["misses"] == 2
+        assert stats["entries"] == 1
+        assert stats["bytes"] == 3
+
+    def test_bounded_by_bytes(self):
+        cache = LocalListingCache(maxsize=10, max_bytes=8, ttl=60)
+
+        async def go():
+            await cache.set("a", 1, b"aaaa")
+            await cache.set("b", 1, b"bbbb")
+            await cache.set("c", 1, b"cccc")
+            return await cache.get("a", 1), await cache.stats()
+
+        evicted, stats = run(go())
+
+        assert evicted is None
+        assert stats["bytes"] == 8
+
+
+class TestRedisListingCache:
+    def test_shared_entries_carry_their_version(self):
+        redis = FakeRedis()
+        cache = RedisListingCache("redis://unused", ttl=60, client=redis)
+
+        async def go():
+            await cache.set("k", 3, b'{"items":[]}')
+            return await cache.get("k", 3), await cache.get("k", 4), await cache.stats()
+
+        hit, stale, stats = run(go())
+
+        assert redis.data == {"listing:k": b'3:{"items":[]}'}
+        assert redis.expiry == {"listing:k": 60}
+        assert hit == b'{"items":[]}'
+        assert stale is None
+        assert stats["backend"] == "redis"
+        assert stats["hit_ratio"] == 0.5
+
+
+def test_local_backend_by_default():
+    assert isinstance(create_listing_cache("", 10, 1024, 60), LocalListingCache)
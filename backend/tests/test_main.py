@@ -1,30 +1,56 @@
 import pytest
 import asyncio
 from fastapi.testclient import TestClient
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 import io
-from datetime import datetime
+import hashlib
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from bson import ObjectId
+from auth import clear_auth_caches
+from compression import Compressor
+from listing_cache import LocalListingCache
+from object_store import LocalStore, MinioStore
+from resources import Resources
+from thumbnails import ThumbnailPipeline
+from usage import empty_usage
 
-# Mock the MongoDB and MinIO dependencies
+def async_collection():
+    """AsyncMock collection whose find() returns an async-iterable cursor"""
+    collection = AsyncMock()
+    collection.find = MagicMock()
+    collection.find.return_value.__aiter__.return_value = []
+    return collection
+
+COLLECTIONS = ("files", "folders", "users", "upload_sessions", "blobs", "jobs", "folder_versions", "usage")
+
+# An app served with mocked MongoDB and MinIO resources (its lifespan is not run)
 @pytest.fixture
-def mock_db():
-    with patch('main.files_collection') as mock_files, \
-         patch('main.folders_collection') as mock_folders, \
-         patch('main.users_collection') as mock_users:
-        yield {
-            'files': mock_files,
-            'folders': mock_folders,
-            'users': mock_users
-        }
+def app():
+    from main import create_app
+    clear_auth_caches()
+    db = SimpleNamespace(**{name: async_collection() for name in COLLECTIONS})
+    db.folder_versions.find_one.return_value = None
+    store = MinioStore(MagicMock(), "files", MagicMock())
+    app = create_app()
+    app.state.resources = Resources(
+        AsyncMock(), db, store, Compressor(enabled=False), LocalListingCache(100, 1 << 20, 60),
+        ThumbnailPipeline(db.files, store, enabled=False)
+    )
+    return app
+
+@pytest.fixture
+def mock_db(app):
+    db = app.state.resources.db
+    return {name: getattr(db, name) for name in COLLECTIONS}
 
 @pytest.fixture
-def mock_minio():
-    with patch('main.minio_client') as mock_client:
-        yield mock_client
+def mock_minio(app):
+    return app.state.resources.object_store.client
 
 @pytest.fixture
-def client():
-    from main import app
+def client(app):
     return TestClient(app)
 
 class TestFileManager:
@@ -33,6 +59,48 @@ class TestFileManager:
         assert response.status_code == 200
         assert "File Manager API is running" in response.json()["message"]
 
+    def test_lifespan_starts_and_stops_dependencies(self):
+        from main import create_app
+        hasher = MagicMock(start=AsyncMock())
+        mock_client, mock_minio = AsyncMock(), MagicMock()
+        with patch('main.create_mongo_client', return_value=mock_client), \
+             patch('main.create_object_store', return_value=MinioStore(mock_minio, "files")), \
+             patch('main.ensure_indexes', new_callable=AsyncMock) as mock_indexes, \
+             patch('main.password_hasher', hasher), \
+             patch('main.ThumbnailPipeline', return_value=MagicMock(stop=AsyncMock())) as pipelines, \
+             patch('main.settings.STARTUP_RETRY_DELAY', 0):
+            # The first ping fails, as when MongoDB is still coming up
+            mock_client.admin.command.side_effect = [ConnectionError("not yet"), {"ok": 1}]
+            app = create_app()
+            with TestClient(app) as started:
+                assert started.get("/").status_code == 200
+                assert app.state.resources.client is mock_client
+                assert mock_client.admin.command.await_count == 2
+                mock_indexes.assert_awaited_once()
+                mock_minio.bucket_exists.assert_called_once_with("files")
+                hasher.start.assert_awaited_once()
+                pipelines.return_value.start.assert_called_once()
+            pipelines.return_value.stop.assert_awaited_once()
+            hasher.shutdown.assert_called_once()
+            mock_client.close.assert_awaited_once()
+
+    def test_routes_use_the_apps_own_resources(self, app, client, mock_db):
+        from auth import create_access_token
+
+        mock_db['users'].find_one.return_value = {
+            "_id": "user_id",
+            "email": "test@example.com",
+            "full_name": "Test User",
+            "created_at": datetime.utcnow(),
+            "is_active": True
+        }
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': 'test@example.com'})}"}
+        # Nothing is wired through overrides, so clearing them changes nothing
+        app.dependency_overrides.clear()
+
+        assert client.get("/api/auth/me", headers=headers).status_code == 200
+        mock_db['users'].find_one.assert_awaited_once()
+
     def test_health_endpoint(self, client, mock_db, mock_minio):
         # Mock successful connections
         mock_db['files'].find_one.return_value = True
@@ -42,6 +110,7 @@ class TestFileManager:
         assert response.status_code == 200
         data = response.json()
         assert data["status"] == "healthy"
+        assert data["listing_cache"]["backend"] == "local"
 
     def test_user_registration(self, client, mock_db):
         # Mock user doesn't exist
@@ -97,6 +166,7 @@ class TestAuthentication:
             "email": "test@example.com",
             "hashed_password": hashed_password,
             "full_name": "Test User",
+            "created_at": datetime.utcnow(),
             "is_active": True
         }
         
@@ -124,6 +194,88 @@ class TestAuthentication:
         assert response.status_code == 401
         assert "Incorrect email or password" in response.json()["detail"]
 
+    def test_login_rejected_when_hash_queue_full(self, client, mock_db):
+        from passwords import HashQueueFullError
+
+        mock_db['users'].find_one.return_value = {
+            "_id": "user_id",
+            "email": "test@example.com",
+            "hashed_password": "hash",
+            "full_name": "Test User",
+            "created_at": datetime.utcnow(),
+            "is_active": True
+        }
+        with patch('main.password_hasher.verify', new_callable=AsyncMock,
+                   side_effect=HashQueueFullError("full")):
+            response = client.post("/api/auth/login",
+                                   json={"email": "test@example.com", "password": "password123"})
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+
+    def test_current_user_is_cached(self, client, mock_db):
+        from auth import create_access_token, invalidate_user
+
+        mock_db['users'].find_one.return_value = {
+            "_id": "user_id",
+            "email": "test@example.com",
+            "full_name": "Test User",
+            "created_at": datetime.utcnow(),
+            "is_active": True
+        }
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': 'test@example.com'})}"}
+
+        assert client.get("/api/files", headers=headers).status_code == 200
+        assert client.get("/api/files", headers=headers).status_code == 200
+        assert mock_db['users'].find_one.await_count == 1
+
+        invalidate_user("test@example.com")
+        assert client.get("/api/files", headers=headers).status_code == 200
+        assert mock_db['users'].find_one.await_count == 2
+
+    def test_missing_user_is_not_cached(self, client, mock_db):
+        from auth import create_access_token
+
+        mock_db['users'].find_one.return_value = None
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': 'gone@example.com'})}"}
+
+        assert client.get("/api/files", headers=headers).status_code == 401
+        assert client.get("/api/files", headers=headers).status_code == 401
+        assert mock_db['users'].find_one.await_count == 2
+
+    def test_expired_token_is_rejected_and_not_cached(self, client, mock_db):
+        from auth import create_access_token, token_cache
+
+        mock_db['users'].find_one.return_value = {
+            "_id": "user_id",
+            "email": "test@example.com",
+            "full_name": "Test User",
+            "created_at": datetime.utcnow(),
+            "is_active": True
+        }
+        token = create_access_token({'sub': 'test@example.com'}, expires_delta=timedelta(seconds=-6))
+
+        response = client.get("/api/files", headers={"Authorization": f"Bearer {token}"})
+
+        assert response.status_code == 401
+        assert token_cache.get(token) is None
+
+    def test_token_cache_stops_at_expiry_in_any_time_zone(self, monkeypatch):
+        import auth
+
+        # Far east of UTC, where a naive utcnow().timestamp() is hours early
+        monkeypatch.setenv("TZ", "Asia/Tokyo")
+        time.tzset()
+        try:
+            token = auth.create_access_token({'sub': 'test@example.com'}, expires_delta=timedelta(seconds=6))
+            with patch.object(auth.token_cache, 'set', wraps=auth.token_cache.set) as cache_set:
+                auth._verify_token(token)
+        finally:
+            monkeypatch.undo()
+            time.tzset()
+
+        ttl = cache_set.call_args.args[2]
+        assert 0 < ttl <= 6
+
 class TestFileOperations:
     def get_auth_token(self, client, mock_db):
         """Helper to get authentication token"""
@@ -135,6 +287,7 @@ class TestFileOperations:
             "email": "test@example.com",
             "hashed_password": hashed_password,
             "full_name": "Test User",
+            "created_at": datetime.utcnow(),
             "is_active": True
         }
         
@@ -160,18 +313,532 @@ class TestFileOperations:
         assert response.status_code == 200
         assert response.json()["message"] == "File uploaded successfully"
 
+    def test_file_upload_streams_with_checksum(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        # Drain the stream the way MinIO would
+        mock_minio.put_object.side_effect = lambda bucket, name, data, **kwargs: data.read(-1)
+        mock_db['files'].insert_one.return_value = MagicMock()
+        
+        files = {"file": ("test.txt", io.BytesIO(b"test content"), "text/plain")}
+        response = client.post("/api/files/upload", files=files, headers=headers)
+        
+        assert response.status_code == 200
+        assert mock_minio.put_object.call_args.kwargs["length"] == -1
+        saved = mock_db['files'].insert_one.call_args.args[0]
+        assert saved["size"] == len(b"test content")
+        assert saved["sha256"] == hashlib.sha256(b"test content").hexdigest()
+
+    def test_download_folder_archive(self, client, mock_db, mock_minio):
+        import zipfile
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mock_db['folders'].find.return_value.__aiter__.return_value = [
+            {"folder_id": "a", "name": "Project", "ancestors": []},
+            {"folder_id": "b", "name": "Sub", "ancestors": [{"folder_id": "a", "name": "Project"}]}
+        ]
+        mock_db['files'].find.return_value.__aiter__.return_value = [
+            {"file_id": "f1", "name": "readme.txt", "size": 5, "content_type": "text/plain",
+             "upload_date": datetime(2024, 1, 1), "folder_id": "b"}
+        ]
+        body = MagicMock()
+        body.read.side_effect = [b"hello", b""]
+        mock_minio.get_object.return_value = body
+        
+        response = client.get("/api/folders/a/download", headers=headers)
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/zip"
+        assert "Project.zip" in response.headers["content-disposition"]
+        with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+            assert zf.namelist() == ["Project/", "Project/Sub/", "Project/Sub/readme.txt"]
+            assert zf.read("Project/Sub/readme.txt") == b"hello"
+        mock_minio.get_object.assert_called_once_with("files", "f1")
+
+    def test_download_archive_missing_file(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = client.get("/api/archive?file_id=nope", headers=headers)
+        
+        assert response.status_code == 404
+
+    def test_file_upload_content_addressed_duplicate(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        digest = hashlib.sha256(b"test content").hexdigest()
+        
+        mock_minio.put_object.side_effect = lambda bucket, name, data, **kwargs: data.read(-1)
+        mock_db['blobs'].find_one_and_update.return_value = {"_id": digest, "refcount": 2}
+        
+        with patch('main.settings.CONTENT_ADDRESSED_STORAGE', True):
+            files = {"file": ("test.txt", io.BytesIO(b"test content"), "text/plain")}
+            response = client.post("/api/files/upload", files=files, headers=headers)
+        
+        assert response.status_code == 200
+        assert response.json()["deduplicated"] is True
+        staged = mock_minio.put_object.call_args.args[1]
+        assert staged.startswith("staging/")
+        mock_minio.compose_object.assert_not_called()
+        mock_minio.remove_object.assert_called_once_with("files", staged)
+        saved = mock_db['files'].insert_one.call_args.args[0]
+        assert saved["object_name"] == f"blobs/{digest}"
+
+    def test_image_upload_queues_thumbnail(self, app, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+
+        mock_minio.put_object.side_effect = lambda bucket, name, data, **kwargs: data.read(-1)
+
+        with patch.object(app.state.resources.thumbnail_pipeline, 'enabled', True):
+            files = {"file": ("cat.png", io.BytesIO(b"not really a png"), "image/png")}
+            response = client.post("/api/files/upload", files=files, headers=headers)
+            files = {"file": ("notes.txt", io.BytesIO(b"text"), "text/plain")}
+            client.post("/api/files/upload", files=files, headers=headers)
+
+        assert response.status_code == 200
+        image, text = [call.args[0] for call in mock_db['files'].insert_one.call_args_list]
+        assert image["thumbnail"] == {"status": "pending", "attempts": 0}
+        assert "thumbnail" not in text
+
+    def test_thumbnail_served_with_long_cache(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+
+        mock_db['files'].find_one.return_value = {
+            "file_id": "file_id", "object_name": "blobs/abc", "thumbnail": {"status": "ready"}
+        }
+        body = MagicMock()
+        body.read.return_value = b"jpeg bytes"
+        mock_minio.get_object.return_value = body
+
+        response = client.get("/api/files/file_id/thumbnail", headers=headers)
+
+        assert response.status_code == 200
+        assert response.content == b"jpeg bytes"
+        assert response.headers["content-type"] == "image/jpeg"
+        assert "immutable" in response.headers["cache-control"]
+        mock_minio.get_object.assert_called_once_with("files", "derivatives/blobs/abc/thumbnail.jpg")
+
+    def test_thumbnail_pending(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+
+        mock_db['files'].find_one.return_value = {
+            "file_id": "file_id", "thumbnail": {"status": "pending"}
+        }
+
+        response = client.get("/api/files/file_id/thumbnail", headers=headers)
+
+        assert response.status_code == 404
+        assert response.json()["detail"]["status"] == "pending"
+        mock_minio.get_object.assert_not_called()
+
+    def test_delete_file_releases_blob(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mock_db['files'].find_one_and_delete.return_value = {
+            "file_id": "file_id", "object_name": "blobs/abc"
+        }
+        mock_db['blobs'].find_one_and_update.return_value = {"_id": "abc", "refcount": 1}
+        
+        response = client.delete("/api/files/file_id", headers=headers)
+        
+        assert response.status_code == 200
+        assert mock_db['blobs'].find_one_and_update.call_args.args[1] == {"$inc": {"refcount": -1}}
+        mock_minio.remove_object.assert_not_called()
+
+    def test_delete_missing_file(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['files'].find_one_and_delete.return_value = None
+        
+        response = client.delete("/api/files/file_id", headers=headers)
+        
+        assert response.status_code == 404
+
+    def test_file_upload_too_large(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mock_minio.put_object.side_effect = lambda bucket, name, data, **kwargs: data.read(-1)
+        
+        with patch('main.settings.MAX_FILE_SIZE', 4):
+            files = {"file": ("test.txt", io.BytesIO(b"test content"), "text/plain")}
+            response = client.post("/api/files/upload", files=files, headers=headers)
+        
+        assert response.status_code == 413
+        mock_db['files'].insert_one.assert_not_called()
+
+    def test_list_files_cursor_pagination(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mock_db['folders'].find.return_value.__aiter__.return_value = [
+            {"_id": ObjectId(), "name": name, "created_date": datetime(2024, 1, 1),
+             "folder_id": name, "parent_folder_id": None}
+            for name in ("a", "b")
+        ]
+        mock_db['files'].find.return_value.__aiter__.return_value = [
+            {"_id": ObjectId(), "name": name, "size": 1, "content_type": "text/plain",
+             "upload_date": datetime(2024, 1, 1), "file_id": name, "folder_id": None}
+            for name in ("c.txt", "d.txt")
+        ]
+        
+        response = client.get("/api/files?limit=2", headers=headers)
+        data = response.json()
+        assert response.status_code == 200
+        assert [item["name"] for item in data["items"]] == ["a", "b"]
+        assert data["has_more"] is True
+        
+        folder_call = mock_db['folders'].find.call_args
+        assert folder_call.kwargs == {"sort": [("name", 1), ("_id", 1)], "limit": 3}
+        assert "name_grams" not in folder_call.args[1]
+        
+        mock_db['folders'].find.reset_mock()
+        response = client.get(f"/api/files?limit=2&cursor={data['next_cursor']}", headers=headers)
+        data = response.json()
+        assert [item["name"] for item in data["items"]] == ["c.txt", "d.txt"]
+        assert data["has_more"] is False
+        mock_db['folders'].find.assert_not_called()
+
+    def test_list_files_rejects_invalid_cursor(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = client.get("/api/files?cursor=garbage", headers=headers)
+        assert response.status_code == 400
+
+    def search_file(self, name, number=1):
+        return {
+            "_id": f"65f00000000000000000000{number}", "name": name, "size": 1,
+            "content_type": "text/plain", "upload_date": datetime(2024, 1, 1),
+            "file_id": f"file_id{number}", "folder_id": None
+        }
+
+    def test_search_is_indexed_ranked_and_paginated(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        names = ["old report.txt", "report.txt", "reportage.txt", "rpt.txt"]
+        mock_db['files'].find.return_value.__aiter__.return_value = [
+            self.search_file(name, number) for number, name in enumerate(names)
+        ]
+        
+        response = client.get("/api/files?search=report&limit=2", headers=headers)
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert [item["name"] for item in data["items"]] == ["report.txt", "reportage.txt"]
+        assert data["has_more"] is True and data["truncated"] is False
+        prefix_lookup, lookup = [call.args[0] for call in mock_db['files'].find.call_args_list]
+        assert prefix_lookup["name_grams"] == {"$all": ["epo", "ort", "por", "rep", "<rep"]}
+        assert lookup["name_grams"] == {"$all": ["epo", "ort", "por", "rep"]}
+        
+        response = client.get("/api/files?search=report&limit=2&offset=2", headers=headers)
+        assert [item["name"] for item in response.json()["items"]] == ["old report.txt"]
+        
+        # Without a limit, like a folder listing, every match comes back
+        response = client.get("/api/files?search=report", headers=headers)
+        assert len(response.json()["items"]) == 3
+        assert response.json()["has_more"] is False
+
+    def test_search_keeps_best_match_beyond_candidate_limit(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+
+        def cursor(docs):
+            found = MagicMock()
+            found.__aiter__.return_value = docs
+            return found
+        weaker = [self.search_file(f"a report {number}", number) for number in range(1, 4)]
+        mock_db['files'].find.side_effect = [
+            cursor([self.search_file("report.txt", 9)]),  # names starting with the term
+            cursor(weaker)  # the broad lookup, sorted by name, past its cap
+        ]
+
+        with patch('main.settings.SEARCH_CANDIDATE_LIMIT', 2):
+            response = client.get("/api/files?search=report", headers=headers)
+
+        data = response.json()
+        assert [item["name"] for item in data["items"]] == ["report.txt", "a report 1", "a report 2"]
+        assert data["truncated"] is True
+        assert mock_db['files'].find.call_args.kwargs["sort"] == [("name", 1), ("_id", 1)]
+
+    def test_rename_maintains_search_grams(self, client, mock_db):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['files'].find_one_and_update.return_value = {"folder_id": "folder_id"}
+        
+        response = client.put("/api/files/file_id", json={"name": "Budget.xlsx"}, headers=headers)
+        
+        assert response.status_code == 200
+        update = mock_db['files'].find_one_and_update.call_args.args[1]["$set"]
+        assert "bud" in update["name_grams"]
+        bumped = [op._filter["_id"] for op in mock_db['folder_versions'].bulk_write.call_args.args[0]]
+        assert bumped == ["user_id/*", "user_id/folder_id"]
+
+    def test_rename_missing_file(self, client, mock_db):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['files'].find_one_and_update.return_value = None
+        
+        response = client.put("/api/files/file_id", json={"name": "Budget.xlsx"}, headers=headers)
+        
+        assert response.status_code == 404
+        mock_db['folder_versions'].bulk_write.assert_not_called()
+
+    def file_doc(self, content=b"0123456789"):
+        return {
+            "file_id": "file_id",
+            "name": "movie.mp4",
+            "size": len(content),
+            "content_type": "video/mp4",
+            "upload_date": datetime(2024, 1, 1, 12, 0, 0),
+            "user_id": "user_id"
+        }
+
+    def mock_object(self, mock_minio, content=b"0123456789"):
+        def get_object(bucket, name, offset=0, length=0):
+            data = io.BytesIO(content[offset:offset + length] if length else content[offset:])
+            response = MagicMock()
+            response.read.side_effect = data.read
+            return response
+        mock_minio.get_object.side_effect = get_object
+
+    def test_download_full_advertises_ranges(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['files'].find_one.return_value = self.file_doc()
+        self.mock_object(mock_minio)
+        
+        response = client.get("/api/files/file_id/download", headers=headers)
+        
+        assert response.status_code == 200
+        assert response.content == b"0123456789"
+        assert response.headers["accept-ranges"] == "bytes"
+        assert response.headers["content-length"] == "10"
+
+    def test_download_conditional_on_checksum(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['files'].find_one.return_value = {**self.file_doc(), "sha256": "abc"}
+        self.mock_object(mock_minio)
+
+        response = client.get("/api/files/file_id/download", headers=headers)
+        assert response.headers["etag"] == '"abc"'
+        assert response.headers["cache-control"] == "private, no-cache"
+
+        response = client.get("/api/files/file_id/download",
+                              headers={**headers, "If-None-Match": '"abc"'})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert mock_minio.get_object.call_count == 1
+        mock_minio.stat_object.assert_not_called()
+
+    def test_download_if_modified_since(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}",
+                   "If-Modified-Since": "Mon, 01 Jan 2024 12:00:00 GMT"}
+        mock_db['files'].find_one.return_value = self.file_doc()
+        mock_minio.stat_object.return_value = MagicMock(etag="minio-etag")
+
+        response = client.get("/api/files/file_id/download", headers=headers)
+
+        assert response.status_code == 304
+        assert response.headers["etag"] == '"minio-etag"'
+        mock_minio.get_object.assert_not_called()
+        # Recorded so the next request needs no stat
+        assert mock_db['files'].update_one.call_args.args[1] == {"$set": {"etag": "minio-etag"}}
+
+    def test_download_single_range(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}", "Range": "bytes=2-5"}
+        mock_db['files'].find_one.return_value = self.file_doc()
+        self.mock_object(mock_minio)
+        
+        response = client.get("/api/files/file_id/download", headers=headers)
+        
+        assert response.status_code == 206
+        assert response.content == b"2345"
+        assert response.headers["content-range"] == "bytes 2-5/10"
+        assert response.headers["content-length"] == "4"
+        assert mock_minio.get_object.call_args.kwargs == {"offset": 2, "length": 4}
+
+    def test_download_multi_range(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}", "Range": "bytes=0-1,8-"}
+        mock_db['files'].find_one.return_value = self.file_doc()
+        self.mock_object(mock_minio)
+        
+        response = client.get("/api/files/file_id/download", headers=headers)
+        
+        assert response.status_code == 206
+        assert response.headers["content-type"].startswith("multipart/byteranges; boundary=")
+        assert int(response.headers["content-length"]) == len(response.content)
+        assert b"Content-Range: bytes 0-1/10\r\n\r\n01\r\n" in response.content
+        assert b"Content-Range: bytes 8-9/10\r\n\r\n89\r\n" in response.content
+
+    def test_download_stale_if_range_serves_full_object(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Range": "bytes=2-5",
+            "If-Range": '"old-etag"'
+        }
+        mock_db['files'].find_one.return_value = self.file_doc()
+        mock_minio.stat_object.return_value = MagicMock(etag="new-etag")
+        self.mock_object(mock_minio)
+        
+        response = client.get("/api/files/file_id/download", headers=headers)
+        
+        assert response.status_code == 200
+        assert response.content == b"0123456789"
+
+    def test_download_unsatisfiable_range(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}", "Range": "bytes=20-30"}
+        mock_db['files'].find_one.return_value = self.file_doc()
+        
+        response = client.get("/api/files/file_id/download", headers=headers)
+        
+        assert response.status_code == 416
+        assert response.headers["content-range"] == "bytes */10"
+        mock_minio.get_object.assert_not_called()
+
+    def test_download_from_local_storage(self, app, client, mock_db, tmp_path):
+        store = LocalStore(str(tmp_path))
+        store.ensure_ready()
+        store.put_bytes("file_id", b"0123456789")
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['files'].find_one.return_value = {**self.file_doc(), "sha256": "abc"}
+
+        with patch.object(app.state.resources, 'object_store', store):
+            full = client.get("/api/files/file_id/download", headers=headers)
+            ranged = client.get("/api/files/file_id/download", headers={**headers, "Range": "bytes=2-5"})
+            multi = client.get("/api/files/file_id/download", headers={**headers, "Range": "bytes=0-1,8-"})
+            mock_db['files'].find_one.return_value = {**self.file_doc(), "file_id": "gone"}
+            missing = client.get("/api/files/gone/download", headers=headers)
+
+        assert (full.status_code, full.content) == (200, b"0123456789")
+        assert (ranged.status_code, ranged.content) == (206, b"2345")
+        assert ranged.headers["content-range"] == "bytes 2-5/10"
+        assert b"Content-Range: bytes 8-9/10\r\n\r\n89\r\n" in multi.content
+        assert missing.status_code == 404
+
+    def compressed_doc(self):
+        return {**self.file_doc(), "name": "data.csv", "content_type": "text/csv", "sha256": "abc",
+                "compression": {"codec": "zstd", "stored_size": 4}}
+
+    def test_download_compressed_passes_through(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": "gzip, zstd"}
+        mock_db['files'].find_one.return_value = self.compressed_doc()
+        self.mock_object(mock_minio, b"ZSTD")
+        
+        with client.stream("GET", "/api/files/file_id/download", headers=headers) as response:
+            body = b"".join(response.iter_raw())
+        
+        assert (response.status_code, body) == (200, b"ZSTD")
+        assert response.headers["content-encoding"] == "zstd"
+        assert response.headers["content-length"] == "4"
+        assert response.headers["etag"] == 'W/"abc"'
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert mock_minio.get_object.call_args.kwargs == {}
+
+        response = client.get("/api/files/file_id/download",
+                              headers={**headers, "If-None-Match": 'W/"abc"'})
+        assert response.status_code == 304
+
+    def test_download_compressed_decoded_for_other_clients(self, client, mock_db, mock_minio):
+        zstandard = pytest.importorskip("zstandard")
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": "gzip"}
+        mock_db['files'].find_one.return_value = self.compressed_doc()
+        self.mock_object(mock_minio, zstandard.ZstdCompressor().compress(b"0123456789"))
+        
+        full = client.get("/api/files/file_id/download", headers=headers)
+        ranged = client.get("/api/files/file_id/download",
+                            headers={**headers, "Accept-Encoding": "zstd", "Range": "bytes=2-5"})
+        
+        assert (full.status_code, full.content) == (200, b"0123456789")
+        assert "content-encoding" not in full.headers
+        assert full.headers["content-length"] == "10"
+        assert full.headers["etag"] == '"abc"'
+        assert (ranged.status_code, ranged.content) == (206, b"2345")
+        assert "content-encoding" not in ranged.headers
+
     def test_list_files_authorized(self, client, mock_db, mock_minio):
         token = self.get_auth_token(client, mock_db)
         headers = {"Authorization": f"Bearer {token}"}
         
         # Mock file list
-        mock_db['files'].find.return_value = []
-        mock_db['folders'].find.return_value = []
+        mock_db['files'].find.return_value.__aiter__.return_value = []
+        mock_db['folders'].find.return_value.__aiter__.return_value = []
         
         response = client.get("/api/files", headers=headers)
         assert response.status_code == 200
         assert "items" in response.json()
 
+    def test_metrics_break_down_listing_latency(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        client.get("/api/files", headers=headers)
+        response = client.get("/metrics")
+        
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert 'http_request_duration_seconds_count{method="GET",route="/api/files",status="200"}' in response.text
+        assert 'http_request_phase_seconds_count{route="/api/files",phase="auth"}' in response.text
+        assert 'http_request_phase_seconds_count{route="/api/files",phase="serialize"}' in response.text
+
+    def test_list_files_revalidates_from_folder_version(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['folder_versions'].find_one.return_value = {"_id": "user_id/f", "version": 7}
+
+        first = client.get("/api/files?folder_id=f", headers=headers)
+        etag = first.headers["etag"]
+        assert etag.startswith('W/"7-')
+        assert first.headers["cache-control"] == "private, no-cache"
+        queries = mock_db['files'].find.call_count
+
+        second = client.get("/api/files?folder_id=f", headers={**headers, "If-None-Match": etag})
+        assert second.status_code == 304
+        assert second.headers["etag"] == etag
+        assert mock_db['files'].find.call_count == queries
+
+        mock_db['folder_versions'].find_one.return_value = {"_id": "user_id/f", "version": 8}
+        third = client.get("/api/files?folder_id=f", headers={**headers, "If-None-Match": etag})
+        assert third.status_code == 200
+
+    def test_list_files_served_from_cache_until_folder_changes(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['folder_versions'].find_one.return_value = {"_id": "user_id/f", "version": 1}
+        mock_db['files'].find.return_value.__aiter__.return_value = [{
+            "_id": ObjectId(), "name": "a.txt", "size": 1, "content_type": "text/plain",
+            "upload_date": datetime(2024, 1, 1), "file_id": "a", "folder_id": "f"
+        }]
+
+        first = client.get("/api/files?folder_id=f", headers=headers)
+        queries = mock_db['files'].find.call_count
+        second = client.get("/api/files?folder_id=f", headers=headers)
+
+        assert second.status_code == 200
+        assert second.json() == first.json()
+        assert second.headers["etag"] == first.headers["etag"]
+        assert mock_db['files'].find.call_count == queries
+
+        mock_db['folder_versions'].find_one.return_value = {"_id": "user_id/f", "version": 2}
+        client.get("/api/files?folder_id=f", headers=headers)
+        assert mock_db['files'].find.call_count > queries
+
 class TestFolderOperations:
     def get_auth_token(self, client, mock_db):
         """Helper to get authentication token"""
@@ -183,6 +850,7 @@ class TestFolderOperations:
             "email": "test@example.com",
             "hashed_password": hashed_password,
             "full_name": "Test User",
+            "created_at": datetime.utcnow(),
             "is_active": True
         }
         
@@ -207,15 +875,229 @@ class TestFolderOperations:
         assert response.status_code == 200
         assert response.json()["message"] == "Folder created successfully"
 
-    def test_delete_non_empty_folder(self, client, mock_db):
+    def test_create_nested_folder_records_ancestors(self, client, mock_db):
         token = self.get_auth_token(client, mock_db)
         headers = {"Authorization": f"Bearer {token}"}
         
+        mock_db['folders'].find_one.return_value = {
+            "folder_id": "parent", "name": "Parent",
+            "ancestors": [{"folder_id": "root", "name": "Root"}]
+        }
+        
+        response = client.post("/api/folders", json={"name": "Child", "parent_folder_id": "parent"}, headers=headers)
+        
+        assert response.status_code == 200
+        saved = mock_db['folders'].insert_one.call_args.args[0]
+        assert saved["ancestors"] == [
+            {"folder_id": "root", "name": "Root"}, {"folder_id": "parent", "name": "Parent"}
+        ]
+
+    def test_create_folder_in_missing_parent(self, client, mock_db):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mock_db['folders'].find_one.return_value = None
+        
+        response = client.post("/api/folders", json={"name": "Child", "parent_folder_id": "nope"}, headers=headers)
+        
+        assert response.status_code == 404
+        mock_db['folders'].insert_one.assert_not_called()
+
+    def test_rename_folder_updates_descendant_paths(self, client, mock_db):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mock_db['folders'].find_one_and_update.return_value = {"parent_folder_id": None}
+        
+        response = client.put("/api/folders/folder_id", json={"name": "Renamed"}, headers=headers)
+        
+        assert response.status_code == 200
+        call = mock_db['folders'].update_many.call_args
+        assert call.args[0] == {"user_id": "user_id", "ancestors.folder_id": "folder_id"}
+        assert call.args[1] == {"$set": {"ancestors.$[entry].name": "Renamed"}}
+
+    def test_breadcrumb_single_read(self, client, mock_db):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mock_db['folders'].find_one.return_value = {
+            "folder_id": "c", "name": "C",
+            "ancestors": [{"folder_id": "a", "name": "A"}, {"folder_id": "b", "name": "B"}]
+        }
+        
+        response = client.get("/api/folders/c/breadcrumb", headers=headers)
+        
+        assert response.status_code == 200
+        assert [crumb["name"] for crumb in response.json()["breadcrumb"]] == ["Home", "A", "B", "C"]
+        assert mock_db['folders'].find_one.await_count == 1
+
+    def test_delete_folder_recursive_starts_job(self, client, mock_db):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mock_db['folders'].find_one.return_value = {"_id": "oid"}
+        
+        with patch('main.start_job') as start:
+            response = client.delete("/api/folders/folder_id?recursive=true", headers=headers)
+        
+        assert response.status_code == 202
+        job = response.json()
+        assert job["type"] == "delete_folder"
+        assert job["status"] == "pending"
+        saved = mock_db['jobs'].insert_one.call_args.args[0]
+        assert saved["job_id"] == job["job_id"]
+        assert saved["user_id"] == "user_id"
+        start.assert_called_once()
+        mock_db['files'].count_documents.assert_not_called()
+
+    def test_delete_folder_job_accounts_for_a_partial_delete(self, client, mock_db):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mock_db['folders'].find_one.return_value = {
+            "folder_id": "a", "name": "A", "parent_folder_id": "p",
+            "ancestors": [{"folder_id": "p", "name": "P"}]
+        }
+        
+        async def partial_delete(*args, removed, touched, **kwargs):
+            removed["a"].update(files=1, bytes=4)
+            touched.add("b")
+            raise RuntimeError("storage down")
+        
+        with patch('main.start_job') as start:
+            response = client.delete("/api/folders/a?recursive=true", headers=headers)
+        work = start.call_args.args[2]
+        with patch('main.delete_subtree', side_effect=partial_delete):
+            with pytest.raises(RuntimeError):
+                asyncio.run(work(AsyncMock()))
+        
+        assert response.status_code == 202
+        assert mock_db['usage'].update_one.call_args.args[1] == {"$inc": {"files": -1, "bytes": -4}}
+        usage_ops = mock_db['folders'].bulk_write.call_args.args[0]
+        assert {op._filter["folder_id"] for op in usage_ops} == {"a", "p"}
+        bumped = {op._filter["_id"] for op in mock_db['folder_versions'].bulk_write.call_args.args[0]}
+        assert {"user_id/p", "user_id/a", "user_id/b"} <= bumped
+
+    def test_move_folder_into_own_subtree(self, client, mock_db):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mock_db['folders'].find_one.side_effect = [
+            {"folder_id": "a", "name": "A", "ancestors": []},
+            {"folder_id": "c", "name": "C", "ancestors": [{"folder_id": "a", "name": "A"}]}
+        ]
+        
+        with patch('main.start_job') as start:
+            response = client.post("/api/folders/a/move", json={"target_folder_id": "c"}, headers=headers)
+        
+        assert response.status_code == 400
+        start.assert_not_called()
+
+    def test_move_folder_starts_job(self, client, mock_db):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mock_db['folders'].find_one.side_effect = [
+            {"folder_id": "a", "name": "A", "ancestors": []},
+            {"folder_id": "b", "name": "B", "ancestors": []}
+        ]
+        
+        with patch('main.start_job') as start:
+            response = client.post("/api/folders/a/move", json={"target_folder_id": "b"}, headers=headers)
+        
+        assert response.status_code == 202
+        assert response.json()["target_folder_id"] == "b"
+        start.assert_called_once()
+
+    def test_batch_items(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mock_db['files'].find.return_value.__aiter__.return_value = [
+            {"_id": ObjectId(), "file_id": "f1", "folder_id": None, "size": 10},
+            {"_id": ObjectId(), "file_id": "f2", "folder_id": None, "size": 5}
+        ]
+        mock_db['folders'].find.return_value.__aiter__.return_value = [
+            {"_id": ObjectId(), "folder_id": "a", "name": "A", "ancestors": []},
+            {"_id": ObjectId(), "folder_id": "t", "name": "T", "ancestors": []}
+        ]
+        mock_minio.remove_objects.return_value = iter([])
+        operations = [
+            {"action": "move", "item_type": "file", "item_id": "f1", "target_folder_id": "t"},
+            {"action": "delete", "item_type": "file", "item_id": "f2"},
+            {"action": "rename", "item_type": "file", "item_id": "missing", "name": "x"},
+            {"action": "delete", "item_type": "folder", "item_id": "a"}
+        ]
+        
+        with patch('main.start_job') as start:
+            response = client.post("/api/items/batch", json={"operations": operations}, headers=headers)
+        
+        assert response.status_code == 200
+        body = response.json()
+        assert [r["status"] for r in body["results"]] == ["ok", "ok", "error", "accepted"]
+        assert body["succeeded"] == 3 and body["failed"] == 1
+        assert body["job"]["folder_ids"] == ["a"]
+        assert body["results"][3]["job_id"] == body["job"]["job_id"]
+        assert mock_db['files'].find.call_count == 1
+        assert mock_db['folders'].find.call_count == 1
+        assert mock_db['files'].bulk_write.await_count == 1
+        # No folder writes besides the usage of the move target
+        usage_ops = mock_db['folders'].bulk_write.call_args.args[0]
+        assert [(op._filter["folder_id"], op._doc["$inc"]) for op in usage_ops] == [
+            ("t", {"usage.files": 1, "usage.bytes": 10, "usage.total_files": 1, "usage.total_bytes": 10})
+        ]
+        assert mock_db['usage'].update_one.call_args.args[1] == {"$inc": {"files": -1, "bytes": -5}}
+        assert [obj.name for obj in mock_minio.remove_objects.call_args.args[1]] == ["f2"]
+        start.assert_called_once()
+
+    def test_batch_too_large(self, client, mock_db):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        operations = [{"action": "delete", "item_type": "file", "item_id": "f"}] * 3
+        
+        with patch('main.settings.MAX_BATCH_ITEMS', 2):
+            response = client.post("/api/items/batch", json={"operations": operations}, headers=headers)
+        
+        assert response.status_code == 400
+
+    def test_get_job(self, client, mock_db):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mock_db['jobs'].find_one.return_value = {
+            "_id": ObjectId(), "job_id": "j1", "user_id": "user_id", "type": "delete_folder",
+            "status": "running", "progress": {"total_files": 10, "deleted_files": 4},
+            "created_at": datetime(2024, 1, 1), "updated_at": datetime(2024, 1, 1)
+        }
+        
+        response = client.get("/api/jobs/j1", headers=headers)
+        
+        assert response.status_code == 200
+        assert response.json()["progress"]["deleted_files"] == 4
+        assert "user_id" not in response.json()
+        assert mock_db['jobs'].find_one.call_args.args[0] == {"job_id": "j1", "user_id": "user_id"}
+
     def test_delete_non_empty_folder(self, client, mock_db):
         token = self.get_auth_token(client, mock_db)
         headers = {"Authorization": f"Bearer {token}"}
         
-        # Mock folder contains files
+        mock_db['folders'].find_one.return_value = {
+            "folder_id": "folder_id", "name": "F", "ancestors": [],
+            "usage": {**empty_usage(), "files": 1, "total_files": 1}
+        }
+        
+        response = client.delete("/api/folders/folder_id", headers=headers)
+        assert response.status_code == 400
+        assert "Cannot delete non-empty folder" in response.json()["detail"]
+        mock_db['files'].count_documents.assert_not_called()
+        mock_db['folders'].find_one_and_delete.assert_not_called()
+
+    def test_delete_untracked_folder_counts_contents(self, client, mock_db):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        # Created before usage rollups: no counters to trust
+        mock_db['folders'].find_one.return_value = {"folder_id": "folder_id", "name": "F", "ancestors": []}
         mock_db['files'].count_documents.return_value = 1  # Folder has files
         mock_db['folders'].count_documents.return_value = 0
         
@@ -227,11 +1109,352 @@ class TestFolderOperations:
         token = self.get_auth_token(client, mock_db)
         headers = {"Authorization": f"Bearer {token}"}
         
-        # Mock empty folder
-        mock_db['files'].count_documents.return_value = 0
-        mock_db['folders'].count_documents.return_value = 0
-        mock_db['folders'].delete_one.return_value = MagicMock(deleted_count=1)
+        mock_db['folders'].find_one.return_value = {
+            "folder_id": "folder_id", "name": "F", "parent_folder_id": "parent",
+            "ancestors": [{"folder_id": "parent", "name": "P"}], "usage": empty_usage()
+        }
+        mock_db['folders'].find_one_and_delete.return_value = {"_id": "oid"}
         
         response = client.delete("/api/folders/folder_id", headers=headers)
         assert response.status_code == 200
-        assert response.json()["message"] == "Folder deleted successfully"
\ No newline at end of file
+        assert response.json()["message"] == "Folder deleted successfully"
+        mock_db['files'].count_documents.assert_not_called()
+        usage_ops = mock_db['folders'].bulk_write.call_args.args[0]
+        assert [(op._filter["folder_id"], op._doc["$inc"]) for op in usage_ops] == [
+            ("parent", {"usage.folders": -1, "usage.total_folders": -1})
+        ]
+        bumped = [op._filter["_id"] for op in mock_db['folder_versions'].bulk_write.call_args.args[0]]
+        assert "user_id/parent" in bumped
+
+    def test_folder_usage(self, client, mock_db):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        mock_db['folders'].find_one.return_value = {
+            "usage": {**empty_usage(), "files": 2, "bytes": 30, "total_files": 5, "total_bytes": 80, "total_folders": 1}
+        }
+        
+        response = client.get("/api/usage?folder_id=f", headers=headers)
+        
+        assert response.status_code == 200
+        assert response.json() == {
+            "folder_id": "f", "files": 5, "bytes": 80, "folders": 1,
+            "direct": {"files": 2, "bytes": 30, "folders": 0}
+        }
+        mock_db['files'].count_documents.assert_not_called()
+
+    def test_user_usage_untracked(self, client, mock_db):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        # Only ever $inc'ed, never initialised or rebuilt
+        mock_db['usage'].find_one.return_value = {"_id": "user_id", "files": 3}
+        
+        response = client.get("/api/usage", headers=headers)
+        
+        assert response.status_code == 409
+
+class TestUploadSessions:
+    CHUNK = 5 * 1024 * 1024
+
+    def get_auth_token(self, client, mock_db):
+        """Helper to get authentication token"""
+        from auth import get_password_hash
+        
+        hashed_password = get_password_hash("password123")
+        mock_db['users'].find_one.return_value = {
+            "_id": "user_id",
+            "email": "test@example.com",
+            "hashed_password": hashed_password,
+            "full_name": "Test User",
+            "created_at": datetime.utcnow(),
+            "is_active": True
+        }
+        
+        login_data = {
+            "email": "test@example.com",
+            "password": "password123"
+        }
+        
+        response = client.post("/api/auth/login", json=login_data)
+        return response.json()["access_token"]
+
+    def session_doc(self, parts=None):
+        return {
+            "_id": "session_oid",
+            "session_id": "session_id",
+            "upload_id": "upload_id",
+            "file_id": "65f000000000000000000001",
+            "name": "big.bin",
+            "size": self.CHUNK + 10,
+            "content_type": "application/octet-stream",
+            "folder_id": None,
+            "chunk_size": self.CHUNK,
+            "total_parts": 2,
+            "parts": parts or {},
+            "user_id": "user_id",
+            "updated_at": datetime.utcnow()
+        }
+
+    def test_create_session(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_minio._create_multipart_upload.return_value = "upload_id"
+        
+        response = client.post("/api/uploads", headers=headers, json={
+            "filename": "big.bin", "size": self.CHUNK * 2 + 1, "chunk_size": self.CHUNK
+        })
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total_parts"] == 3
+        assert data["missing_parts"] == [1, 2, 3]
+        assert mock_db['upload_sessions'].insert_one.call_args.args[0]["upload_id"] == "upload_id"
+
+    def test_create_session_rejects_oversized_file(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        with patch('main.settings.MAX_FILE_SIZE', 10):
+            response = client.post("/api/uploads", headers=headers, json={
+                "filename": "big.bin", "size": 11
+            })
+        
+        assert response.status_code == 413
+        mock_minio._create_multipart_upload.assert_not_called()
+
+    def test_upload_part_out_of_order(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['upload_sessions'].find_one.return_value = self.session_doc()
+        mock_minio._upload_part.return_value = "etag2"
+        
+        response = client.put("/api/uploads/session_id/parts/2", headers=headers, content=b"x" * 10)
+        
+        assert response.status_code == 200
+        assert response.json() == {"part_number": 2, "etag": "etag2"}
+        update = mock_db['upload_sessions'].update_one.call_args.args[1]
+        assert update["$set"]["parts.2"] == {"etag": "etag2", "size": 10}
+
+    def test_upload_part_wrong_size(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['upload_sessions'].find_one.return_value = self.session_doc()
+        
+        response = client.put("/api/uploads/session_id/parts/1", headers=headers, content=b"x" * 10)
+        
+        assert response.status_code == 400
+        mock_minio._upload_part.assert_not_called()
+
+    def test_upload_part_oversized_content_length(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}", "Content-Length": str(self.CHUNK * 4)}
+        mock_db['upload_sessions'].find_one.return_value = self.session_doc()
+        
+        response = client.put("/api/uploads/session_id/parts/2", headers=headers, content=b"x" * 10)
+        
+        assert response.status_code == 413
+        mock_minio._upload_part.assert_not_called()
+
+    def test_upload_part_requires_content_length(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['upload_sessions'].find_one.return_value = self.session_doc()
+        
+        # A generator body is sent chunked, without Content-Length
+        response = client.put("/api/uploads/session_id/parts/2", headers=headers,
+                              content=(b"x" * 5 for _ in range(2)))
+        
+        assert response.status_code == 411
+        mock_minio._upload_part.assert_not_called()
+
+    def test_create_session_chunk_size_too_large(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        with patch('main.settings.MAX_UPLOAD_PART_SIZE', self.CHUNK):
+            response = client.post("/api/uploads", headers=headers, json={
+                "filename": "big.bin", "size": self.CHUNK * 2, "chunk_size": self.CHUNK + 1
+            })
+        
+        assert response.status_code == 400
+        mock_minio._create_multipart_upload.assert_not_called()
+
+    def test_complete_incomplete_session(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['upload_sessions'].find_one.return_value = self.session_doc(
+            parts={"2": {"etag": "etag2", "size": 10}}
+        )
+        
+        response = client.post("/api/uploads/session_id/complete", headers=headers)
+        
+        assert response.status_code == 409
+        assert response.json()["detail"]["missing_parts"] == [1]
+        mock_minio._complete_multipart_upload.assert_not_called()
+
+    def test_complete_session(self, client, mock_db, mock_minio):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['upload_sessions'].find_one.return_value = self.session_doc(parts={
+            "2": {"etag": "etag2", "size": 10},
+            "1": {"etag": "etag1", "size": self.CHUNK}
+        })
+        
+        response = client.post("/api/uploads/session_id/complete", headers=headers)
+        
+        assert response.status_code == 200
+        parts = mock_minio._complete_multipart_upload.call_args.args[3]
+        assert [(part.part_number, part.etag) for part in parts] == [(1, "etag1"), (2, "etag2")]
+        saved = mock_db['files'].insert_one.call_args.args[0]
+        assert saved["size"] == self.CHUNK + 10
+        mock_db['upload_sessions'].delete_one.assert_called_once()
+
+    def test_sweep_stale_sessions(self, app, mock_db, mock_minio):
+        from main import sweep_stale_upload_sessions
+        
+        mock_db['upload_sessions'].find.return_value.__aiter__.return_value = [self.session_doc()]
+        
+        swept = asyncio.run(sweep_stale_upload_sessions(app.state.resources))
+        
+        assert swept == 1
+        mock_minio._abort_multipart_upload.assert_called_once_with(
+            "files", "65f000000000000000000001", "upload_id"
+        )
+        mock_db['upload_sessions'].delete_one.assert_called_once_with({"_id": "session_oid"})
+
+class TestPresignedUrls:
+    def get_auth_token(self, client, mock_db):
+        """Helper to get authentication token"""
+        from auth import get_password_hash
+        
+        hashed_password = get_password_hash("password123")
+        mock_db['users'].find_one.return_value = {
+            "_id": "user_id",
+            "email": "test@example.com",
+            "hashed_password": hashed_password,
+            "full_name": "Test User",
+            "created_at": datetime.utcnow(),
+            "is_active": True
+        }
+        
+        login_data = {
+            "email": "test@example.com",
+            "password": "password123"
+        }
+        
+        response = client.post("/api/auth/login", json=login_data)
+        return response.json()["access_token"]
+
+    @pytest.fixture
+    def mock_presign(self, app, mock_minio):
+        with patch.object(app.state.resources.object_store, 'presign_client') as mock_client, \
+             patch('main.settings.PRESIGNED_URLS_ENABLED', True):
+            yield mock_client
+
+    def test_disabled_by_default(self, client, mock_db):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        response = client.get("/api/files/file_id/download-url", headers=headers)
+        assert response.status_code == 404
+
+    def test_download_url_checks_ownership(self, client, mock_db, mock_presign):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['files'].find_one.return_value = None
+        
+        response = client.get("/api/files/file_id/download-url", headers=headers)
+        
+        assert response.status_code == 404
+        mock_presign.presigned_get_object.assert_not_called()
+
+    def test_download_url(self, client, mock_db, mock_presign):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['files'].find_one.return_value = {
+            "file_id": "file_id", "name": "a.pdf", "content_type": "application/pdf"
+        }
+        mock_presign.presigned_get_object.return_value = "http://minio/files/file_id?sig"
+        
+        response = client.get("/api/files/file_id/download-url", headers=headers)
+        
+        assert response.status_code == 200
+        assert response.json()["download_url"] == "http://minio/files/file_id?sig"
+
+    def test_download_url_for_compressed_file(self, client, mock_db, mock_presign):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": "gzip"}
+        mock_db['files'].find_one.return_value = {
+            "file_id": "file_id", "name": "a.csv", "content_type": "text/csv",
+            "compression": {"codec": "zstd", "stored_size": 4}
+        }
+        mock_presign.presigned_get_object.return_value = "http://minio/files/file_id?sig"
+        
+        response = client.get("/api/files/file_id/download-url", headers=headers)
+        assert response.status_code == 406
+        mock_presign.presigned_get_object.assert_not_called()
+        
+        response = client.get("/api/files/file_id/download-url",
+                              headers={**headers, "Accept-Encoding": "gzip, zstd"})
+        assert response.status_code == 200
+        response_headers = mock_presign.presigned_get_object.call_args.kwargs["response_headers"]
+        assert response_headers["response-content-encoding"] == "zstd"
+
+    def test_upload_url_records_pending_upload(self, client, mock_db, mock_presign):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_presign.presigned_put_object.return_value = "http://minio/files/new?sig"
+        
+        response = client.post("/api/files/upload-url", headers=headers, json={"filename": "a.pdf"})
+        
+        assert response.status_code == 200
+        data = response.json()
+        assert data["upload_url"] == "http://minio/files/new?sig"
+        pending = mock_db['upload_sessions'].insert_one.call_args.args[0]
+        assert pending["file_id"] == data["file_id"]
+        assert "upload_id" not in pending
+
+    def test_commit_records_metadata(self, client, mock_db, mock_minio, mock_presign):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['upload_sessions'].find_one.return_value = {
+            "_id": "pending_oid", "file_id": "65f000000000000000000002", "name": "a.pdf",
+            "content_type": None, "folder_id": "folder"
+        }
+        mock_db['folders'].find_one.return_value = {
+            "folder_id": "folder", "name": "Folder", "ancestors": [{"folder_id": "top", "name": "Top"}]
+        }
+        mock_minio.stat_object.return_value = MagicMock(size=42, content_type="application/pdf")
+        
+        response = client.post("/api/files/65f000000000000000000002/commit", headers=headers)
+        
+        assert response.status_code == 200
+        saved = mock_db['files'].insert_one.call_args.args[0]
+        assert saved["size"] == 42
+        assert saved["content_type"] == "application/pdf"
+        assert saved["folder_id"] == "folder"
+        # Counted in the folder and every folder above it
+        usage_ops = mock_db['folders'].bulk_write.call_args.args[0]
+        assert {op._filter["folder_id"]: op._doc["$inc"] for op in usage_ops} == {
+            "folder": {"usage.files": 1, "usage.bytes": 42, "usage.total_files": 1, "usage.total_bytes": 42},
+            "top": {"usage.total_files": 1, "usage.total_bytes": 42}
+        }
+        assert mock_db['usage'].update_one.call_args.args[1] == {"$inc": {"files": 1, "bytes": 42}}
+
+    def test_commit_rejects_oversized_upload(self, client, mock_db, mock_minio, mock_presign):
+        token = self.get_auth_token(client, mock_db)
+        headers = {"Authorization": f"Bearer {token}"}
+        mock_db['upload_sessions'].find_one.return_value = {
+            "_id": "pending_oid", "file_id": "file_id", "name": "a.pdf",
+            "content_type": None, "folder_id": None
+        }
+        mock_minio.stat_object.return_value = MagicMock(size=11)
+        
+        with patch('main.settings.MAX_FILE_SIZE', 10):
+            response = client.post("/api/files/file_id/commit", headers=headers)
+        
+        assert response.status_code == 413
+        mock_minio.remove_object.assert_called_once_with("files", "file_id")
+        mock_db['files'].insert_one.assert_not_called()
+
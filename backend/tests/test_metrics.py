@@ -0,0 +1,138 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+import metrics
+from metrics import (
+    Counter, Histogram, MetricsMiddleware, MongoCommandMetrics, Registry, TimedMinio, timed
+)
+
+
+class TestRegistry:
+    def test_renders_counters_with_escaped_labels(self):
+        registry = Registry()
+        counter = Counter("things_total", "Things", ["kind"], registry=registry)
+        counter.inc(kind='a"b')
+        counter.inc(2, kind='a"b')
+
+        assert registry.render() == (
+            '# HELP things_total Things\n'
+            '# TYPE things_total counter\n'
+            'things_total{kind="a\\"b"} 3\n'
+        )
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Registry()
+        histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0), registry=registry)
+        for value in (0.05, 0.5, 0.7, 3.0):
+            histogram.observe(value)
+
+        lines = registry.render().splitlines()[2:]
+        assert lines == [
+            'latency_seconds_bucket{le="0.1"} 1',
+            'latency_seconds_bucket{le="1"} 3',
+            'latency_seconds_bucket{le="+Inf"} 4',
+            'latency_seconds_sum 4.25',
+            'latency_seconds_count 4',
+        ]
+        assert histogram.get() == (4, 4.25)
+
+
+def instrumented_app():
+    app = FastAPI()
+
+    @app.post("/items/{item_id}")
+    async def upload(item_id: str, request: Request):
+        body = await request.body()
+        with timed("serialize"):
+            return {"id": item_id, "size": len(body)}
+
+    app.add_middleware(MetricsMiddleware, routes=app.router.routes)
+    return app
+
+
+class TestMiddleware:
+    def test_labels_by_route_template_and_counts_bytes(self):
+        client = TestClient(instrumented_app())
+        before = metrics.HTTP_REQUEST_SECONDS.get(method="POST", route="/items/{item_id}", status=200)[0]
+        received = metrics.HTTP_REQUEST_BYTES.get(route="/items/{item_id}")
+
+        response = client.post("/items/42", content=b"x" * 100)
+
+        assert response.status_code == 200
+        assert metrics.HTTP_REQUEST_SECONDS.get(method="POST", route="/items/{item_id}", status=200)[0] == before + 1
+        assert metrics.HTTP_REQUEST_BYTES.get(route="/items/{item_id}") == received + 100
+        assert metrics.HTTP_RESPONSE_BYTES.get(route="/items/{item_id}") >= len(response.content)
+        assert metrics.PHASE_SECONDS.get(route="/items/{item_id}", phase="serialize")[0] >= 1
+        assert metrics.HTTP_IN_FLIGHT.get(method="POST", route="/items/{item_id}") == 0
+
+    def test_unknown_paths_share_one_label(self):
+        client = TestClient(instrumented_app())
+        before = metrics.HTTP_REQUEST_SECONDS.get(method="GET", route="unmatched", status=404)[0]
+
+        client.get("/nope/1")
+        client.get("/nope/2")
+
+        assert metrics.HTTP_REQUEST_SECONDS.get(method="GET", route="unmatched", status=404)[0] == before + 2
+
+
+def command_event(name, command, request_id=1, duration_micros=2500):
+    return SimpleNamespace(command_name=name, command=command, connection_id=("db", 27017),
+                           request_id=request_id, duration_micros=duration_micros)
+
+
+class TestMongoCommandMetrics:
+    def test_times_commands_by_collection(self):
+        listener = MongoCommandMetrics()
+        before = metrics.MONGO_SECONDS.get(command="find", collection="files")
+
+        listener.started(command_event("find", {"find": "files", "filter": {}}))
+        listener.succeeded(command_event("find", {}))
+
+        count, total = metrics.MONGO_SECONDS.get(command="find", collection="files")
+        assert count == before[0] + 1
+        assert total == pytest.approx(before[1] + 0.0025)
+
+    def test_get_more_and_failures(self):
+        listener = MongoCommandMetrics()
+        failures = metrics.MONGO_FAILURES.get(command="getMore", collection="folders")
+
+        listener.started(command_event("getMore", {"getMore": 123, "collection": "folders"}, request_id=7))
+        listener.failed(command_event("getMore", {}, request_id=7))
+
+        assert metrics.MONGO_FAILURES.get(command="getMore", collection="folders") == failures + 1
+
+
+class TestTimedMinio:
+    def test_times_calls_and_failures(self):
+        client = MagicMock()
+        client.stat_object.side_effect = RuntimeError("down")
+        timed_client = TimedMinio(client)
+        before = metrics.MINIO_SECONDS.get(operation="bucket_exists")[0]
+        failures = metrics.MINIO_FAILURES.get(operation="stat_object")
+
+        timed_client.bucket_exists("files")
+        with pytest.raises(RuntimeError):
+            timed_client.stat_object("files", "key")
+
+        assert metrics.MINIO_SECONDS.get(operation="bucket_exists")[0] == before + 1
+        assert metrics.MINIO_FAILURES.get(operation="stat_object") == failures + 1
+
+    def test_multipart_calls_are_timed(self):
+        before = metrics.MINIO_SECONDS.get(operation="_upload_part")[0]
+
+        TimedMinio(MagicMock())._upload_part("files", "key", b"data", None, "upload", 1)
+
+        assert metrics.MINIO_SECONDS.get(operation="_upload_part")[0] == before + 1
+
+    def test_generators_are_timed_while_consumed(self):
+        client = MagicMock()
+        client.remove_objects.side_effect = lambda bucket, objects: (error for error in [])
+        before = metrics.MINIO_SECONDS.get(operation="remove_objects")[0]
+
+        errors = TimedMinio(client).remove_objects("files", [])
+        assert metrics.MINIO_SECONDS.get(operation="remove_objects")[0] == before + 1
+        assert list(errors) == []
+
+        assert metrics.MINIO_SECONDS.get(operation="remove_objects")[0] == before + 2
@@ -0,0 +1,162 @@
+import asyncio
+import hashlib
+import io
+from unittest.mock import MagicMock
+import pytest
+from minio.error import S3Error
+from storage import FileTooLargeError
+from object_store import (
+    LocalFileResponse, LocalStore, MinioStore, ObjectNotFoundError, StorageError, ZEROCOPY_SEND,
+    minio_pool
+)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def s3_error(code):
+    # Keywords: the positional order changed within minio 7.x
+    return S3Error(code=code, message=code, resource="f1", request_id=None, host_id=None, response=None)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LocalStore(str(tmp_path / "files"))
+    store.ensure_ready()
+    return store
+
+
+class TestMinioStore:
+    def test_reader_returns_connection_on_close(self):
+        client = MagicMock()
+        client.get_object.return_value.read.return_value = b"data"
+        reader = MinioStore(client, "files").open("f1", offset=2, length=4)
+
+        assert reader.read(4) == b"data"
+        reader.close()
+
+        assert client.get_object.call_args.kwargs == {"offset": 2, "length": 4}
+        client.get_object.return_value.release_conn.assert_called_once()
+
+    def test_missing_object_raises_not_found(self):
+        client = MagicMock()
+        client.stat_object.side_effect = s3_error("NoSuchKey")
+
+        with pytest.raises(ObjectNotFoundError):
+            MinioStore(client, "files").stat("f1")
+
+    def test_other_errors_raise_storage_error(self):
+        client = MagicMock()
+        client.remove_object.side_effect = s3_error("AccessDenied")
+
+        with pytest.raises(StorageError) as error:
+            MinioStore(client, "files").remove("f1")
+        assert not isinstance(error.value, ObjectNotFoundError)
+
+
+class TestLocalStore:
+    def test_put_stream_sizes_hashes_and_reads_back(self, store):
+        stored = store.put_stream("blobs/abc", io.BytesIO(b"hello world"))
+
+        assert stored.size == 11
+        assert stored.sha256 == hashlib.sha256(b"hello world").hexdigest()
+        assert store.read("blobs/abc") == b"hello world"
+        assert store.stat("blobs/abc").size == 11
+
+    def test_oversized_stream_leaves_nothing_behind(self, store, tmp_path):
+        with pytest.raises(FileTooLargeError):
+            store.put_stream("f1", io.BytesIO(b"x" * 10), max_size=4)
+
+        with pytest.raises(ObjectNotFoundError):
+            store.stat("f1")
+        assert not list((tmp_path / "files" / ".tmp").iterdir())
+
+    def test_ranges_are_read_from_a_map(self, store):
+        store.put_bytes("f1", b"0123456789")
+
+        reader = store.open("f1", offset=2, length=5)
+        assert reader.read(3) == b"234"
+        assert reader.read(10) == b"56"
+        assert reader.read(10) == b""
+        reader.close()
+        assert store.open("f1", offset=20).read() == b""
+        store.put_bytes("empty", b"")
+        assert store.open("empty").read() == b""
+
+    def test_copy_and_remove_prune_directories(self, store, tmp_path):
+        store.put_bytes("staging/f1", b"data")
+        store.copy("staging/f1", "blobs/abc")
+        store.remove("staging/f1")
+
+        assert store.read("blobs/abc") == b"data"
+        assert not (tmp_path / "files" / "staging").exists()
+        # Removing what is not there is not an error
+        store.remove("staging/f1")
+        assert store.remove_many(["blobs/abc", "derivatives/blobs/abc/thumbnail.jpg"]) == []
+        with pytest.raises(ObjectNotFoundError):
+            store.copy("staging/f1", "blobs/def")
+
+    def test_multipart_upload(self, store):
+        upload_id = store.create_multipart_upload("f1")
+        etags = {2: store.upload_part("f1", upload_id, 2, b"world"),
+                 1: store.upload_part("f1", upload_id, 1, b"hello ")}
+
+        etag = store.complete_multipart_upload("f1", upload_id, etags)
+
+        assert store.read("f1") == b"hello world"
+        assert etag.endswith("-2")
+        with pytest.raises(ObjectNotFoundError):
+            store.abort_multipart_upload("f1", upload_id)
+
+    def test_rejects_keys_outside_the_root(self, store):
+        for key in ("../etc/passwd", "/etc/passwd", "a//b", ".uploads/x", ""):
+            with pytest.raises(ValueError):
+                store.path(key)
+
+    def test_no_presigned_urls(self, store):
+        assert not store.supports_presigned_urls
+        assert MinioStore(MagicMock(), "files").supports_presigned_urls
+
+
+class TestLocalFileResponse:
+    def send_to(self, response, extensions):
+        messages = []
+
+        async def receive():
+            # The client stays connected
+            await asyncio.Future()
+
+        async def send(message):
+            messages.append(message)
+
+        run(response({"type": "http", "extensions": extensions}, receive, send))
+        return messages
+
+    def test_streams_range_without_zero_copy(self, store):
+        store.put_bytes("f1", b"0123456789")
+        response = LocalFileResponse(store.local_path("f1"), 2, 5, status_code=206)
+
+        messages = self.send_to(response, {})
+
+        assert messages[0]["status"] == 206
+        assert b"".join(m.get("body", b"") for m in messages[1:]) == b"23456"
+
+    def test_hands_file_to_zero_copy_server(self, store):
+        store.put_bytes("f1", b"0123456789")
+        response = LocalFileResponse(store.local_path("f1"), 2, 5)
+
+        messages = self.send_to(response, {ZEROCOPY_SEND: {}})
+
+        assert [m["type"] for m in messages] == ["http.response.start", ZEROCOPY_SEND]
+        assert (messages[1]["offset"], messages[1]["count"]) == (2, 5)
+
+    def test_missing_file_is_not_found(self, store):
+        with pytest.raises(ObjectNotFoundError):
+            store.local_path("f1")
+
+
+def test_minio_pool_is_sized_for_the_storage_workers():
+    pool = minio_pool(32)
+    assert pool.connection_pool_kw["maxsize"] == 32
+    assert pool.connection_pool_kw["retries"].total == 5
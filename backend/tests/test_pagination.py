@@ -0,0 +1,46 @@
+import pytest
+from datetime import datetime
+from bson import ObjectId
+
+from pagination import (
+    ListingSort, SortOrder, InvalidCursorError, encode_cursor, decode_cursor,
+    keyset_filter, sort_spec
+)
+
+
+class TestCursor:
+    def test_round_trip_with_datetime_key(self):
+        doc = {"_id": ObjectId(), "upload_date": datetime(2024, 5, 1, 12, 30)}
+        cursor = encode_cursor("file", ListingSort.DATE, SortOrder.DESC, doc)
+        decoded = decode_cursor(cursor, ListingSort.DATE, SortOrder.DESC)
+        assert decoded["p"] == "file"
+        assert decoded["k"] == datetime(2024, 5, 1, 12, 30)
+        assert decoded["i"] == doc["_id"]
+
+    def test_rejects_cursor_from_other_sort(self):
+        cursor = encode_cursor("folder", ListingSort.NAME, SortOrder.ASC, {"_id": ObjectId(), "name": "a"})
+        with pytest.raises(InvalidCursorError):
+            decode_cursor(cursor, ListingSort.SIZE, SortOrder.ASC)
+
+    def test_rejects_garbage(self):
+        with pytest.raises(InvalidCursorError):
+            decode_cursor("not-a-cursor", ListingSort.NAME, SortOrder.ASC)
+
+
+class TestKeyset:
+    def test_filter_is_strictly_after_cursor(self):
+        oid = ObjectId()
+        position = {"p": "file", "k": 100, "i": oid}
+        assert keyset_filter("file", ListingSort.SIZE, SortOrder.DESC, position) == {"$or": [
+            {"size": {"$lt": 100}},
+            {"size": 100, "_id": {"$lt": oid}},
+        ]}
+
+    def test_no_filter_for_other_phase_or_phase_start(self):
+        position = {"p": "file", "k": "a", "i": ObjectId()}
+        assert keyset_filter("folder", ListingSort.NAME, SortOrder.ASC, position) == {}
+        assert keyset_filter("file", ListingSort.NAME, SortOrder.ASC, {"p": "file"}) == {}
+
+    def test_folders_sort_by_name_for_size(self):
+        assert sort_spec("folder", ListingSort.SIZE, SortOrder.ASC) == [("name", 1), ("_id", 1)]
+        assert sort_spec("file", ListingSort.SIZE, SortOrder.DESC) == [("size", -1), ("_id", -1)]
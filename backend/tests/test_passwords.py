@@ -0,0 +1,43 @@
+import asyncio
+import pytest
+from passwords import PasswordHasher, HashQueueFullError, verify_password_sync
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(workers=1, max_queue=1)
+    yield hasher
+    hasher.shutdown()
+
+
+class TestPasswordHasher:
+    def test_hash_and_verify_in_pool(self, hasher):
+        async def run():
+            hashed = await hasher.hash("password123")
+            return hashed, await hasher.verify("password123", hashed), await hasher.verify("nope", hashed)
+
+        hashed, good, bad = asyncio.run(run())
+        assert verify_password_sync("password123", hashed)
+        assert good is True
+        assert bad is False
+        stats = hasher.stats()
+        assert stats["completed"] == 3
+        assert stats["queue_depth"] == 0
+        assert stats["latency_ms"]["max"] > 0
+
+    def test_rejects_when_queue_is_full(self, hasher):
+        async def run():
+            # one call on the worker, one queued, the third is turned away
+            return await asyncio.gather(
+                *(hasher.hash("password123") for _ in range(3)), return_exceptions=True
+            )
+
+        results = asyncio.run(run())
+        assert sum(isinstance(r, HashQueueFullError) for r in results) == 1
+        assert sum(isinstance(r, str) for r in results) == 2
+        assert hasher.stats()["rejected"] == 1
+
+    def test_queue_depth_counts_only_waiting_calls(self, hasher):
+        hasher.pending = 2
+        assert hasher.queue_depth == 1
+        assert hasher.stats()["in_flight"] == 1
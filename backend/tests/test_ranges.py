@@ -0,0 +1,56 @@
+import pytest
+from datetime import datetime
+
+from ranges import (
+    RangeNotSatisfiableError, parse_range_header, if_range_matches,
+    http_date, multipart_length, multipart_part_header, multipart_trailer
+)
+
+
+class TestParseRangeHeader:
+    def test_missing_or_foreign_unit_serves_full_object(self):
+        assert parse_range_header(None, 100) is None
+        assert parse_range_header("items=0-5", 100) is None
+
+    def test_malformed_spec_is_ignored(self):
+        assert parse_range_header("bytes=5-1", 100) is None
+        assert parse_range_header("bytes=abc", 100) is None
+        assert parse_range_header("bytes=-", 100) is None
+
+    def test_single_ranges(self):
+        assert parse_range_header("bytes=0-9", 100) == [(0, 9)]
+        assert parse_range_header("bytes=90-", 100) == [(90, 99)]
+        assert parse_range_header("bytes=-10", 100) == [(90, 99)]
+        assert parse_range_header("bytes=50-500", 100) == [(50, 99)]
+
+    def test_multi_range_keeps_order_and_coalesces_overlaps(self):
+        assert parse_range_header("bytes=50-59, 0-9", 100) == [(50, 59), (0, 9)]
+        assert parse_range_header("bytes=0-9,5-20,40-49", 100) == [(0, 20), (40, 49)]
+
+    def test_unsatisfiable(self):
+        with pytest.raises(RangeNotSatisfiableError):
+            parse_range_header("bytes=100-200", 100)
+        with pytest.raises(RangeNotSatisfiableError):
+            parse_range_header("bytes=-5", 0)
+
+
+class TestIfRange:
+    def test_etag_requires_strong_match(self):
+        assert if_range_matches('"abc"', etag='"abc"')
+        assert not if_range_matches('"abc"', etag='"def"')
+        assert not if_range_matches('W/"abc"', etag='W/"abc"')
+
+    def test_date_must_equal_last_modified(self):
+        modified = datetime(2024, 1, 2, 3, 4, 5, 678000)
+        assert if_range_matches(http_date(modified), last_modified=modified)
+        assert not if_range_matches(http_date(datetime(2024, 1, 1)), last_modified=modified)
+
+
+def test_multipart_length_matches_body():
+    ranges = [(0, 3), (10, 11)]
+    body = b""
+    for start, end in ranges:
+        body += multipart_part_header("b", "text/plain", start, end, 20)
+        body += b"x" * (end - start + 1) + b"\r\n"
+    body += multipart_trailer("b")
+    assert multipart_length("b", "text/plain", ranges, 20) == len(body)
@@ -0,0 +1,42 @@
+from search import name_grams, query_grams, match_rank, rank_matches, search_query
+
+
+class TestGrams:
+    def test_name_grams_cover_substrings_and_word_prefixes(self):
+        grams = name_grams("My Report.pdf")
+        assert "rep" in grams and "t.p" in grams
+        assert "^m" in grams and "^re" in grams and "^pd" in grams
+        assert {"<m", "<my", "<my "} <= set(grams)
+
+    def test_query_grams_are_a_subset_of_matching_names(self):
+        assert set(query_grams("PORT")) <= set(name_grams("My Report.pdf"))
+        assert set(query_grams("re")) <= set(name_grams("My Report.pdf"))
+
+    def test_search_query_never_uses_regex(self):
+        query = search_query("user_id", ".*(a+)+$")
+        assert query["user_id"] == "user_id"
+        assert "$regex" not in str(query)
+
+    def test_prefix_query_needs_the_name_start(self):
+        grams = search_query("user_id", "Report", prefix=True)["name_grams"]["$all"]
+        assert "<rep" in grams and set(grams) <= set(name_grams("report-2024.pdf"))
+        assert not set(grams) <= set(name_grams("q1 report.pdf"))
+
+
+class TestRanking:
+    def test_match_rank_order(self):
+        assert match_rank("report", "Report") == 0
+        assert match_rank("report", "report-2024.pdf") == 1
+        assert match_rank("report", "q1 report.pdf") == 2
+        assert match_rank("port", "q1 report.pdf") == 3
+        assert match_rank("xyz", "q1 report.pdf") is None
+
+    def test_short_terms_only_match_word_prefixes(self):
+        assert match_rank("re", "q1 report.pdf") == 2
+        assert match_rank("po", "q1 report.pdf") is None
+
+    def test_rank_matches_drops_false_positives(self):
+        docs = [{"name": "annual report.pdf"}, {"name": "report.pdf"}, {"name": "teport rep"}]
+        assert [doc["name"] for doc in rank_matches("report", docs)] == [
+            "report.pdf", "annual report.pdf"
+        ]
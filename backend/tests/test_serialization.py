@@ -0,0 +1,51 @@
+import json
+from datetime import datetime
+from unittest.mock import patch
+from bson import ObjectId
+from serialization import FastJSONResponse, dumps, listing_rows
+
+FILE_DOC = {
+    "_id": ObjectId("65a000000000000000000001"), "name": "Résumé   \"final\".pdf", "size": 10,
+    "content_type": "application/pdf", "upload_date": datetime(2024, 1, 1, 12, 0, 0, 5),
+    "file_id": "f1", "folder_id": None, "thumbnail": {"status": "ready"},
+}
+FOLDER_DOC = {
+    "_id": ObjectId("65a000000000000000000002"), "name": "Docs", "created_date": datetime(2024, 1, 1),
+    "folder_id": "d1", "usage": {"tracked": True, "total_files": 3, "total_bytes": 30},
+}
+
+
+def legacy(content):
+    # What JSONResponse renders
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
+
+
+class TestListingRows:
+    def test_rows(self):
+        folder, = listing_rows("folder", [FOLDER_DOC])
+        file, = listing_rows("file", [FILE_DOC])
+
+        assert folder["id"] == "65a000000000000000000002"
+        assert folder["parent_folder_id"] is None
+        assert folder["usage"] == {"files": 3, "bytes": 30, "folders": 0}
+        assert file["item_type"] == "file"
+        assert file["has_thumbnail"] is True
+        assert file["upload_date"] == FILE_DOC["upload_date"]
+
+    def test_encoded_like_json_response(self):
+        rows = listing_rows("folder", [FOLDER_DOC]) + listing_rows("file", [FILE_DOC])
+        expected = [
+            {**row, **{key: row[key].isoformat() for key in ("created_date", "upload_date") if key in row}}
+            for row in rows
+        ]
+
+        assert dumps({"items": rows}) == legacy({"items": expected})
+        with patch("serialization.orjson", None):
+            assert dumps({"items": rows}) == legacy({"items": expected})
+
+    def test_response(self):
+        response = FastJSONResponse(content={"at": datetime(2024, 1, 1)}, headers={"ETag": '"x"'})
+
+        assert response.body == b'{"at":"2024-01-01T00:00:00"}'
+        assert response.headers["content-type"] == "application/json"
@@ -0,0 +1,77 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+import pytest
+from metrics import STARTUP_SECONDS
+from startup import create_mongo_client, retry, run_steps
+
+
+@pytest.fixture
+def no_sleep():
+    with patch("startup.asyncio.sleep", new_callable=AsyncMock) as sleep:
+        yield sleep
+
+
+class TestRetry:
+    def test_succeeds_after_transient_failures(self, no_sleep):
+        step = AsyncMock(side_effect=[ConnectionError("down"), ConnectionError("down"), "ok"])
+
+        assert asyncio.run(retry(step, "mongodb", attempts=5, delay=1)) == "ok"
+        assert step.await_count == 3
+        waits = [call.args[0] for call in no_sleep.await_args_list]
+        # Doubling, with up to half taken off as jitter
+        assert 0.5 <= waits[0] <= 1 and 1 <= waits[1] <= 2
+
+    def test_gives_up_after_the_last_attempt(self, no_sleep):
+        step = AsyncMock(side_effect=ConnectionError("down"))
+
+        with pytest.raises(ConnectionError):
+            asyncio.run(retry(step, "storage", attempts=3, delay=1))
+        assert step.await_count == 3
+        assert no_sleep.await_count == 2
+
+    def test_backoff_is_capped(self, no_sleep):
+        step = AsyncMock(side_effect=[ConnectionError("down")] * 10 + ["ok"])
+
+        asyncio.run(retry(step, "mongodb", attempts=11, delay=1))
+        assert max(call.args[0] for call in no_sleep.await_args_list) <= 30
+
+
+class TestRunSteps:
+    def test_steps_run_concurrently_and_are_timed(self):
+        running, overlapped = set(), []
+
+        def step(name):
+            async def run():
+                running.add(name)
+                await asyncio.sleep(0)
+                overlapped.append(len(running))
+                running.discard(name)
+            return run
+
+        timings = asyncio.run(run_steps({"a": step("a"), "b": step("b")}, attempts=1, delay=0))
+
+        assert set(timings) == {"a", "b"}
+        assert max(overlapped) == 2
+        assert STARTUP_SECONDS.get(phase="a") == timings["a"]
+
+    def test_failing_step_fails_startup(self, no_sleep):
+        async def broken():
+            raise ConnectionError("down")
+
+        with pytest.raises(ConnectionError):
+            asyncio.run(run_steps({"ok": AsyncMock(), "broken": broken}, attempts=2, delay=0))
+
+
+def test_mongo_client_pool_is_configured_and_lazy():
+    settings = SimpleNamespace(
+        MONGODB_URL="mongodb://db.invalid:27017", MONGODB_MAX_POOL_SIZE=7,
+        MONGODB_MIN_POOL_SIZE=2, MONGODB_SERVER_SELECTION_TIMEOUT_MS=1000, METRICS_ENABLED=False
+    )
+    client = create_mongo_client(settings)
+    try:
+        assert client.options.pool_options.max_pool_size == 7
+        assert client.options.pool_options.min_pool_size == 2
+        assert client.options.server_selection_timeout == 1
+    finally:
+        asyncio.run(client.close())
@@ -0,0 +1,51 @@
+import pytest
+import asyncio
+import hashlib
+import io
+from unittest.mock import MagicMock
+
+from storage import FileTooLargeError, HashingReader, stream_to_minio
+
+
+class TestHashingReader:
+    def test_counts_and_hashes(self):
+        reader = HashingReader(io.BytesIO(b"hello world"))
+        assert reader.read(5) == b"hello"
+        assert reader.read(-1) == b" world"
+        assert reader.size == 11
+        assert reader.sha256 == hashlib.sha256(b"hello world").hexdigest()
+
+    def test_enforces_max_size_mid_stream(self):
+        reader = HashingReader(io.BytesIO(b"x" * 10), max_size=6)
+        assert reader.read(4) == b"xxxx"
+        with pytest.raises(FileTooLargeError):
+            reader.read(4)
+
+
+class TestStreamToMinio:
+    def test_uses_unknown_length_multipart(self):
+        client = MagicMock()
+        client.put_object.side_effect = lambda bucket, name, data, **kwargs: data.read(-1)
+
+        stored = stream_to_minio(client, "files", "obj", io.BytesIO(b"data"), part_size=5 * 1024 * 1024)
+
+        kwargs = client.put_object.call_args.kwargs
+        assert kwargs["length"] == -1
+        assert kwargs["part_size"] == 5 * 1024 * 1024
+        assert kwargs["num_parallel_uploads"] == 1
+        assert stored.size == 4
+        assert stored.sha256 == hashlib.sha256(b"data").hexdigest()
+
+
+class TestIterObject:
+    def test_streams_chunks_and_closes(self):
+        from storage import iter_object
+
+        response = MagicMock()
+        response.read.side_effect = [b"ab", b"cd", b""]
+
+        async def collect():
+            return [chunk async for chunk in iter_object(response, chunk_size=2)]
+
+        assert asyncio.run(collect()) == [b"ab", b"cd"]
+        response.close.assert_called_once()
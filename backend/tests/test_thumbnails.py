@@ -0,0 +1,173 @@
+import asyncio
+import io
+from unittest.mock import AsyncMock, MagicMock, patch
+import pytest
+from object_store import MinioStore
+from thumbnails import ThumbnailPipeline, ThumbnailStatus, UnsupportedSourceError, has_thumbnail
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def pipeline(files=None, client=None, **kwargs):
+    p = ThumbnailPipeline(files or AsyncMock(), MinioStore(client or MagicMock(), "files"), **kwargs)
+    p.enabled = True  # independent of whether Pillow is installed here
+    return p
+
+
+class TestFields:
+    def test_images_and_pdfs_are_queued(self):
+        p = pipeline()
+        assert p.fields("image/jpeg", 10)["thumbnail"]["status"] == "pending"
+        assert p.fields("application/pdf", 10)["thumbnail"]["status"] == "pending"
+
+    def test_other_types_and_large_sources_are_not(self):
+        p = pipeline(max_source_size=100)
+        assert p.fields("text/plain", 10) == {}
+        assert p.fields(None, 10) == {}
+        assert p.fields("image/png", 101) == {}
+
+    def test_disabled(self):
+        p = pipeline()
+        p.enabled = False
+        assert p.fields("image/png", 10) == {}
+
+    def test_has_thumbnail(self):
+        assert has_thumbnail({"thumbnail": {"status": "ready"}})
+        assert not has_thumbnail({"thumbnail": {"status": "pending"}})
+        assert not has_thumbnail({})
+
+
+class TestProcess:
+    def claimed(self, **extra):
+        return {"_id": "oid", "file_id": "f1", "content_type": "image/png", **extra}
+
+    def test_renders_and_stores_thumbnail(self):
+        files = AsyncMock()
+        client = MagicMock()
+        client.stat_object.side_effect = Exception("NoSuchKey")
+        client.get_object.return_value.read.return_value = b"source"
+        files.find_one_and_update.return_value = None  # idle workers
+        p = pipeline(files, client)
+
+        async def go():
+            p.start()
+            try:
+                with patch("thumbnails.render_thumbnail", return_value=b"jpeg") as render:
+                    status = await p.process(self.claimed())
+                return status, render
+            finally:
+                await p.stop()
+
+        status, render = run(go())
+
+        assert status == ThumbnailStatus.READY
+        render.assert_called_once_with(b"source", "image/png", 256)
+        assert client.put_object.call_args.args[1] == "derivatives/f1/thumbnail.jpg"
+        update = files.update_one.call_args.args
+        assert update[0] == {"_id": "oid", "thumbnail.status": "processing"}
+        assert update[1]["$set"]["thumbnail.status"] == "ready"
+        assert p.stats()["ready"] == 1
+
+    def test_reuses_thumbnail_of_shared_blob(self):
+        files = AsyncMock()
+        client = MagicMock()
+        p = pipeline(files, client)
+
+        status = run(p.process(self.claimed(object_name="blobs/abc")))
+
+        assert status == ThumbnailStatus.READY
+        client.stat_object.assert_called_once_with("files", "derivatives/blobs/abc/thumbnail.jpg")
+        client.get_object.assert_not_called()
+        assert p.stats()["reused"] == 1
+
+    def test_failures_are_recorded(self):
+        files = AsyncMock()
+        client = MagicMock()
+        client.stat_object.side_effect = Exception("NoSuchKey")
+        client.get_object.side_effect = Exception("boom")
+        p = pipeline(files, client)
+
+        assert run(p.process(self.claimed())) == ThumbnailStatus.FAILED
+        assert files.update_one.call_args.args[1]["$set"]["thumbnail.status"] == "failed"
+
+    def test_unsupported_source(self):
+        files = AsyncMock()
+        client = MagicMock()
+        client.stat_object.side_effect = Exception("NoSuchKey")
+        files.find_one_and_update.return_value = None  # idle workers
+        p = pipeline(files, client)
+
+        async def go():
+            p.start()
+            try:
+                with patch("thumbnails.render_thumbnail", side_effect=UnsupportedSourceError()):
+                    return await p.process(self.claimed(content_type="application/pdf"))
+            finally:
+                await p.stop()
+
+        assert run(go()) == ThumbnailStatus.UNSUPPORTED
+
+    def test_thumbnail_of_deleted_file_is_removed(self):
+        files = AsyncMock()
+        files.update_one.return_value = MagicMock(matched_count=0)
+        client = MagicMock()
+        p = pipeline(files, client)
+
+        run(p.process(self.claimed()))
+
+        client.remove_object.assert_called_once_with("files", "derivatives/f1/thumbnail.jpg")
+
+
+    def test_ready_thumbnail_notifies(self):
+        files = AsyncMock()
+        on_ready = AsyncMock()
+        p = pipeline(files, MagicMock(), on_ready=on_ready)
+
+        run(p.process(self.claimed(user_id="u", folder_id="f")))
+
+        on_ready.assert_awaited_once()
+        assert on_ready.call_args.args[0]["folder_id"] == "f"
+
+
+class TestWorkers:
+    def test_claims_pending_then_idles(self):
+        files = AsyncMock()
+        files.find_one_and_update.side_effect = [
+            {"_id": "oid", "file_id": "f1", "content_type": "image/png"}, None, None
+        ]
+        p = pipeline(files, MagicMock(), workers=1, poll_interval=60)
+
+        async def go():
+            with patch.object(p, "process", AsyncMock()) as process:
+                p.start()
+                await asyncio.sleep(0.05)
+                p.notify()
+                await asyncio.sleep(0.05)
+                await p.stop()
+                return process
+
+        process = run(go())
+
+        process.assert_awaited_once()
+        claim = files.find_one_and_update.call_args.args
+        assert claim[1]["$set"]["thumbnail.status"] == "processing"
+        assert claim[1]["$inc"] == {"thumbnail.attempts": 1}
+        # one claim that found work, one that didn't, one more after notify()
+        assert files.find_one_and_update.await_count == 3
+
+
+class TestRender:
+    def test_image_is_scaled_to_fit(self):
+        Image = pytest.importorskip("PIL.Image")
+        from thumbnails import render_thumbnail
+
+        source = io.BytesIO()
+        Image.new("RGBA", (1024, 512), (255, 0, 0, 128)).save(source, "PNG")
+
+        out = render_thumbnail(source.getvalue(), "image/png", 256)
+
+        with Image.open(io.BytesIO(out)) as thumb:
+            assert thumb.format == "JPEG"
+            assert thumb.size == (256, 128)
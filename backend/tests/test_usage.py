@@ -0,0 +1,117 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+from usage import UsageChanges, apply_usage, empty_usage, rebuild_usage, removed_subtrees
+
+
+def folder(folder_id, ancestors=(), **usage):
+    return {"_id": folder_id, "user_id": "u", "folder_id": folder_id,
+            "parent_folder_id": ancestors[-1] if ancestors else None,
+            "ancestors": [{"folder_id": a, "name": a} for a in ancestors],
+            "usage": {**empty_usage(), **usage}}
+
+
+def cursor(rows):
+    result = MagicMock()
+    result.__aiter__.return_value = rows
+    return result
+
+
+class TestUsageChanges:
+    def test_item_counts_directly_and_up_the_chain(self):
+        changes = UsageChanges()
+        changes.add_item(["a", "b"], files=1, bytes=100)
+
+        assert dict(changes.folders["b"]) == {"files": 1, "bytes": 100, "total_files": 1, "total_bytes": 100}
+        assert dict(changes.folders["a"]) == {"total_files": 1, "total_bytes": 100}
+        assert changes.user["bytes"] == 100
+
+    def test_root_items_only_count_for_the_user(self):
+        changes = UsageChanges()
+        changes.add_item([], folders=1)
+
+        assert changes.operations("u") == []
+        assert changes.user["folders"] == 1
+
+    def test_deltas_for_one_folder_are_merged(self):
+        changes = UsageChanges()
+        changes.add_item(["a"], files=1, bytes=10)
+        changes.add_item(["a"], files=-1, bytes=-10)
+        changes.add_item(["a"], files=1, bytes=4)
+
+        [operation] = changes.operations("u")
+        assert operation._filter == {"user_id": "u", "folder_id": "a"}
+        assert operation._doc == {"$inc": {"usage.files": 1, "usage.bytes": 4,
+                                           "usage.total_files": 1, "usage.total_bytes": 4}}
+
+    def test_subtree_carries_its_totals_and_itself(self):
+        changes = UsageChanges()
+        changes.add_subtree(["p"], folder("c", ["p"], total_files=3, total_bytes=30, total_folders=2), -1)
+
+        assert dict(changes.folders["p"]) == {"folders": -1, "total_files": -3, "total_bytes": -30,
+                                              "total_folders": -3}
+        assert dict(changes.user) == {"files": -3, "bytes": -30, "folders": -3}
+
+    def test_removed_subtrees_skip_nested_roots(self):
+        outer = folder("a", ["top"], total_files=5, total_folders=1)
+        inner = folder("b", ["top", "a"], total_files=2)
+
+        changes = removed_subtrees([inner, outer], {"a": {"files": 5, "folders": 2}})
+
+        assert dict(changes.user) == {"files": -5, "folders": -2}
+        assert "a" not in changes.folders
+
+    def test_removed_subtrees_count_what_was_deleted(self):
+        # Totals read before the job; a file and a folder arrived while it ran
+        doc = folder("a", ["top"], total_files=1, total_bytes=10)
+
+        changes = removed_subtrees([doc], {"a": {"files": 2, "bytes": 110, "folders": 2}})
+
+        assert dict(changes.folders["top"]) == {"folders": -1, "total_files": -2,
+                                                "total_bytes": -110, "total_folders": -2}
+        assert dict(changes.user) == {"files": -2, "bytes": -110, "folders": -2}
+        assert not removed_subtrees([doc], {}).folders
+
+    def test_removed_subtrees_keep_a_partly_deleted_folder(self):
+        doc = folder("a", ["top"], total_files=3, total_bytes=30, total_folders=1)
+
+        changes = removed_subtrees([doc], {"a": {"files": 2, "bytes": 20}})
+
+        # "a" is still there: only the totals up its chain lose the files that went
+        assert dict(changes.folders["a"]) == {"total_files": -2, "total_bytes": -20}
+        assert dict(changes.folders["top"]) == {"total_files": -2, "total_bytes": -20}
+        assert dict(changes.user) == {"files": -2, "bytes": -20}
+
+    def test_apply_writes_folders_then_user(self):
+        folders_coll, usage_coll = AsyncMock(), AsyncMock()
+        changes = UsageChanges()
+        changes.add_item(["a"], files=1, bytes=10)
+
+        asyncio.run(apply_usage(folders_coll, usage_coll, "u", changes))
+
+        assert len(folders_coll.bulk_write.call_args.args[0]) == 1
+        usage_coll.update_one.assert_awaited_once_with(
+            {"_id": "u"}, {"$inc": {"files": 1, "bytes": 10}}, upsert=True
+        )
+
+
+class TestRebuild:
+    def test_recomputes_direct_and_subtree_counts(self):
+        db = MagicMock()
+        db.files.aggregate = AsyncMock(return_value=cursor([
+            {"_id": {"user_id": "u", "folder_id": "b"}, "files": 2, "bytes": 20},
+            {"_id": {"user_id": "u", "folder_id": None}, "files": 1, "bytes": 1},
+        ]))
+        db.folders.find.return_value = cursor([folder("a"), folder("b", ["a"])])
+        db.folders.bulk_write = AsyncMock()
+        db.users.find.return_value = cursor([{"_id": "u"}, {"_id": "empty"}])
+        db.usage.bulk_write = AsyncMock()
+
+        assert asyncio.run(rebuild_usage(db)) == {"folders": 2, "users": 2}
+
+        usage = {op._filter["_id"]: op._doc["$set"]["usage"] for op in db.folders.bulk_write.call_args.args[0]}
+        assert usage["a"] == {"files": 0, "bytes": 0, "folders": 1, "total_files": 2, "total_bytes": 20,
+                              "total_folders": 1, "tracked": True}
+        assert usage["b"]["files"] == 2 and usage["b"]["total_folders"] == 0
+        users = {op._filter["_id"]: op._doc["$set"] for op in db.usage.bulk_write.call_args.args[0]}
+        assert users["u"] == {"files": 3, "bytes": 21, "folders": 2, "tracked": True}
+        assert users["empty"] == {"files": 0, "bytes": 0, "folders": 0, "tracked": True}
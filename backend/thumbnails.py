@@ -0,0 +1,264 @@
+"""Thumbnail derivatives rendered in the background.
+
+An upload whose type can be previewed is stored with ``thumbnail.status``
+set to ``pending``, and that field is the queue: ``claim_next`` atomically
+flips one pending file to ``processing``, so every API process can run
+consumers against the same collection. Each process runs ``workers`` consumer
+tasks, and decoding/resizing happens on a thread pool of the same size (Pillow
+releases the GIL while it works), so rendering is bounded and never blocks the
+event loop. A claim left behind by a crashed process is picked up again after
+``claim_timeout``, at most ``MAX_ATTEMPTS`` times.
+
+Thumbnails are JPEGs stored under ``derivatives/<object key>/thumbnail.jpg``,
+so files sharing a deduplicated blob share one thumbnail. A file's bytes never
+change, which is what lets the thumbnail endpoint send a year-long immutable
+``Cache-Control``.
+
+Images are rendered with Pillow and PDFs from their first page through
+poppler's ``pdftoppm``. Pillow is optional: without it nothing is queued.
+Without ``pdftoppm``, PDFs end up ``unsupported``.
+"""
+import asyncio
+import io
+import logging
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from blobs import BLOB_PREFIX, object_key, thumbnail_key
+from storage import run_storage_io
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # optional dependency: thumbnails are disabled without it
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp", "image/tiff"}
+PDF_TYPE = "application/pdf"
+PDF_RENDERER = shutil.which("pdftoppm")
+PDF_RENDER_TIMEOUT = 30  # seconds
+MAX_ATTEMPTS = 3
+JPEG_QUALITY = 80
+
+SOURCE_PROJECTION = {
+    "file_id": 1, "object_name": 1, "content_type": 1, "thumbnail": 1, "user_id": 1, "folder_id": 1,
+}
+
+
+class ThumbnailStatus(str, Enum):
+    PENDING = "pending"
+    PROCESSING = "processing"
+    READY = "ready"
+    FAILED = "failed"
+    UNSUPPORTED = "unsupported"
+
+
+class UnsupportedSourceError(Exception):
+    """Raised for sources this process has no renderer for"""
+
+
+def render_pdf_page(data: bytes, size: int) -> bytes:
+    """First page of a PDF as PNG, scaled so its long side is ``size``"""
+    if PDF_RENDERER is None:
+        raise UnsupportedSourceError("pdftoppm is not installed")
+    result = subprocess.run(
+        [PDF_RENDERER, "-f", "1", "-l", "1", "-singlefile", "-png",
+         "-scale-to", str(size), "-"],
+        input=data, capture_output=True, timeout=PDF_RENDER_TIMEOUT, check=True,
+    )
+    return result.stdout
+
+
+def render_thumbnail(data: bytes, content_type: str, size: int) -> bytes:
+    """JPEG no larger than ``size`` x ``size``, keeping the aspect ratio"""
+    if content_type == PDF_TYPE:
+        data = render_pdf_page(data, size)
+    with Image.open(io.BytesIO(data)) as source:
+        # JPEG sources decode straight at a reduced scale, much cheaper than full size
+        source.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail((size, size))
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            flattened = Image.new("RGB", image.size, (255, 255, 255))
+            flattened.paste(image, mask=image.getchannel("A"))
+            image = flattened
+        out = io.BytesIO()
+        image.convert("RGB").save(out, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        return out.getvalue()
+
+
+def has_thumbnail(file_doc: Dict[str, Any]) -> bool:
+    return (file_doc.get("thumbnail") or {}).get("status") == ThumbnailStatus.READY.value
+
+
+class ThumbnailPipeline:
+    def __init__(
+        self,
+        files_collection,
+        store,
+        enabled: bool = True,
+        workers: int = 2,
+        size: int = 256,
+        max_source_size: int = 50 * 1024 * 1024,
+        poll_interval: float = 30,
+        claim_timeout: float = 300,
+        on_ready: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+    ):
+        self.files_collection = files_collection
+        self.store = store
+        self.enabled = enabled and Image is not None and workers > 0
+        self.workers = workers
+        self.size = size
+        self.max_source_size = max_source_size
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        # Called with the file once its thumbnail is ready, e.g. to refresh listings
+        self.on_ready = on_ready
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks: List[asyncio.Task] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._in_flight = 0
+        self._counts = {status.value: 0 for status in
+                        (ThumbnailStatus.READY, ThumbnailStatus.FAILED, ThumbnailStatus.UNSUPPORTED)}
+        self._reused = 0
+        self._render_ms: List[float] = []
+
+    def fields(self, content_type: Optional[str], size: int) -> Dict[str, Any]:
+        """Extra file-document fields that queue a thumbnail for a new upload"""
+        if not self.enabled or size > self.max_source_size:
+            return {}
+        if content_type not in IMAGE_TYPES and content_type != PDF_TYPE:
+            return {}
+        return {"thumbnail": {"status": ThumbnailStatus.PENDING.value, "attempts": 0}}
+
+    def notify(self):
+        """Wake idle workers after queueing a thumbnail"""
+        if self._wake is not None:
+            self._wake.set()
+
+    def start(self):
+        if not self.enabled or self._tasks:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="thumbnail")
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def claim_next(self) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=self.claim_timeout)
+        return await self.files_collection.find_one_and_update(
+            {"$or": [
+                {"thumbnail.status": ThumbnailStatus.PENDING.value},
+                {"thumbnail.status": ThumbnailStatus.PROCESSING.value,
+                 "thumbnail.claimed_at": {"$lt": stale},
+                 "thumbnail.attempts": {"$lt": MAX_ATTEMPTS}},
+            ]},
+            {"$set": {"thumbnail.status": ThumbnailStatus.PROCESSING.value, "thumbnail.claimed_at": now},
+             "$inc": {"thumbnail.attempts": 1}},
+            projection=SOURCE_PROJECTION,
+        )
+
+    async def _work(self):
+        while True:
+            try:
+                file_doc = await self.claim_next()
+            except Exception as e:
+                logger.error(f"Thumbnail claim failed: {e}")
+                file_doc = None
+            if file_doc is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.process(file_doc)
+
+    async def _exists(self, key: str) -> bool:
+        try:
+            await run_storage_io(self.store.stat, key)
+            return True
+        except Exception:
+            return False
+
+    async def _render(self, file_doc: Dict[str, Any], target: str):
+        data = await run_storage_io(self.store.read, object_key(file_doc))
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        rendered = await loop.run_in_executor(
+            self._executor, render_thumbnail, data, file_doc["content_type"], self.size
+        )
+        self._render_ms.append((time.perf_counter() - started) * 1000)
+        del self._render_ms[:-1000]
+        await run_storage_io(self.store.put_bytes, target, rendered, content_type="image/jpeg")
+
+    async def process(self, file_doc: Dict[str, Any]) -> ThumbnailStatus:
+        """Render one claimed file's thumbnail and record the outcome"""
+        key = object_key(file_doc)
+        target = thumbnail_key(key)
+        self._in_flight += 1
+        try:
+            # Another file with the same blob may have rendered it already
+            if await self._exists(target):
+                self._reused += 1
+            else:
+                await self._render(file_doc, target)
+            status = ThumbnailStatus.READY
+        except UnsupportedSourceError:
+            status = ThumbnailStatus.UNSUPPORTED
+        except Exception as e:
+            logger.warning(f"Thumbnail for {file_doc['file_id']} failed: {e}")
+            status = ThumbnailStatus.FAILED
+        finally:
+            self._in_flight -= 1
+        self._counts[status.value] += 1
+
+        result = await self.files_collection.update_one(
+            {"_id": file_doc["_id"], "thumbnail.status": ThumbnailStatus.PROCESSING.value},
+            {"$set": {"thumbnail.status": status.value, "thumbnail.updated_at": datetime.utcnow()},
+             "$unset": {"thumbnail.claimed_at": ""}},
+        )
+        if status != ThumbnailStatus.READY:
+            return status
+        if result.matched_count == 0:
+            if not key.startswith(BLOB_PREFIX):
+                # The file was deleted while rendering; nothing else points at this thumbnail
+                await run_storage_io(self.store.remove, target)
+        elif self.on_ready is not None:
+            try:
+                await self.on_ready(file_doc)
+            except Exception as e:
+                logger.warning(f"Thumbnail callback for {file_doc['file_id']} failed: {e}")
+        return status
+
+    def stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {
+            "enabled": self.enabled,
+            "workers": self.workers if self.enabled else 0,
+            "in_flight": self._in_flight,
+            "reused": self._reused,
+            **self._counts,
+        }
+        if self._render_ms:
+            ordered = sorted(self._render_ms)
+            stats["render_ms"] = {
+                "p50": round(ordered[len(ordered) // 2], 1),
+                "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 1),
+                "max": round(ordered[-1], 1),
+            }
+        return stats
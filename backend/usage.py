@@ -0,0 +1,235 @@
+"""Incrementally maintained storage usage rollups.
+
+Every folder document carries ``usage``: ``files``, ``bytes`` and ``folders``
+directly inside it, and ``total_files``, ``total_bytes`` and ``total_folders``
+for everything below it. Per-user totals live in the ``usage`` collection.
+Writers describe what changed with a ``UsageChanges`` and apply it with one
+``$inc`` per touched folder (in one bulk write, along the materialized
+ancestor path) plus one for the user, so nothing ever scans ``files``.
+
+Counters are only trusted where ``tracked`` is set: on folders and users
+created after rollups were introduced, or once they have been rebuilt from
+scratch with ``python usage.py --rebuild``. The rebuild assumes writes are
+quiet while it runs.
+"""
+import argparse
+import asyncio
+import json
+import sys
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+from pymongo import UpdateOne
+
+FIELDS = ("files", "bytes", "folders")
+TOTALS = tuple(f"total_{field}" for field in FIELDS)
+PROJECTION = {"usage": 1}
+
+
+def empty_usage() -> Dict[str, Any]:
+    """``usage`` for a new folder: all zero, and trusted from the start"""
+    return {**{field: 0 for field in FIELDS + TOTALS}, "tracked": True}
+
+
+def folder_chain(folder_doc: Optional[Dict[str, Any]]) -> List[str]:
+    """Folder ids from the top of the tree down to ``folder_doc`` (root: empty)"""
+    if not folder_doc:
+        return []
+    return [a["folder_id"] for a in folder_doc.get("ancestors", [])] + [folder_doc["folder_id"]]
+
+
+def folder_totals(folder_doc: Dict[str, Any]) -> Dict[str, int]:
+    """What a folder weighs in its parent: its contents plus itself"""
+    usage = folder_doc.get("usage") or {}
+    return {
+        "files": usage.get("total_files", 0),
+        "bytes": usage.get("total_bytes", 0),
+        "folders": usage.get("total_folders", 0) + 1,
+    }
+
+
+class UsageChanges:
+    """Accumulated counter deltas, applied in one go by ``apply_usage``"""
+
+    def __init__(self):
+        self.folders: Dict[str, Counter] = defaultdict(Counter)
+        self.user: Counter = Counter()
+
+    def add_item(self, chain: List[str], files: int = 0, bytes: int = 0, folders: int = 0,
+                 count_user: bool = True):
+        """A file or an empty folder enters (positive) or leaves (negative)
+        the folder at the end of ``chain``"""
+        self._add(chain, {"files": files, "bytes": bytes, "folders": folders},
+                  {"files": files, "bytes": bytes, "folders": folders}, count_user)
+
+    def add_subtree(self, chain: List[str], folder_doc: Dict[str, Any], sign: int,
+                    count_user: bool = True):
+        """A folder and everything below it enters (``sign=1``) or leaves
+        (``sign=-1``) the folder at the end of ``chain``"""
+        totals = {field: sign * value for field, value in folder_totals(folder_doc).items()}
+        self._add(chain, {"folders": sign}, totals, count_user)
+
+    def add_removed_subtree(self, chain: List[str], files: int, bytes: int, folders: int,
+                            count_user: bool = True):
+        """A folder was deleted from the folder at the end of ``chain`` along with
+        ``files``, ``bytes`` and ``folders`` (itself included), as counted by the
+        deletion rather than taken from its totals"""
+        self._add(chain, {"folders": -1},
+                  {"files": -files, "bytes": -bytes, "folders": -folders}, count_user)
+
+    def add_removed_contents(self, chain: List[str], files: int, bytes: int, count_user: bool = True):
+        """``files`` and ``bytes`` were deleted from somewhere below the folder at
+        the end of ``chain``, which itself is still there"""
+        self._add(chain, {}, {"files": -files, "bytes": -bytes}, count_user)
+
+    def _add(self, chain: List[str], direct: Dict[str, int], totals: Dict[str, int], count_user: bool):
+        direct = {field: value for field, value in direct.items() if value}
+        totals = {field: value for field, value in totals.items() if value}
+        if chain:
+            self.folders[chain[-1]].update(direct)
+        for folder_id in chain:
+            self.folders[folder_id].update({f"total_{field}": value for field, value in totals.items()})
+        if count_user:
+            self.user.update(totals)
+
+    def folder_ids(self) -> List[str]:
+        return sorted(self.folders)
+
+    def operations(self, user_id: str) -> List[UpdateOne]:
+        operations = []
+        for folder_id in self.folder_ids():
+            inc = {f"usage.{field}": value for field, value in self.folders[folder_id].items() if value}
+            if inc:
+                operations.append(UpdateOne({"user_id": user_id, "folder_id": folder_id}, {"$inc": inc}))
+        return operations
+
+
+def removed_subtrees(folder_docs: List[Dict[str, Any]],
+                     removed: Dict[str, Dict[str, int]]) -> UsageChanges:
+    """Deltas for deleting these folders with everything below them.
+
+    ``removed`` is what ``jobs.delete_subtree`` reports it deleted under each
+    folder, so files and folders that arrived during the deletion count too.
+    It may stop short of the folder itself when the deletion failed partway;
+    the folder then stays, without the files that did go.
+    """
+    roots = {doc["folder_id"] for doc in folder_docs}
+    changes = UsageChanges()
+    for doc in folder_docs:
+        parents = folder_chain(doc)[:-1]
+        if roots.intersection(parents):
+            # Already inside the subtree of another deleted folder
+            continue
+        counts = removed.get(doc["folder_id"]) or {}
+        if counts.get("folders"):
+            changes.add_removed_subtree(
+                parents, counts.get("files", 0), counts.get("bytes", 0), counts["folders"]
+            )
+        elif counts.get("files"):
+            # Failed before reaching the folder itself
+            changes.add_removed_contents(folder_chain(doc), counts["files"], counts.get("bytes", 0))
+        # Otherwise gone before the job reached it; whoever deleted it accounted for it
+    return changes
+
+
+async def apply_usage(folders_collection, usage_collection, user_id: str, changes: UsageChanges):
+    operations = changes.operations(user_id)
+    if operations:
+        await folders_collection.bulk_write(operations, ordered=False)
+    inc = {field: value for field, value in changes.user.items() if value}
+    if inc:
+        await usage_collection.update_one({"_id": user_id}, {"$inc": inc}, upsert=True)
+
+
+async def init_user_usage(usage_collection, user_id: str):
+    """Start a new user's totals at zero, trusted"""
+    await usage_collection.update_one(
+        {"_id": user_id},
+        {"$setOnInsert": {**{field: 0 for field in FIELDS}, "tracked": True}},
+        upsert=True,
+    )
+
+
+def serialize_usage(usage: Optional[Dict[str, Any]], totals_only: bool = False) -> Optional[Dict[str, Any]]:
+    """A folder's totals (and its direct counts); None until its counters are tracked"""
+    if not usage or not usage.get("tracked"):
+        return None
+    serialized = {field: usage.get(f"total_{field}", 0) for field in FIELDS}
+    if not totals_only:
+        serialized["direct"] = {field: usage.get(field, 0) for field in FIELDS}
+    return serialized
+
+
+def serialize_user_usage(usage: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if not usage or not usage.get("tracked"):
+        return None
+    return {field: usage.get(field, 0) for field in FIELDS}
+
+
+async def rebuild_usage(db) -> Dict[str, int]:
+    """Recompute every folder's and user's counters from the files and folders"""
+    direct: Dict[tuple, Counter] = defaultdict(Counter)
+    async for row in await db.files.aggregate([
+        {"$group": {"_id": {"user_id": "$user_id", "folder_id": "$folder_id"},
+                    "files": {"$sum": 1}, "bytes": {"$sum": "$size"}}},
+    ]):
+        key = (row["_id"]["user_id"], row["_id"].get("folder_id") or None)
+        direct[key].update(files=row["files"], bytes=row["bytes"])
+
+    folders: List[Dict[str, Any]] = []
+    async for folder in db.folders.find({}, {"user_id": 1, "folder_id": 1, "parent_folder_id": 1, "ancestors": 1}):
+        folders.append(folder)
+        direct[(folder["user_id"], folder.get("parent_folder_id") or None)]["folders"] += 1
+
+    by_id = {(folder["user_id"], folder["folder_id"]): folder for folder in folders}
+    totals: Dict[tuple, Counter] = defaultdict(Counter)
+    for (user_id, folder_id), counts in direct.items():
+        # Files left in a missing folder only count towards the user
+        chain = folder_chain(by_id.get((user_id, folder_id)))
+        # None stands for the user's whole tree
+        for container in [None, *chain]:
+            totals[(user_id, container)].update(counts)
+
+    operations = []
+    for folder in folders:
+        key = (folder["user_id"], folder["folder_id"])
+        usage = {**{field: direct[key][field] for field in FIELDS},
+                 **{f"total_{field}": totals[key][field] for field in FIELDS},
+                 "tracked": True}
+        operations.append(UpdateOne({"_id": folder["_id"]}, {"$set": {"usage": usage}}))
+    if operations:
+        await db.folders.bulk_write(operations, ordered=False)
+
+    users = {user_id for user_id, _ in totals} | {
+        str(user["_id"]) async for user in db.users.find({}, {"_id": 1})
+    }
+    user_operations = [
+        UpdateOne({"_id": user_id},
+                  {"$set": {**{field: totals[(user_id, None)][field] for field in FIELDS}, "tracked": True}},
+                  upsert=True)
+        for user_id in sorted(users)
+    ]
+    if user_operations:
+        await db.usage.bulk_write(user_operations, ordered=False)
+    return {"folders": len(operations), "users": len(user_operations)}
+
+
+async def main() -> int:
+    from pymongo import AsyncMongoClient
+    from config import settings
+
+    client = AsyncMongoClient(settings.MONGODB_URL)
+    try:
+        print(json.dumps(await rebuild_usage(client[settings.MONGODB_DB_NAME]), indent=2))
+        return 0
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Storage usage rollup maintenance")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="recompute all folder and user usage counters")
+    if not parser.parse_args().rebuild:
+        parser.print_help()
+        sys.exit(0)
+    sys.exit(asyncio.run(main()))
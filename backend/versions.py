@@ -0,0 +1,37 @@
+"""Per-folder listing versions.
+
+Every write that changes what a folder listing returns bumps a counter for that
+(user, folder) in the ``folder_versions`` collection, together with one counter
+per user that covers all of their folders and backs search results. Listings
+derive a weak ETag from the counter, so a client revalidating an unchanged
+folder gets a 304 before any listing query runs.
+
+Listings read the version before their data and writers bump after writing, so
+an ETag can be older than the data it was sent with but never newer: at worst
+a client refetches a page it already had.
+"""
+from typing import Iterable, Optional
+from pymongo import UpdateOne
+
+ROOT = ""
+ALL_FOLDERS = "*"
+
+
+def version_key(user_id: str, folder_id: Optional[str]) -> str:
+    # Root items are stored with a folder_id of None or ""
+    return f"{user_id}/{folder_id or ROOT}"
+
+
+async def bump_versions(versions_collection, user_id: str, folder_ids: Iterable[Optional[str]]):
+    """Invalidate the listings of ``folder_ids`` (and the user's search results)"""
+    keys = {version_key(user_id, folder_id) for folder_id in folder_ids}
+    keys.add(version_key(user_id, ALL_FOLDERS))
+    await versions_collection.bulk_write(
+        [UpdateOne({"_id": key}, {"$inc": {"version": 1}}, upsert=True) for key in sorted(keys)],
+        ordered=False,
+    )
+
+
+async def folder_version(versions_collection, user_id: str, folder_id: Optional[str]) -> int:
+    doc = await versions_collection.find_one({"_id": version_key(user_id, folder_id)})
+    return doc["version"] if doc else 0
@@ -196,6 +196,19 @@ export const api = {
     document.body.removeChild(a);
   },
 
+  // Get a file's thumbnail as an object URL (revoke it when done)
+  async getThumbnailUrl(fileId) {
+    const response = await fetch(`${API_BASE_URL}/api/files/${fileId}/thumbnail`, {
+      headers: getAuthHeaders()
+    });
+
+    if (!response.ok) {
+      throw new Error('Thumbnail not available');
+    }
+
+    return window.URL.createObjectURL(await response.blob());
+  },
+
   // Update file name
   async updateFile(fileId, data) {
     const response = await fetch(`${API_BASE_URL}/api/files/${fileId}`, {